@@ -3,6 +3,8 @@ from qdrant_client import QdrantClient
 from sqlalchemy.orm import Session
 from app.db.session import SessionLocal
 from app.core.lifespan import get_qdrant_client
+from app.services import embedding_cache, llm_output_cache
+from app.services.query_vector_cache import query_vector_cache
 
 router = APIRouter()
 
@@ -46,4 +48,15 @@ async def health_check(
             "postgresql_db": db_status,
             "qdrant_vector_db": qdrant_status
         }
+    }
+
+@router.get("/health/cache-stats", tags=["Health"])
+def cache_stats(db: Session = Depends(get_db)):
+    """
+    返回 Embedding 缓存、查询向量缓存和 LLM 输出缓存的命中率与条目数，用于评估缓存容量。
+    """
+    return {
+        "embedding_cache": embedding_cache.get_stats(db),
+        "query_vector_cache": query_vector_cache.get_stats(),
+        "llm_output_cache": llm_output_cache.get_stats(db)
     }
\ No newline at end of file
@@ -1,20 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, File, UploadFile
+from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, File, UploadFile, Query, Request
 from sqlalchemy.orm import Session
-from qdrant_client import QdrantClient
+from qdrant_client import QdrantClient, AsyncQdrantClient
 from typing import List
 import logging
 from app.schemas.knowledgebase import ( # (!! 修改这个 import !!)
-    KnowledgeBase, KnowledgeBaseCreate, KnowledgeBaseUpdate, 
+    KnowledgeBase, KnowledgeBaseCreate, KnowledgeBaseUpdate, StorageProfileUpdate,
     StartParsingRequest, GenerateSummaryRequest, 
-    GenerateGraphRequest  # <-- (1) 添加 GenerateGraphRequest
+    GenerateGraphRequest,  # <-- (1) 添加 GenerateGraphRequest
+    GraphNeighborhoodResponse, GraphPathResponse,
+    UploadSessionCreate, UploadCommitRequest, UploadSession
 )
 from app.services import ( # (!! 修改这个 import !!)
     kb_service, generation_service, 
-    kg_service  # <-- (2) 添加 kg_service
+    kg_service,  # <-- (2) 添加 kg_service
+    graph_store, upload_service
 )
 from app.crud import crud_model, crud_knowledgebase
 from app.api.endpoints.health import get_db # 重用 get_db
-from app.core.lifespan import get_qdrant_client # 重用 get_qdrant_client
+from app.core.lifespan import get_qdrant_client, get_async_qdrant_client # 重用 get_qdrant_client
 from app.db.session import SessionLocal # 导入 SessionLocal 用于后台任务
 from app.schemas.knowledgebase import KnowledgeBase as KnowledgeBaseSchema
 router = APIRouter()
@@ -46,6 +49,9 @@ def convert_sqlalchemy_to_pydantic(db_obj) -> KnowledgeBaseSchema:
     _status = db_obj.status
     _parsing_state = db_obj.parsing_state
     _source_file_path = db_obj.source_file_path
+    _source_content_hash = db_obj.source_content_hash
+    _storage_profile = db_obj.storage_profile
+    _vector_collection = db_obj.vector_collection
     
     # 从数据库对象中读取新的 'kb_type' 字段
     _kb_type = db_obj.kb_type 
@@ -68,7 +74,10 @@ def convert_sqlalchemy_to_pydantic(db_obj) -> KnowledgeBaseSchema:
             
             status=_status,
             parsing_state=_parsing_state,
-            source_file_path=_source_file_path
+            source_file_path=_source_file_path,
+            source_content_hash=_source_content_hash,
+            storage_profile=_storage_profile,
+            vector_collection=_vector_collection
         )
         print("Pydantic object created successfully.")
         print("-------------------------------------------------------")
@@ -147,6 +156,25 @@ def update_kb(
         raise HTTPException(status_code=404, detail="KnowledgeBase not found")
     return db_kb
 
+@router.put(
+    "/{id}/storage-profile",
+    response_model=KnowledgeBase,
+    summary="[KB Store] 设置知识库的向量存储配置 (量化 / 磁盘存储 / HNSW 参数)，已有集合原地迁移"
+)
+def update_storage_profile(
+    id: int,
+    request: StorageProfileUpdate,
+    db: Session = Depends(get_db),
+    qdrant: QdrantClient = Depends(get_qdrant_client)
+):
+    try:
+        db_kb = kb_service.set_storage_profile(db, qdrant, id, request.storage_profile)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if db_kb is None:
+        raise HTTPException(status_code=404, detail="KnowledgeBase not found")
+    return convert_sqlalchemy_to_pydantic(db_kb)
+
 @router.delete(
     "/{id}",
     status_code=status.HTTP_204_NO_CONTENT,
@@ -172,13 +200,16 @@ def delete_kb(
     response_model=KnowledgeBaseSchema,
     summary="[KB Store] 上传知识库的源文件"
 )
-def upload_kb_file(
+async def upload_kb_file(
     id: int,
     file: UploadFile = File(...),
     db: Session = Depends(get_db)
 ):
+    """
+    一次性上传 (适合小文件)。大文件请使用下面的可续传分块上传接口。
+    """
     try:
-        updated_kb_sqlalchemy = kb_service.save_kb_file(db, kb_id=id, file=file)
+        updated_kb_sqlalchemy = await kb_service.save_kb_file(db, kb_id=id, file=file)
         if updated_kb_sqlalchemy is None:
             raise HTTPException(status_code=404, detail="KnowledgeBase not found")
 
@@ -203,6 +234,96 @@ def upload_kb_file(
     except Exception as e:
         logger.error(f"Upload failed for KB {id}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
+
+
+# --- 可续传分块上传 ---
+def _get_upload_session(db: Session, id: int, upload_id: str):
+    upload = upload_service.get_session(db, id, upload_id)
+    if upload is None:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return upload
+
+
+@router.post(
+    "/{id}/uploads",
+    response_model=UploadSession,
+    status_code=status.HTTP_201_CREATED,
+    summary="[KB Store] 创建可续传的分块上传会话"
+)
+def create_upload_session(id: int, request: UploadSessionCreate, db: Session = Depends(get_db)):
+    try:
+        upload = upload_service.create_session(db, id, request.filename, request.total_size)
+    except upload_service.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if upload is None:
+        raise HTTPException(status_code=404, detail="KnowledgeBase not found")
+    return upload
+
+
+@router.get(
+    "/{id}/uploads/{upload_id}",
+    response_model=UploadSession,
+    summary="[KB Store] 查询上传会话 (断点续传时获取 offset)"
+)
+def read_upload_session(id: int, upload_id: str, db: Session = Depends(get_db)):
+    return _get_upload_session(db, id, upload_id)
+
+
+@router.put(
+    "/{id}/uploads/{upload_id}",
+    response_model=UploadSession,
+    summary="[KB Store] 追加一个分块 (请求体为原始字节)"
+)
+async def upload_chunk(
+    id: int,
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0, description="分块起始字节，必须等于服务端已接收的字节数"),
+    db: Session = Depends(get_db)
+):
+    """
+    offset 不一致时返回 409 (detail 中带服务端的 offset)；超出大小上限时返回 413。
+    """
+    upload = _get_upload_session(db, id, upload_id)
+    content_length = request.headers.get("content-length")
+    try:
+        return await upload_service.append_chunk(
+            db, upload, offset, request.stream(),
+            content_length=int(content_length) if content_length and content_length.isdigit() else None
+        )
+    except upload_service.UploadOffsetMismatch as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "offset": e.expected_offset})
+    except upload_service.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post(
+    "/{id}/uploads/{upload_id}/commit",
+    response_model=KnowledgeBaseSchema,
+    summary="[KB Store] 完成上传并设为知识库的源文件"
+)
+async def commit_upload(id: int, upload_id: str, request: UploadCommitRequest, db: Session = Depends(get_db)):
+    upload = _get_upload_session(db, id, upload_id)
+    try:
+        db_kb = await upload_service.commit_upload(db, upload, expected_sha256=request.sha256)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if db_kb is None:
+        raise HTTPException(status_code=404, detail="KnowledgeBase not found")
+    return convert_sqlalchemy_to_pydantic(db_kb)
+
+
+@router.delete(
+    "/{id}/uploads/{upload_id}",
+    response_model=UploadSession,
+    summary="[KB Store] 放弃上传会话并删除已接收的数据"
+)
+def abort_upload(id: int, upload_id: str, db: Session = Depends(get_db)):
+    return upload_service.abort_upload(db, _get_upload_session(db, id, upload_id))
     
     
     
@@ -215,7 +336,6 @@ def upload_kb_file(
 def start_parsing(
     id: int,
     parse_request: StartParsingRequest,
-    background_tasks: BackgroundTasks, # FastAPI 注入
     db: Session = Depends(get_db),
     qdrant: QdrantClient = Depends(get_qdrant_client)
 ):
@@ -223,15 +343,15 @@ def start_parsing(
     (startParsing) 触发知识摄取管道。
     """
     try:
-        # (!! 关键修复 !!) 调用 service 层函数，并传递 background_tasks
+        # 调用 service 层函数，任务写入持久化队列，由 worker 进程执行
         db_kb = kb_service.start_kb_parsing(
             db=db,
             qdrant=qdrant,
             kb_id=id,
             embedding_model_id=parse_request.embedding_model_id,
-            background_tasks=background_tasks # <-- 传递下去
+            incremental=parse_request.incremental
         )
-        # Service 层内部已经处理了 background task 的添加和状态更新
+        # Service 层内部已经处理了任务入队和状态更新
 
         if db_kb is None:
             # Service 层如果返回 None 通常意味着 KB 未找到或准备失败
@@ -281,7 +401,7 @@ async def generate_l2a_summary(
     request: GenerateSummaryRequest,
     # background_tasks: BackgroundTasks, # <-- (!! 移除 !!) 不再需要后台任务
     db: Session = Depends(get_db),
-    qdrant: QdrantClient = Depends(get_qdrant_client)
+    qdrant: AsyncQdrantClient = Depends(get_async_qdrant_client)
 ):
     """
     (RAG 循环 B) (已修复为混合架构)
@@ -302,7 +422,8 @@ async def generate_l2a_summary(
             db=db,
             qdrant=qdrant,
             parent_kb=parent_kb,
-            generation_model=generation_model
+            generation_model=generation_model,
+            mode=request.mode
         )
         logger.info(f"[KB {id}] Generation service 完成。新的 L2a KB ID: {new_sub_kb.id}")
 
@@ -366,7 +487,8 @@ async def generate_l2b_graph( # (1) <-- 关键修复：改回 async def
         new_sub_kb = await kg_service.generate_graph_pipeline(
             db=db,
             parent_kb=parent_kb,
-            generation_model=generation_model
+            generation_model=generation_model,
+            extractor=request.extractor
         )
         logger.info(f"[KB {id}] KG service 完成。新的 L2b KB ID: {new_sub_kb.id}")
 
@@ -386,4 +508,54 @@ async def generate_l2b_graph( # (1) <-- 关键修复：改回 async def
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Generate graph failed for KB {id}: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
+
+
+def _get_indexed_graph_kb(db: Session, id: int):
+    """ 解析 L2b 图谱 KB (旧版只有 JSON 的图谱在此时导入索引表) """
+    graph_kb = graph_store.resolve_graph_kb(db, id)
+    if graph_kb is None:
+        raise HTTPException(status_code=404, detail="Knowledge graph not found for this KnowledgeBase.")
+    if not graph_store.ensure_indexed(db, graph_kb):
+        raise HTTPException(status_code=404, detail="Knowledge graph is empty or its data is missing.")
+    return graph_kb
+
+
+@router.get(
+    "/{id}/graph/neighborhood",
+    response_model=GraphNeighborhoodResponse,
+    summary="[KB Store] (L2b) 查询实体的 k 跳邻域子图"
+)
+def read_graph_neighborhood(
+    id: int,
+    entity: List[str] = Query(..., description="种子实体名 (可重复传入多个)"),
+    hops: int = Query(1, ge=1, le=4),
+    limit: int = Query(200, ge=1, le=5000, description="最多返回的边数"),
+    db: Session = Depends(get_db)
+):
+    """
+    id 可以是 L2b 图谱 KB，也可以是它的父 KB。
+    """
+    graph_kb = _get_indexed_graph_kb(db, id)
+    result = graph_store.get_neighborhood(db, graph_kb.id, entity, hops=hops, max_edges=limit)
+    return GraphNeighborhoodResponse(graph_kb_id=graph_kb.id, **result)
+
+
+@router.get(
+    "/{id}/graph/path",
+    response_model=GraphPathResponse,
+    summary="[KB Store] (L2b) 查询两个实体之间的最短路径"
+)
+def read_graph_path(
+    id: int,
+    source: str,
+    target: str,
+    max_hops: int = Query(4, ge=1, le=8),
+    db: Session = Depends(get_db)
+):
+    """
+    忽略边的方向做广度优先搜索；路径上的边保持原始方向返回。
+    """
+    graph_kb = _get_indexed_graph_kb(db, id)
+    edges = graph_store.find_path(db, graph_kb.id, source, target, max_hops=max_hops)
+    return GraphPathResponse(graph_kb_id=graph_kb.id, found=edges is not None, edges=edges or [])
@@ -1,12 +1,13 @@
 # app/api/endpoints/rag.py
-from fastapi import APIRouter, Depends, HTTPException, logger
+from fastapi import APIRouter, Depends, HTTPException, Request, logger
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from qdrant_client import QdrantClient
+from qdrant_client import AsyncQdrantClient
 
 from app.schemas.rag import RagQueryRequest, RagQueryResponse, RagRetrieveRequest, RagRetrieveResponse
-from app.services.rag_service import generate_rag_response, retrieve_contexts_only
+from app.services.rag_service import generate_rag_response, retrieve_contexts_only, prepare_rag_query, stream_rag_answer
 from app.api.endpoints.health import get_db # 复用
-from app.core.lifespan import get_qdrant_client # 复用
+from app.core.lifespan import get_async_qdrant_client # 复用
 
 router = APIRouter()
 
@@ -18,7 +19,7 @@ router = APIRouter()
 async def execute_rag_query(
     request: RagQueryRequest,
     db: Session = Depends(get_db),
-    qdrant: QdrantClient = Depends(get_qdrant_client)
+    qdrant: AsyncQdrantClient = Depends(get_async_qdrant_client)
 ):
     """
     (前端 '生成' 按钮调用)
@@ -38,6 +39,48 @@ async def execute_rag_query(
         logger.error(f"RAG query failed: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error during RAG query: {e}")
 
+@router.post(
+    "/query/stream",
+    summary="[RAG] 执行RAG查询并以 SSE 流式返回答案"
+)
+async def execute_rag_query_stream(
+    request: RagQueryRequest,
+    http_request: Request,
+    db: Session = Depends(get_db),
+    qdrant: AsyncQdrantClient = Depends(get_async_qdrant_client)
+):
+    """
+    与 /query 相同的 RAG 流程，但以 Server-Sent Events 返回:
+    先发送检索到的上下文 (event: contexts)，再逐段转发生成的文本 (event: token)，
+    最后发送 event: done (或 event: error)。客户端断开时会中止上游生成。
+    """
+    try:
+        # 检索在开始推流前完成，这样参数错误仍以普通 HTTP 错误返回
+        gen_model_details, retrieval = await prepare_rag_query(db=db, qdrant=qdrant, request=request)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as e:
+        logger.error(f"RAG stream query failed: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Internal server error during RAG query: {e}")
+
+    async def event_stream():
+        events = stream_rag_answer(request, gen_model_details, retrieval)
+        try:
+            async for event in events:
+                if await http_request.is_disconnected():
+                    logger.info("RAG stream: client disconnected, cancelling generation.")
+                    break
+                yield event
+        finally:
+            # 关闭生成器 -> 关闭上游 HTTP 流
+            await events.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post(
     "/retrieve",
     response_model=RagRetrieveResponse,
@@ -46,7 +89,7 @@ async def execute_rag_query(
 async def retrieve_contexts_only_endpoint(
     request: RagRetrieveRequest,
     db: Session = Depends(get_db),
-    qdrant: QdrantClient = Depends(get_qdrant_client)
+    qdrant: AsyncQdrantClient = Depends(get_async_qdrant_client)
 ):
     """
     (新增) 只执行检索，不调用生成模型
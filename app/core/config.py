@@ -1,3 +1,4 @@
+from typing import Dict, List
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -15,6 +16,82 @@ class Settings(BaseSettings):
     POSTGRES_PASSWORD: str
     POSTGRES_DB: str
 
+    # Embedding 调度: 每个嵌入端点同时在途的批次数上限
+    EMBEDDING_MAX_CONCURRENCY: int = 4
+    # 按 endpoint_url 单独覆盖并发上限, 例如 {"http://localhost:11434/v1": 1}
+    EMBEDDING_ENDPOINT_CONCURRENCY: Dict[str, int] = {}
+
+    # 持久化 Embedding 缓存 (embedding_cache 表)，按 LRU 淘汰
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 500_000
+
+    # 持久化 LLM 输出缓存 (llm_output_cache 表: 文件摘要、知识图谱三元组)，按总字节数 LRU 淘汰
+    LLM_OUTPUT_CACHE_ENABLED: bool = True
+    LLM_OUTPUT_CACHE_MAX_BYTES: int = 256 * 1024 * 1024
+
+    # RAG 查询向量的进程内 LRU 缓存 (按 模型/维度/规范化查询 缓存，过期后重新嵌入)
+    QUERY_VECTOR_CACHE_ENABLED: bool = True
+    QUERY_VECTOR_CACHE_MAX_ENTRIES: int = 2048
+    QUERY_VECTOR_CACHE_TTL_SECONDS: float = 600.0
+
+    # RAG 提示词中上下文的默认 token 预算 (模型行上的 context_token_budget 优先)
+    RAG_CONTEXT_TOKEN_BUDGET: int = 6000
+
+    # RAG 重排序: 每个集合过采样 top_k * RAG_RERANK_OVERFETCH 个候选，重排序后再截取 top_k
+    RAG_RERANK_ENABLED: bool = True
+    RAG_RERANK_OVERFETCH: int = 5
+
+    # L2a 摘要提示词中最多放入的知识图谱边数 (从 graph_edges 表取相关子图)
+    GRAPH_SUMMARY_MAX_EDGES: int = 300
+
+    # 图谱扩展检索 (请求中 graph_expansion_hops > 0 时): 邻域最多展开的边数、最多追加的代码块数
+    GRAPH_EXPANSION_MAX_EDGES: int = 200
+    GRAPH_EXPANSION_MAX_CHUNKS: int = 6
+
+    # 上传: 单个源文件大小上限；可续传上传会话多久没有新分块后过期
+    UPLOAD_MAX_BYTES: int = 10 * 1024 * 1024 * 1024
+    UPLOAD_SESSION_TTL_SECONDS: int = 24 * 3600
+
+    # L2 管道 (知识图谱、分层摘要) 读取的单个源文件大小上限 (压缩包成员在解压前按头信息判断)
+    SOURCE_FILE_MAX_BYTES: int = 2 * 1024 * 1024
+
+    # Qdrant 集合的默认存储配置 (见 app/services/vector_store.py 的 STORAGE_PROFILES)，KB 可单独指定
+    VECTOR_STORAGE_PROFILE: str = "default"
+    # per_kb = 每个 KB 一个集合 kb_{id}；shared = 同一嵌入模型的 KB 共用一个集合，按 kb_id payload 分区 (适合大量小 KB)
+    VECTOR_COLLECTION_MODE: str = "per_kb"
+
+    # 摄取前的语料过滤 (见 app/services/corpus_filter.py): vendor 目录、锁文件、压缩/生成代码、二进制文件、超大文件
+    INGESTION_FILTER_ENABLED: bool = True
+    INGESTION_MAX_FILE_BYTES: int = 2 * 1024 * 1024
+    INGESTION_RESPECT_GITIGNORE: bool = True           # 遵循源码树中的 .gitignore
+    INGESTION_EXCLUDE_PATTERNS: List[str] = []         # 额外的 gitignore 风格规则, 例如 ["*.snap", "docs/api/"]
+    INGESTION_MINIFIED_AVG_LINE_LENGTH: int = 300      # js/css/json 文件开头的平均行长 (字符) 超过该值视为压缩代码
+
+    # 摄取时并行切分文档的进程数 (0 = 每个 CPU 核心一个, 1 = 不使用进程池)
+    INGESTION_SPLIT_WORKERS: int = 0
+
+    # 摄取任务队列 (ingestion_jobs 表) 与 worker 进程 (python -m app.worker)
+    INGESTION_WORKER_CONCURRENCY: int = 2      # 每个 worker 进程同时执行的任务数
+    INGESTION_JOB_MAX_ATTEMPTS: int = 3
+    INGESTION_JOB_LEASE_SECONDS: int = 120
+    INGESTION_JOB_HEARTBEAT_SECONDS: int = 30
+    INGESTION_JOB_RETRY_BASE_SECONDS: float = 30.0 # 第 n 次重试等待 base * 2^(n-1) 秒
+    INGESTION_WORKER_POLL_SECONDS: float = 2.0
+
+    # 生成模型调用限流 (见 app/core/llm_throttle.py)，按模型名覆盖
+    LLM_MAX_CONCURRENCY: int = 4                   # 每个生成模型同时在途的请求数
+    LLM_MODEL_CONCURRENCY: Dict[str, int] = {}
+    LLM_RATE_LIMIT_RPM: int = 0                    # 每分钟请求数上限 (0 = 不限速)
+    LLM_MODEL_RATE_LIMIT_RPM: Dict[str, int] = {}
+    LLM_RETRY_MAX_ATTEMPTS: int = 5                # 429/503 时的最大尝试次数
+    LLM_RETRY_BASE_SECONDS: float = 2.0            # 退避基数 (带随机抖动)
+
+    # OpenAI 兼容客户端连接池 (见 app/core/llm_clients.py)
+    LLM_HTTP_MAX_CONNECTIONS: int = 100
+    LLM_HTTP_MAX_KEEPALIVE: int = 20
+    LLM_HTTP_KEEPALIVE_EXPIRY: float = 60.0
+    LLM_HTTP_TIMEOUT: float = 600.0                # 与 openai 客户端默认值一致: 长文档摘要等慢请求不应被提前中断
+
     @property
     def SQLALCHEMY_DATABASE_URI(self) -> str:
         """ 构造异步 PostgreSQL 连接字符串 """
@@ -2,11 +2,13 @@ import time
 import logging
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from qdrant_client import QdrantClient
+from qdrant_client import QdrantClient, AsyncQdrantClient
 from qdrant_client.http.models import Distance, VectorParams
 from app.core.config import settings
-from app.db.session import init_db
+from app.db.session import init_db, SessionLocal
 from app.services.kb_service import UPLOADS_DIR
+from app.core.llm_clients import close_openai_clients
+from app.services.job_queue import recover_orphaned_kbs
 
 
 # 配置日志
@@ -15,6 +17,8 @@ logger = logging.getLogger(__name__)
 
 # 全局客户端实例，将在 lifespan 中初始化
 qdrant_db = None
+# 检索路径使用的异步客户端 (不阻塞事件循环)
+async_qdrant_db = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -55,6 +59,9 @@ async def lifespan(app: FastAPI):
                 raise
             time.sleep(retry_wait)
 
+    global async_qdrant_db
+    async_qdrant_db = AsyncQdrantClient(host=settings.QDRANT_HOST, port=settings.QDRANT_PORT)
+
     # 2. (新增) 初始化关系型数据库 (创建表)
     try:
         init_db()
@@ -62,6 +69,18 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.error(f"关系型数据库初始化失败: {e}")
         raise
+
+    # 3. 恢复卡在 'processing' 但已没有摄取任务的知识库 (重新入队，由 worker 执行)
+    db = SessionLocal()
+    try:
+        recovered = recover_orphaned_kbs(db)
+        if recovered:
+            logger.info(f"已恢复 {recovered} 个中断的知识库解析任务。")
+    except Exception as e:
+        logger.error(f"恢复中断的解析任务失败: {e}")
+        db.rollback()
+    finally:
+        db.close()
 #    而不是在文件被导入时运行，从而避免了重载循环
     try:
         UPLOADS_DIR.mkdir(exist_ok=True)
@@ -76,10 +95,19 @@ async def lifespan(app: FastAPI):
     logger.info("FastAPI 应用关闭...")
     # (如果需要，可以在此关闭连接池等)
     qdrant_db.close()
+    await async_qdrant_db.close()
     logger.info("Qdrant 连接已关闭。")
+    await close_openai_clients()
+    logger.info("LLM 客户端连接池已关闭。")
 
 
 def get_qdrant_client():
     """ 依赖项，用于在 API 端点中获取 Qdrant 客户端 """
     global qdrant_db
-    return qdrant_db
\ No newline at end of file
+    return qdrant_db
+
+
+def get_async_qdrant_client():
+    """ 依赖项，用于在异步检索端点中获取 AsyncQdrantClient """
+    global async_qdrant_db
+    return async_qdrant_db
\ No newline at end of file
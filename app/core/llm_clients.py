@@ -0,0 +1,65 @@
+# app/core/llm_clients.py
+
+import asyncio
+import logging
+import threading
+import weakref
+from typing import Dict, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# (endpoint_url, api_key, model_type) -> AsyncOpenAI
+ClientKey = Tuple[str, str, str]
+
+# httpx 连接池绑定在创建它的事件循环上，因此按事件循环分组缓存客户端:
+# API 进程的主循环上的客户端常驻复用，后台摄取线程的循环结束时由调用方关闭自己的那一组。
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[ClientKey, AsyncOpenAI]]" = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def _build_client(endpoint_url: str, api_key: str) -> AsyncOpenAI:
+    http_client = DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=settings.LLM_HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(settings.LLM_HTTP_TIMEOUT, connect=10.0),
+    )
+    return AsyncOpenAI(api_key=api_key, base_url=endpoint_url, http_client=http_client)
+
+
+def get_openai_client(endpoint_url: Optional[str], api_key: Optional[str], model_type: str) -> AsyncOpenAI:
+    """
+    获取 (endpoint_url, api_key, model_type) 对应的常驻 AsyncOpenAI 客户端。
+    必须在事件循环内调用。
+    """
+    loop = asyncio.get_running_loop()
+    key = (endpoint_url or "", api_key or "", model_type)
+    with _lock:
+        loop_clients = _clients.setdefault(loop, {})
+        client = loop_clients.get(key)
+        if client is None:
+            client = _build_client(endpoint_url, api_key)
+            loop_clients[key] = client
+            logger.info(f"Created pooled AsyncOpenAI client for '{endpoint_url}' ({model_type}).")
+    return client
+
+
+async def close_openai_clients() -> None:
+    """ 关闭当前事件循环上创建的所有客户端 (应用关闭或后台循环结束时调用) """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        loop_clients = _clients.pop(loop, {})
+    for (endpoint_url, _, model_type), client in loop_clients.items():
+        try:
+            await client.close()
+        except Exception as e:
+            logger.warning(f"Failed to close AsyncOpenAI client for '{endpoint_url}' ({model_type}): {e}")
+    if loop_clients:
+        logger.info(f"Closed {len(loop_clients)} pooled AsyncOpenAI client(s).")
@@ -0,0 +1,118 @@
+# app/core/llm_throttle.py
+
+import asyncio
+import logging
+import random
+import threading
+import time
+import weakref
+from typing import Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+import openai
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 视为可重试的限流/过载状态码
+RETRYABLE_STATUS_CODES = {429, 503}
+
+
+class TokenBucket:
+    """ 异步令牌桶: 平均速率 rate_per_second，允许 capacity 大小的突发 """
+
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate = rate_per_second
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ModelThrottle:
+    """ 单个生成模型的并发上限 (信号量) + 请求速率上限 (令牌桶，可选) """
+
+    def __init__(self, concurrency: int, requests_per_minute: int):
+        self.concurrency = max(1, concurrency)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._bucket = TokenBucket(requests_per_minute / 60.0, min(requests_per_minute, self.concurrency)) if requests_per_minute > 0 else None
+
+    async def __aenter__(self):
+        await self._semaphore.acquire()
+        if self._bucket is not None:
+            try:
+                await self._bucket.acquire()
+            except BaseException:
+                self._semaphore.release()
+                raise
+        return self
+
+    async def __aexit__(self, *exc):
+        self._semaphore.release()
+        return False
+
+
+# 与 llm_clients 相同: 信号量/锁属于事件循环，按循环分组
+_throttles: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[str, str], ModelThrottle]]" = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def get_model_throttle(endpoint_url: Optional[str], model_name: str) -> ModelThrottle:
+    """ 同一 (endpoint, 模型) 的所有调用共享一个限流器 (必须在事件循环内调用) """
+    loop = asyncio.get_running_loop()
+    key = (endpoint_url or "", model_name)
+    with _lock:
+        loop_throttles = _throttles.setdefault(loop, {})
+        throttle = loop_throttles.get(key)
+        if throttle is None:
+            throttle = ModelThrottle(
+                concurrency=settings.LLM_MODEL_CONCURRENCY.get(model_name, settings.LLM_MAX_CONCURRENCY),
+                requests_per_minute=settings.LLM_MODEL_RATE_LIMIT_RPM.get(model_name, settings.LLM_RATE_LIMIT_RPM)
+            )
+            loop_throttles[key] = throttle
+    return throttle
+
+
+def _retry_after_seconds(error: openai.APIStatusError) -> Optional[float]:
+    try:
+        value = error.response.headers.get("retry-after")
+        return float(value) if value else None
+    except (AttributeError, ValueError):
+        return None
+
+
+async def call_with_retry(throttle: ModelThrottle, fn: Callable[[], Awaitable[T]], description: str = "LLM call") -> T:
+    """
+    在限流器内执行 fn，遇到 429/503 时按带抖动的指数退避重试 (等待期间不占用并发名额)。
+    其他错误直接抛出。fn 使用的客户端应关闭 SDK 自带的重试 (client.with_options(max_retries=0))，
+    否则 SDK 会在持有并发名额、绕过令牌桶的情况下自行重试。
+    """
+    max_attempts = max(1, settings.LLM_RETRY_MAX_ATTEMPTS)
+    for attempt in range(1, max_attempts + 1):
+        try:
+            async with throttle:
+                return await fn()
+        except openai.APIStatusError as e:
+            if e.status_code not in RETRYABLE_STATUS_CODES or attempt == max_attempts:
+                raise
+            retry_after = _retry_after_seconds(e)
+            if retry_after:
+                delay = retry_after * random.uniform(1.0, 1.2)
+            else:
+                delay = settings.LLM_RETRY_BASE_SECONDS * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+            logger.warning(f"{description}: HTTP {e.status_code}, retrying in {delay:.1f}s (attempt {attempt}/{max_attempts}).")
+            await asyncio.sleep(delay)
+    raise RuntimeError("unreachable")
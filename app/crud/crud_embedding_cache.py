@@ -0,0 +1,49 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import func, select, delete, update
+from sqlalchemy.dialects.postgresql import insert
+from app.models.embedding_cache import EmbeddingCacheEntry
+from typing import Dict, List
+
+
+def get_entries(db: Session, cache_keys: List[str]) -> Dict[str, EmbeddingCacheEntry]:
+    """ 按键批量获取缓存条目 """
+    if not cache_keys:
+        return {}
+    rows = db.query(EmbeddingCacheEntry).filter(EmbeddingCacheEntry.cache_key.in_(cache_keys)).all()
+    return {row.cache_key: row for row in rows}
+
+def touch_entries(db: Session, cache_keys: List[str]) -> None:
+    """ 刷新命中条目的 last_used_at (LRU) """
+    if not cache_keys:
+        return
+    db.execute(
+        update(EmbeddingCacheEntry)
+        .where(EmbeddingCacheEntry.cache_key.in_(cache_keys))
+        .values(last_used_at=func.now())
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+def insert_entries(db: Session, entries: List[dict]) -> None:
+    """ 批量写入条目，键已存在时忽略 (并发写同一文本时不报错) """
+    if not entries:
+        return
+    stmt = insert(EmbeddingCacheEntry).values(entries).on_conflict_do_nothing(index_elements=["cache_key"])
+    db.execute(stmt)
+    db.commit()
+
+def count_entries(db: Session) -> int:
+    return db.scalar(select(func.count()).select_from(EmbeddingCacheEntry)) or 0
+
+def delete_least_recently_used(db: Session, n: int) -> int:
+    """ 删除最久未使用的 n 个条目，返回删除数量 """
+    if n <= 0:
+        return 0
+    oldest = select(EmbeddingCacheEntry.cache_key).order_by(EmbeddingCacheEntry.last_used_at.asc()).limit(n)
+    result = db.execute(
+        delete(EmbeddingCacheEntry)
+        .where(EmbeddingCacheEntry.cache_key.in_(oldest))
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount or 0
@@ -0,0 +1,80 @@
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+from app.models.graph import GraphEntity, GraphEdge
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+WRITE_BATCH = 1000
+
+
+def clear_graph(db: Session, kb_id: int) -> None:
+    db.query(GraphEdge).filter(GraphEdge.kb_id == kb_id).delete(synchronize_session=False)
+    db.query(GraphEntity).filter(GraphEntity.kb_id == kb_id).delete(synchronize_session=False)
+    db.commit()
+
+def replace_graph(db: Session, kb_id: int, triplets: Iterable[Tuple[str, str, str]]) -> Tuple[int, int]:
+    """ 用三元组整体替换某个图谱 KB 的实体和边。返回 (实体数, 边数) """
+    clear_graph(db, kb_id)
+    edges = list(dict.fromkeys(triplets))
+    names = list(dict.fromkeys(name for s, _, o in edges for name in (s, o)))
+
+    for i in range(0, len(names), WRITE_BATCH):
+        stmt = insert(GraphEntity).values([{"kb_id": kb_id, "name": n} for n in names[i:i + WRITE_BATCH]])
+        db.execute(stmt.on_conflict_do_nothing(constraint="uq_graph_entity_name"))
+    ids = dict(db.query(GraphEntity.name, GraphEntity.id).filter(GraphEntity.kb_id == kb_id).all())
+
+    rows = [{"kb_id": kb_id, "source_id": ids[s], "relation": r, "target_id": ids[o]} for s, r, o in edges]
+    for i in range(0, len(rows), WRITE_BATCH):
+        stmt = insert(GraphEdge).values(rows[i:i + WRITE_BATCH])
+        db.execute(stmt.on_conflict_do_nothing(constraint="uq_graph_edge"))
+    db.commit()
+    return len(ids), len(rows)
+
+def count_entities(db: Session, kb_id: int) -> int:
+    return db.query(func.count(GraphEntity.id)).filter(GraphEntity.kb_id == kb_id).scalar() or 0
+
+def has_entities(db: Session, kb_id: int) -> bool:
+    """ 比 count_entities 便宜: 只需找到一行 """
+    return db.query(GraphEntity.id).filter(GraphEntity.kb_id == kb_id).first() is not None
+
+def get_entity_ids(db: Session, kb_id: int, names: List[str]) -> Dict[str, int]:
+    """ 按名称精确查找实体 """
+    if not names:
+        return {}
+    rows = db.query(GraphEntity.name, GraphEntity.id).filter(
+        GraphEntity.kb_id == kb_id, GraphEntity.name.in_(names)
+    ).all()
+    return dict(rows)
+
+def search_entities(db: Session, kb_id: int, query: str, limit: int = 50) -> List[GraphEntity]:
+    """ 实体名称模糊搜索 (不区分大小写) """
+    return db.query(GraphEntity).filter(
+        GraphEntity.kb_id == kb_id, GraphEntity.name.ilike(f"%{query}%")
+    ).order_by(func.length(GraphEntity.name)).limit(limit).all()
+
+def get_entity_names(db: Session, kb_id: int, ids: Iterable[int]) -> Dict[int, str]:
+    ids = list(ids)
+    if not ids:
+        return {}
+    return dict(db.query(GraphEntity.id, GraphEntity.name).filter(GraphEntity.id.in_(ids)).all())
+
+def get_top_entities(db: Session, kb_id: int, limit: int) -> List[int]:
+    """ 按度数 (出边 + 入边) 排序的核心实体 """
+    out_deg = db.query(GraphEdge.source_id.label("eid")).filter(GraphEdge.kb_id == kb_id)
+    in_deg = db.query(GraphEdge.target_id.label("eid")).filter(GraphEdge.kb_id == kb_id)
+    sub = out_deg.union_all(in_deg).subquery()
+    rows = db.query(sub.c.eid).group_by(sub.c.eid).order_by(func.count().desc()).limit(limit).all()
+    return [r[0] for r in rows]
+
+def get_edges_touching(db: Session, kb_id: int, entity_ids: Set[int], limit: Optional[int] = None) -> List[GraphEdge]:
+    """ 与给定实体相连的所有边 (任一方向) """
+    if not entity_ids:
+        return []
+    ids = list(entity_ids)
+    query = db.query(GraphEdge).filter(
+        GraphEdge.kb_id == kb_id,
+        or_(GraphEdge.source_id.in_(ids), GraphEdge.target_id.in_(ids))
+    ).order_by(GraphEdge.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
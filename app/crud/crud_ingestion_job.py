@@ -0,0 +1,106 @@
+from sqlalchemy.orm import Session
+from app.models.ingestion_job import IngestionJob
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+def create_job(db: Session, kb_id: int, payload: dict, max_attempts: int) -> IngestionJob:
+    """ 入队一个新任务 """
+    job = IngestionJob(kb_id=kb_id, payload=payload, status="queued", max_attempts=max_attempts, run_after=_now())
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+def get_job(db: Session, job_id: int) -> Optional[IngestionJob]:
+    return db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+
+def get_active_job_for_kb(db: Session, kb_id: int) -> Optional[IngestionJob]:
+    """
+    KB 当前排队中或运行中的任务。
+    租约已过期的 running 任务同样算作活动任务: 原 worker 可能仍在运行，要等 reclaim_expired_jobs 结算后才能开始新的解析。
+    """
+    return db.query(IngestionJob).filter(
+        IngestionJob.kb_id == kb_id,
+        IngestionJob.status.in_(ACTIVE_STATUSES)
+    ).first()
+
+def lease_next_job(db: Session, worker_id: str, lease_seconds: int) -> Optional[IngestionJob]:
+    """
+    领取下一个到期的 queued 任务。
+    使用 FOR UPDATE SKIP LOCKED，多个 worker 并发领取时不会拿到同一个任务。
+    租约过期的 running 任务先由 claim_expired_job 结算 (重试退避或失败)，不在这里直接接管。
+    """
+    now = _now()
+    job = db.query(IngestionJob).filter(
+        IngestionJob.status == "queued",
+        IngestionJob.run_after <= now
+    ).order_by(IngestionJob.run_after, IngestionJob.id).with_for_update(skip_locked=True).first()
+    if not job:
+        db.rollback()
+        return None
+    job.status = "running"
+    job.attempts = (job.attempts or 0) + 1
+    job.lease_owner = worker_id
+    job.lease_expires_at = now + timedelta(seconds=lease_seconds)
+    job.heartbeat_at = now
+    db.commit()
+    db.refresh(job)
+    return job
+
+def claim_expired_job(db: Session) -> Optional[IngestionJob]:
+    """ 锁定一个租约已过期 (worker 崩溃) 的 running 任务，由调用方在同一事务中结算 """
+    return db.query(IngestionJob).filter(
+        IngestionJob.status == "running",
+        IngestionJob.lease_expires_at < _now()
+    ).order_by(IngestionJob.id).with_for_update(skip_locked=True).first()
+
+def extend_lease(db: Session, job_id: int, worker_id: str, lease_seconds: int) -> bool:
+    """ 心跳续约；返回 False 表示租约已不属于该 worker (或任务已删除) """
+    now = _now()
+    updated = db.query(IngestionJob).filter(
+        IngestionJob.id == job_id,
+        IngestionJob.status == "running",
+        IngestionJob.lease_owner == worker_id
+    ).update(
+        {"lease_expires_at": now + timedelta(seconds=lease_seconds), "heartbeat_at": now},
+        synchronize_session=False
+    )
+    db.commit()
+    return updated > 0
+
+def _settle_owned(db: Session, job_id: int, owner: str, values: dict) -> bool:
+    """ 条件更新: 只有任务仍是 owner 持有的 running 任务时才生效，返回是否生效 """
+    updated = db.query(IngestionJob).filter(
+        IngestionJob.id == job_id,
+        IngestionJob.lease_owner == owner,
+        IngestionJob.status == "running"
+    ).update({**values, "lease_owner": None, "lease_expires_at": None}, synchronize_session=False)
+    db.commit()
+    return updated > 0
+
+def finish_job(db: Session, job_id: int, owner: str, status: str, error: Optional[str] = None) -> bool:
+    """ 将 owner 持有的任务标记为终态 (succeeded / failed / cancelled)；返回 False 表示租约已被回收 """
+    return _settle_owned(db, job_id, owner, {"status": status, "last_error": error})
+
+def reschedule_job(db: Session, job_id: int, owner: str, delay_seconds: float, error: str) -> bool:
+    """ 失败后按退避时间重新排队；返回 False 表示租约已被回收 """
+    return _settle_owned(db, job_id, owner, {
+        "status": "queued",
+        "last_error": error,
+        "run_after": _now() + timedelta(seconds=delay_seconds)
+    })
+
+def cancel_jobs_for_kb(db: Session, kb_id: int) -> int:
+    """ 取消 KB 所有尚未开始的任务 """
+    cancelled = db.query(IngestionJob).filter(
+        IngestionJob.kb_id == kb_id,
+        IngestionJob.status == "queued"
+    ).update({"status": "cancelled"}, synchronize_session=False)
+    db.commit()
+    return cancelled
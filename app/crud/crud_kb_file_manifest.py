@@ -0,0 +1,49 @@
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import func
+from app.models.kb_file_manifest import KBFileManifest
+from typing import Dict, List, Optional
+
+
+def get_manifest(db: Session, kb_id: int) -> Dict[str, KBFileManifest]:
+    """ 获取 KB 的文件清单: {相对路径: 清单条目} """
+    rows = db.query(KBFileManifest).filter(KBFileManifest.kb_id == kb_id).all()
+    return {row.file_path: row for row in rows}
+
+def get_manifest_model_id(db: Session, kb_id: int) -> Optional[int]:
+    """ 上次解析所用的嵌入模型 ID (清单为空时返回 None) """
+    row = db.query(KBFileManifest.embedding_model_id).filter(KBFileManifest.kb_id == kb_id).first()
+    return row[0] if row else None
+
+def upsert_entries(db: Session, kb_id: int, entries: List[dict]) -> None:
+    """ 按 (kb_id, file_path) 写入或更新清单条目 """
+    if not entries:
+        return
+    values = [{"kb_id": kb_id, **entry} for entry in entries]
+    stmt = insert(KBFileManifest).values(values)
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_kb_file_manifest_path",
+        set_={
+            "content_hash": stmt.excluded.content_hash,
+            "chunk_count": stmt.excluded.chunk_count,
+            "embedding_model_id": stmt.excluded.embedding_model_id,
+            "updated_at": func.now(),
+        }
+    )
+    db.execute(stmt)
+    db.commit()
+
+def delete_entries(db: Session, kb_id: int, file_paths: List[str]) -> None:
+    """ 删除已不存在的文件的清单条目 """
+    if not file_paths:
+        return
+    db.query(KBFileManifest).filter(
+        KBFileManifest.kb_id == kb_id,
+        KBFileManifest.file_path.in_(file_paths)
+    ).delete(synchronize_session=False)
+    db.commit()
+
+def clear_manifest(db: Session, kb_id: int) -> None:
+    """ 全量重建前清空清单 """
+    db.query(KBFileManifest).filter(KBFileManifest.kb_id == kb_id).delete(synchronize_session=False)
+    db.commit()
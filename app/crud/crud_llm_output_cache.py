@@ -0,0 +1,58 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import func, select, delete, update
+from sqlalchemy.dialects.postgresql import insert
+from app.models.llm_output_cache import LLMOutputCacheEntry
+from typing import Dict, List
+
+
+def get_entries(db: Session, cache_keys: List[str]) -> Dict[str, LLMOutputCacheEntry]:
+    """ 按键批量获取缓存条目 """
+    if not cache_keys:
+        return {}
+    rows = db.query(LLMOutputCacheEntry).filter(LLMOutputCacheEntry.cache_key.in_(cache_keys)).all()
+    return {row.cache_key: row for row in rows}
+
+def touch_entries(db: Session, cache_keys: List[str]) -> None:
+    """ 刷新命中条目的 last_used_at (LRU) """
+    if not cache_keys:
+        return
+    db.execute(
+        update(LLMOutputCacheEntry)
+        .where(LLMOutputCacheEntry.cache_key.in_(cache_keys))
+        .values(last_used_at=func.now())
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+def insert_entries(db: Session, entries: List[dict]) -> None:
+    """ 批量写入条目，键已存在时忽略 """
+    if not entries:
+        return
+    stmt = insert(LLMOutputCacheEntry).values(entries).on_conflict_do_nothing(index_elements=["cache_key"])
+    db.execute(stmt)
+    db.commit()
+
+def count_entries(db: Session) -> int:
+    return db.scalar(select(func.count()).select_from(LLMOutputCacheEntry)) or 0
+
+def total_size(db: Session) -> int:
+    return db.scalar(select(func.coalesce(func.sum(LLMOutputCacheEntry.size_bytes), 0))) or 0
+
+def delete_least_recently_used_bytes(db: Session, n_bytes: int) -> int:
+    """ 按 LRU 顺序删除条目，直到释放至少 n_bytes 字节。返回删除的条目数 """
+    if n_bytes <= 0:
+        return 0
+    # 按 last_used_at 累计字节数，删除累计值 (不含本条) 尚未达到 n_bytes 的条目
+    running = select(
+        LLMOutputCacheEntry.cache_key,
+        (func.sum(LLMOutputCacheEntry.size_bytes).over(order_by=(LLMOutputCacheEntry.last_used_at.asc(), LLMOutputCacheEntry.cache_key))
+         - LLMOutputCacheEntry.size_bytes).label("freed_before")
+    ).subquery()
+    oldest = select(running.c.cache_key).where(running.c.freed_before < n_bytes)
+    result = db.execute(
+        delete(LLMOutputCacheEntry)
+        .where(LLMOutputCacheEntry.cache_key.in_(oldest))
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount or 0
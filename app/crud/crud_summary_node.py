@@ -0,0 +1,38 @@
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import func
+from app.models.summary_node import SummaryNode
+from typing import Dict, List
+
+
+def get_nodes(db: Session, kb_id: int, model_id: int) -> Dict[str, SummaryNode]:
+    """ 获取某个 KB + 生成模型的摘要树: {路径: 节点} """
+    rows = db.query(SummaryNode).filter(SummaryNode.kb_id == kb_id, SummaryNode.model_id == model_id).all()
+    return {row.path: row for row in rows}
+
+def upsert_nodes(db: Session, kb_id: int, model_id: int, nodes: List[dict]) -> None:
+    """ 按 (kb_id, model_id, path) 写入或更新节点 """
+    if not nodes:
+        return
+    values = [{"kb_id": kb_id, "model_id": model_id, **node} for node in nodes]
+    stmt = insert(SummaryNode).values(values)
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_summary_node_path",
+        set_={
+            "level": stmt.excluded.level,
+            "input_hash": stmt.excluded.input_hash,
+            "summary": stmt.excluded.summary,
+            "updated_at": func.now(),
+        }
+    )
+    db.execute(stmt)
+    db.commit()
+
+def delete_missing(db: Session, kb_id: int, model_id: int, keep_paths: List[str]) -> None:
+    """ 删除已不在源码树中的节点 """
+    db.query(SummaryNode).filter(
+        SummaryNode.kb_id == kb_id,
+        SummaryNode.model_id == model_id,
+        SummaryNode.path.notin_(keep_paths)
+    ).delete(synchronize_session=False)
+    db.commit()
@@ -0,0 +1,54 @@
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from app.models.upload_session import UploadSession
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+
+def create_session(db: Session, session_id: str, kb_id: int, filename: str, total_size: Optional[int]) -> UploadSession:
+    upload = UploadSession(id=session_id, kb_id=kb_id, filename=filename, total_size=total_size, received=0, status="uploading")
+    db.add(upload)
+    db.commit()
+    db.refresh(upload)
+    return upload
+
+def get_session(db: Session, kb_id: int, session_id: str) -> Optional[UploadSession]:
+    return db.query(UploadSession).filter(UploadSession.id == session_id, UploadSession.kb_id == kb_id).first()
+
+def advance_offset(db: Session, session_id: str, expected_offset: int, new_offset: int) -> bool:
+    """ 仅当 received 仍等于 expected_offset 时推进 (防止并发写同一会话)。返回是否成功 """
+    result = db.execute(
+        update(UploadSession)
+        .where(UploadSession.id == session_id, UploadSession.received == expected_offset, UploadSession.status == "uploading")
+        .values(received=new_offset)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return (result.rowcount or 0) == 1
+
+def transition_status(db: Session, session_id: str, from_status: str, to_status: str) -> bool:
+    """ 仅当状态仍为 from_status 时切换 (防止并发 commit)。返回是否成功 """
+    result = db.execute(
+        update(UploadSession)
+        .where(UploadSession.id == session_id, UploadSession.status == from_status)
+        .values(status=to_status)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return (result.rowcount or 0) == 1
+
+def set_status(db: Session, upload: UploadSession, status: str, content_hash: Optional[str] = None) -> UploadSession:
+    upload.status = status
+    if content_hash is not None:
+        upload.content_hash = content_hash
+    db.commit()
+    db.refresh(upload)
+    return upload
+
+def get_stale_sessions(db: Session, older_than_seconds: int) -> List[UploadSession]:
+    """ 长时间没有新分块的未完成会话 (包括 commit 中途进程退出的会话) """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=older_than_seconds)
+    return db.query(UploadSession).filter(
+        UploadSession.status.in_(("uploading", "committing")),
+        UploadSession.updated_at < cutoff
+    ).all()
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 from app.core.config import settings
 
@@ -19,6 +19,13 @@ class Base(DeclarativeBase):
 # (未来) 在这里导入所有模型，以便 Base 能够“看到”它们
 from app.models.model import Model
 from app.models.knowledgebase import KnowledgeBase
+from app.models.embedding_cache import EmbeddingCacheEntry
+from app.models.kb_file_manifest import KBFileManifest
+from app.models.ingestion_job import IngestionJob
+from app.models.graph import GraphEntity, GraphEdge
+from app.models.summary_node import SummaryNode
+from app.models.llm_output_cache import LLMOutputCacheEntry
+from app.models.upload_session import UploadSession
 
 def init_db():
     """
@@ -26,4 +33,22 @@ def init_db():
     在开发中很有用
     """
     # 注意：在生产环境中，您可能希望使用 Alembic 来管理迁移
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
+
+def _add_missing_columns():
+    """
+    create_all 不会修改已存在的表: 为旧表补上新增的可空列 (ALTER TABLE ... ADD COLUMN)。
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {col["name"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
\ No newline at end of file
@@ -0,0 +1,24 @@
+from sqlalchemy import Column, Integer, String, LargeBinary, DateTime
+from sqlalchemy.sql import func
+from app.db.session import Base
+
+
+class EmbeddingCacheEntry(Base):
+    """
+    SQLAlchemy 模型，定义 'embedding_cache' 表。
+    以 hash(模型名, 维度, 文本) 为键缓存向量，跨知识库、跨重新解析共享。
+    """
+    __tablename__ = "embedding_cache"
+
+    cache_key = Column(String(64), primary_key=True) # sha256 十六进制
+    model_name = Column(String, nullable=False)
+    dimensions = Column(Integer, nullable=False)      # 向量实际长度
+    vector = Column(LargeBinary, nullable=False)      # float32 紧凑存储
+
+    # LRU 淘汰依据: 每次命中都会刷新
+    last_used_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.now(),
+        index=True
+    )
@@ -0,0 +1,33 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, Index, UniqueConstraint
+from app.db.session import Base
+
+
+class GraphEntity(Base):
+    """
+    SQLAlchemy 模型，定义 'graph_entities' 表。
+    L2b 知识图谱中的实体 (类、函数等)，按 (kb_id, name) 唯一。
+    """
+    __tablename__ = "graph_entities"
+    __table_args__ = (UniqueConstraint("kb_id", "name", name="uq_graph_entity_name"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    kb_id = Column(Integer, ForeignKey("knowledgebases.id", ondelete="CASCADE"), nullable=False, index=True)
+    name = Column(String, nullable=False)
+
+
+class GraphEdge(Base):
+    """
+    SQLAlchemy 模型，定义 'graph_edges' 表。
+    有向边 (subject -[relation]-> object)，两个方向都有索引以支持邻域查询。
+    """
+    __tablename__ = "graph_edges"
+    __table_args__ = (
+        UniqueConstraint("kb_id", "source_id", "relation", "target_id", name="uq_graph_edge"),
+        Index("ix_graph_edges_target", "kb_id", "target_id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    kb_id = Column(Integer, ForeignKey("knowledgebases.id", ondelete="CASCADE"), nullable=False)
+    source_id = Column(Integer, ForeignKey("graph_entities.id", ondelete="CASCADE"), nullable=False)
+    relation = Column(String, nullable=False)
+    target_id = Column(Integer, ForeignKey("graph_entities.id", ondelete="CASCADE"), nullable=False)
@@ -0,0 +1,35 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, Text, JSON, DateTime
+from sqlalchemy.sql import func
+from app.db.session import Base
+
+
+class IngestionJob(Base):
+    """
+    SQLAlchemy 模型，定义 'ingestion_jobs' 表。
+    持久化的摄取任务队列，由独立的 worker 进程 (python -m app.worker) 租约式领取执行。
+    """
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kb_id = Column(Integer, ForeignKey("knowledgebases.id", ondelete="CASCADE"), nullable=False, index=True)
+    payload = Column(JSON, nullable=False, default=dict) # 例如 {"embedding_model_id": 1, "incremental": false}
+
+    # queued -> running -> succeeded / failed / cancelled (失败可重试时回到 queued)
+    status = Column(String, nullable=False, default="queued", index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    run_after = Column(DateTime(timezone=True), nullable=False, server_default=func.now()) # 退避重试的最早执行时间
+
+    # 租约: worker 周期性心跳续约，租约过期的 running 任务由其他 worker 按重试规则结算
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    last_error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    updated_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.now(),
+        onupdate=func.now()
+    )
@@ -0,0 +1,26 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, UniqueConstraint
+from sqlalchemy.sql import func
+from app.db.session import Base
+
+
+class KBFileManifest(Base):
+    """
+    SQLAlchemy 模型，定义 'kb_file_manifest' 表。
+    记录每个知识库中每个源文件的内容哈希，用于增量重新解析。
+    """
+    __tablename__ = "kb_file_manifest"
+    __table_args__ = (UniqueConstraint("kb_id", "file_path", name="uq_kb_file_manifest_path"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    kb_id = Column(Integer, ForeignKey("knowledgebases.id", ondelete="CASCADE"), nullable=False, index=True)
+    file_path = Column(String, nullable=False)      # 相对于压缩包/目录根的路径
+    content_hash = Column(String(64), nullable=False)
+    chunk_count = Column(Integer, nullable=False, default=0)
+    embedding_model_id = Column(Integer, nullable=True) # 生成这些向量所用的模型
+
+    updated_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.now(),
+        onupdate=func.now()
+    )
@@ -18,6 +18,13 @@ class KnowledgeBase(Base):
     status = Column(String, nullable=False, default="new")
     parsing_state = Column(JSON, nullable=True)
     source_file_path = Column(String, nullable=True)
+    # 上传时流式计算的源文件 sha256，以及上次解析成功时的值 (两者相同说明源文件未变化)
+    source_content_hash = Column(String(64), nullable=True)
+    parsed_content_hash = Column(String(64), nullable=True)
+    # Qdrant 集合的存储配置 (vector_store.STORAGE_PROFILES)，为空时使用部署默认值 VECTOR_STORAGE_PROFILE
+    storage_profile = Column(String, nullable=True)
+    # 向量所在的 Qdrant 集合 (kb_{id} 或共享集合 kb_shared_{model_id})，为空表示旧的 kb_{id}
+    vector_collection = Column(String, nullable=True)
     
     updated_at = Column(
         DateTime(timezone=True),  # 推荐使用带时区的 DateTime
@@ -0,0 +1,26 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime
+from sqlalchemy.sql import func
+from app.db.session import Base
+
+
+class LLMOutputCacheEntry(Base):
+    """
+    SQLAlchemy 模型，定义 'llm_output_cache' 表。
+    以 hash(用途, 模型名, 提示词版本, 输入内容) 为键缓存 LLM 输出 (文件摘要、知识图谱三元组等)，
+    跨知识库、跨重新生成共享；按总字节数做 LRU 淘汰。
+    """
+    __tablename__ = "llm_output_cache"
+
+    cache_key = Column(String(64), primary_key=True) # sha256 十六进制
+    kind = Column(String(32), nullable=False)         # 'file_summary' | 'kg_triplets' | 'summary'
+    model_name = Column(String, nullable=False)
+    output = Column(Text, nullable=False)             # 原始文本 (三元组为 JSON)
+    size_bytes = Column(Integer, nullable=False)
+
+    # LRU 淘汰依据: 每次命中都会刷新
+    last_used_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.now(),
+        index=True
+    )
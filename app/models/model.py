@@ -13,4 +13,7 @@ class Model(Base):
     endpoint_url = Column(String, nullable=True)  
     
     # (关键修复) 重新添加 dimensions 字段
-    dimensions = Column(Integer, nullable=True) # 例如: 384, 768, 1536
\ No newline at end of file
+    dimensions = Column(Integer, nullable=True) # 例如: 384, 768, 1536
+
+    # (生成式模型) RAG 提示词中上下文部分的 token 预算，为空时使用 RAG_CONTEXT_TOKEN_BUDGET
+    context_token_budget = Column(Integer, nullable=True)
\ No newline at end of file
@@ -0,0 +1,27 @@
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, UniqueConstraint
+from sqlalchemy.sql import func
+from app.db.session import Base
+
+
+class SummaryNode(Base):
+    """
+    SQLAlchemy 模型，定义 'summary_nodes' 表。
+    分层摘要树的中间结果 (文件 / 目录)，按输入哈希复用，源码未变的部分再次生成时不调用模型。
+    """
+    __tablename__ = "summary_nodes"
+    __table_args__ = (UniqueConstraint("kb_id", "model_id", "path", name="uq_summary_node_path"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    kb_id = Column(Integer, ForeignKey("knowledgebases.id", ondelete="CASCADE"), nullable=False, index=True)
+    model_id = Column(Integer, ForeignKey("models.id", ondelete="CASCADE"), nullable=False)
+    path = Column(String, nullable=False)           # 相对于源码根的路径 ("." = 根目录)
+    level = Column(String(16), nullable=False)      # 'file' | 'directory'
+    input_hash = Column(String(64), nullable=False) # 文件内容 / 子节点摘要的哈希 (含提示词版本)
+    summary = Column(Text, nullable=False)
+
+    updated_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.now(),
+        onupdate=func.now()
+    )
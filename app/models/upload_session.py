@@ -0,0 +1,29 @@
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, DateTime
+from sqlalchemy.sql import func
+from app.db.session import Base
+
+
+class UploadSession(Base):
+    """
+    SQLAlchemy 模型，定义 'upload_sessions' 表。
+    可续传的分块上传: 客户端按 offset 追加分块，中断后查询 offset 继续，最后 commit。
+    """
+    __tablename__ = "upload_sessions"
+
+    id = Column(String(32), primary_key=True)  # uuid4 十六进制
+    kb_id = Column(Integer, ForeignKey("knowledgebases.id", ondelete="CASCADE"), nullable=False, index=True)
+    filename = Column(String, nullable=False)
+    total_size = Column(BigInteger, nullable=True)        # 客户端声明的总大小 (可选)
+    received = Column(BigInteger, nullable=False, default=0) # 已持久化的字节数 = 下一个分块的 offset
+
+    # uploading -> committing -> completed / aborted (commit 校验失败时回到 uploading)
+    status = Column(String, nullable=False, default="uploading")
+    content_hash = Column(String(64), nullable=True)      # commit 时写入 (sha256)
+
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    updated_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.now(),
+        onupdate=func.now()
+    )
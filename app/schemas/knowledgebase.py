@@ -1,7 +1,7 @@
 # app/schemas/knowledgebase.py
 
 from pydantic import BaseModel, ConfigDict, Field # (您已导入 Field)
-from typing import Optional, Any, Dict
+from typing import Optional, Any, Dict, List, Literal
 from datetime import datetime
 
 
@@ -28,8 +28,16 @@ class KnowledgeBaseUpdate(BaseModel):
     name: Optional[str] = None
     description: Optional[str] = None
     parentId: Optional[int] = None
+class StorageProfileUpdate(BaseModel):
+    """
+    PUT /{id}/storage-profile 的请求体
+    """
+    # default / scalar / binary / disk；null = 使用部署默认值 (VECTOR_STORAGE_PROFILE)
+    storage_profile: Optional[str] = None
 class StartParsingRequest(BaseModel):
     embedding_model_id: int
+    # 仅重新嵌入新增/修改的文件，并删除已移除文件的向量
+    incremental: bool = False
 
 
 # --- API 响应 ---
@@ -49,6 +57,18 @@ class KnowledgeBase(KnowledgeBaseBase): # 继承 name, description, parentId, 
         default=None, 
         serialization_alias='sourceFilePath'
     )
+    source_content_hash: Optional[str] = Field(
+        default=None,
+        serialization_alias='sourceContentHash'
+    )
+    storage_profile: Optional[str] = Field(
+        default=None,
+        serialization_alias='storageProfile'
+    )
+    vector_collection: Optional[str] = Field(
+        default=None,
+        serialization_alias='vectorCollection'
+    )
 
     model_config = ConfigDict(
         from_attributes=True, 
@@ -67,10 +87,74 @@ class GenerateSummaryRequest(BaseModel):
     
     # (2) 指定用哪个模型来 *向量化* 新生成的摘要
     embedding_model_id: int
+
+    # (3) standard = 小文件全文 / 大文件与压缩包 RAG 检索；
+    #     hierarchical = 逐文件摘要 -> 逐目录汇总 -> 仓库级摘要 (覆盖全部源文件，中间结果可复用)
+    mode: Literal["standard", "hierarchical"] = "standard"
     
     
 class GenerateGraphRequest(BaseModel):
     """
     POST /{id}/generate-graph 的请求体
     """
-    generation_model_id: int
\ No newline at end of file
+    generation_model_id: int
+    # 三元组提取方式: auto = 静态分析优先 (Python ast / tree-sitter)，不支持的文件交给 LLM；
+    # static = 只做静态分析；llm = 全部交给 LLM；enrich = 静态分析 + LLM 补充
+    extractor: Literal["auto", "static", "llm", "enrich"] = "auto"
+
+
+class UploadSessionCreate(BaseModel):
+    """
+    POST /{id}/uploads 的请求体
+    """
+    filename: str
+    total_size: Optional[int] = Field(default=None, ge=0) # 声明总大小后 commit 时会校验
+
+
+class UploadCommitRequest(BaseModel):
+    """
+    POST /{id}/uploads/{upload_id}/commit 的请求体
+    """
+    sha256: Optional[str] = None # (可选) 客户端计算的哈希，不一致时拒绝提交
+
+
+class UploadSession(BaseModel):
+    """
+    上传会话状态 (offset = 下一个分块应从哪个字节开始)
+    """
+    upload_id: str = Field(validation_alias="id")
+    kb_id: int
+    filename: str
+    offset: int = Field(validation_alias="received")
+    total_size: Optional[int] = None
+    status: str
+    content_hash: Optional[str] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class GraphEdge(BaseModel):
+    """ 知识图谱中的一条边: source -[relation]-> target """
+    source: str
+    relation: str
+    target: str
+
+
+class GraphNeighborhoodResponse(BaseModel):
+    """
+    GET /{id}/graph/neighborhood 的响应体
+    """
+    graph_kb_id: int
+    seeds: List[str]                 # 图谱中找到的种子实体
+    missing: List[str] = []          # 图谱中不存在的实体名
+    edges: List[GraphEdge]
+    truncated: bool = False          # 达到 limit 时为 True
+
+
+class GraphPathResponse(BaseModel):
+    """
+    GET /{id}/graph/path 的响应体 (found 为 False 时 edges 为空)
+    """
+    graph_kb_id: int
+    found: bool
+    edges: List[GraphEdge] = []
\ No newline at end of file
@@ -9,6 +9,8 @@ class ModelBase(BaseModel):
     
     # (关键修复) 重新添加 dimensions 字段
     dimensions: Optional[int] = None
+    # (生成式模型) RAG 上下文 token 预算
+    context_token_budget: Optional[int] = None
 
 class ModelCreate(ModelBase):
     pass
@@ -19,6 +21,7 @@ class ModelUpdate(BaseModel):
     api_key: Optional[str] = None
     endpoint_url: Optional[str] = None
     dimensions: Optional[int] = None # (关键修复)
+    context_token_budget: Optional[int] = None
 
 class Model(ModelBase):
     id: int
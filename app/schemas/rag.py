@@ -1,5 +1,5 @@
 # app/schemas/rag.py
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Dict, Any, Optional
 
 class RagQueryRequest(BaseModel):
@@ -10,6 +10,8 @@ class RagQueryRequest(BaseModel):
     knowledgebase_ids: List[int]
     model_id: int # 用于生成答案的 Generative Model ID
     top_k: int = 3
+    rerank_model_id: Optional[int] = None # (可选) 'rerank' 类型模型，不指定时使用本地词法重排序
+    graph_expansion_hops: int = Field(0, ge=0, le=2) # (可选) 沿 L2b 图谱扩展的跳数，0 = 不扩展
 
 class RagRetrieveRequest(BaseModel):
     """
@@ -18,6 +20,8 @@ class RagRetrieveRequest(BaseModel):
     query: str
     knowledgebase_ids: List[int]
     top_k: int = 3
+    rerank_model_id: Optional[int] = None # (可选) 'rerank' 类型模型，不指定时使用本地词法重排序
+    graph_expansion_hops: int = Field(0, ge=0, le=2) # (可选) 沿 L2b 图谱扩展的跳数，0 = 不扩展
 
 class RetrievedContext(BaseModel):
     """
@@ -27,6 +31,7 @@ class RetrievedContext(BaseModel):
     file_path: str
     text: str
     score: float
+    graph_relation: Optional[str] = None # 图谱扩展追加的片段: 与命中实体的关系，例如 "a -[CALLS]-> b"
 
 class RagQueryResponse(BaseModel):
     """
@@ -34,6 +39,8 @@ class RagQueryResponse(BaseModel):
     """
     answer: str # LLM 生成的最终答案
     retrieved_contexts: List[RetrievedContext] # 检索到的上下文，用于调试或前端显示
+    timings: Optional[Dict[str, float]] = None # 各检索阶段耗时 (毫秒)
+    packing: Optional[Dict[str, int]] = None # 上下文 token 预算打包统计 (context_tokens, dropped_tokens 等)
 
 class RagRetrieveResponse(BaseModel):
     """
@@ -41,4 +48,5 @@ class RagRetrieveResponse(BaseModel):
     """
     enhanced_prompt: str # 增强后的提示词（包含检索到的上下文）
     retrieved_contexts: List[RetrievedContext] # 检索到的上下文
-    metaprompt: Optional[str] = None # 完整的元提示词，用于调试
\ No newline at end of file
+    metaprompt: Optional[str] = None # 完整的元提示词，用于调试
+    timings: Optional[Dict[str, float]] = None # 各检索阶段耗时 (毫秒)
\ No newline at end of file
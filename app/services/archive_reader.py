@@ -0,0 +1,89 @@
+# app/services/archive_reader.py
+
+# 不落盘的压缩包读取 (ZIP / RAR / tar, tar.gz, tar.bz2, tar.xz)。
+# 成员按顺序惰性迭代: 先用成员头信息 (路径、未压缩大小) 调用 accept 过滤，
+# 只有被接受的成员才会解压，且只解压到内存。
+
+import logging
+import tarfile
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import Callable, Iterator, List, Tuple
+
+import rarfile
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SUFFIXES = ('.zip', '.rar', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+# accept(成员路径 (posix, 相对根), 未压缩大小) -> 是否读取
+MemberFilter = Callable[[str, int], bool]
+
+
+def is_archive(path: Path) -> bool:
+    return path.is_file() and path.name.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def _normalize(name: str) -> str:
+    """ 统一为不带前导 ./ 或 / 的 posix 相对路径 """
+    return PurePosixPath(name.replace("\\", "/").lstrip("/")).as_posix()
+
+
+def _headers(archive_path: Path) -> Iterator[Tuple[str, int, object, object]]:
+    """ 产出 (路径, 大小, 读取句柄, 成员)；只读目录/头信息，不解压 """
+    name = archive_path.name.lower()
+    if name.endswith('.zip'):
+        try:
+            with zipfile.ZipFile(archive_path, 'r') as zf:
+                for info in zf.infolist():
+                    if not info.is_dir():
+                        yield _normalize(info.filename), info.file_size, zf, info
+        except zipfile.BadZipFile:
+            raise ValueError("Invalid or corrupted zip file.")
+    elif name.endswith('.rar'):
+        try:
+            with rarfile.RarFile(archive_path, 'r') as rf:
+                for info in rf.infolist():
+                    if not info.is_dir():
+                        yield _normalize(info.filename), info.file_size, rf, info
+        except rarfile.BadRarFile:
+            raise ValueError("Invalid or corrupted RAR file.")
+    elif name.endswith(ARCHIVE_SUFFIXES):
+        # 流模式 (r|*): 顺序读取，不对压缩流做随机访问
+        try:
+            with tarfile.open(archive_path, mode='r|*') as tf:
+                for member in tf:
+                    if member.isfile():
+                        yield _normalize(member.name), member.size, tf, member
+        except tarfile.ReadError as e:
+            raise ValueError(f"Invalid or corrupted tar archive: {e}")
+    else:
+        raise ValueError(f"Unsupported archive format: {archive_path.name}.")
+
+
+def _read(handle, member) -> bytes:
+    if isinstance(handle, tarfile.TarFile):
+        stream = handle.extractfile(member)
+        return stream.read() if stream is not None else b""
+    return handle.read(member)
+
+
+def list_members(archive_path: Path, accept: MemberFilter) -> List[str]:
+    """ 被接受的成员路径 (用于进度统计；ZIP/RAR 只读目录，tar 需要顺序扫描一遍但不落盘) """
+    return [path for path, size, _, _ in _headers(archive_path) if accept(path, size)]
+
+
+def iter_members(archive_path: Path, accept: MemberFilter) -> Iterator[Tuple[str, bytes]]:
+    """ 按归档内顺序产出 (路径, 未压缩内容)，被拒绝的成员不会被解压 """
+    skipped = 0
+    for path, size, handle, member in _headers(archive_path):
+        if not accept(path, size):
+            skipped += 1
+            continue
+        try:
+            data = _read(handle, member)
+        except Exception as e:
+            logger.warning(f"Failed to read '{path}' from '{archive_path.name}': {e}")
+            continue
+        yield path, data
+    logger.info(f"Finished reading '{archive_path.name}' ({skipped} member(s) filtered out before decompression).")
@@ -0,0 +1,131 @@
+# app/services/context_packing.py
+
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from app.schemas.rag import RetrievedContext
+
+logger = logging.getLogger(__name__)
+
+# 剩余预算不足这么多 token 时不再截断塞入半个片段
+MIN_TRIM_TOKENS = 64
+# 同一文件的两个片段首尾重叠至少这么多字符才合并 (切分时的 overlap 为 100 字符)
+MIN_OVERLAP_CHARS = 32
+
+_encoding = None
+_encoding_failed = False
+
+
+def _get_encoding():
+    """ tiktoken 编码器 (首次使用时需要下载 BPE 文件，离线失败时退回字符估算) """
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.warning(f"tiktoken unavailable, falling back to chars/4 token estimate: {e}")
+            _encoding_failed = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    encoding = _get_encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    return text[:max_tokens * 4]
+
+
+def _merge_overlapping(first: str, second: str) -> Optional[str]:
+    """ 如果两个文本包含或首尾重叠则返回合并结果，否则返回 None """
+    if second in first:
+        return first
+    if first in second:
+        return second
+    max_len = min(len(first), len(second))
+    for size in range(max_len, MIN_OVERLAP_CHARS - 1, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+        if second.endswith(first[:size]):
+            return second + first[size:]
+    return None
+
+
+def pack_contexts(contexts: List[RetrievedContext], token_budget: int) -> Tuple[List[RetrievedContext], Dict[str, int]]:
+    """
+    按分数从高到低贪心装入 token 预算:
+    同一文件中重叠的片段合并为一个；装不下的片段在剩余预算足够时截断，否则丢弃。
+    返回 (装入的上下文, 统计信息)。
+    """
+    packed: List[RetrievedContext] = []
+    packed_tokens: List[int] = []
+    used = 0
+    dropped_tokens = 0
+    dropped_chunks = 0
+    merged_chunks = 0
+    trimmed_chunks = 0
+
+    for ctx in sorted(contexts, key=lambda c: c.score, reverse=True):
+        text = ctx.text or ""
+
+        # 1. 与已装入的同文件片段重叠 -> 合并，只为新增部分付费
+        merged = False
+        for i, existing in enumerate(packed):
+            if existing.source_kb_id != ctx.source_kb_id or existing.file_path != ctx.file_path:
+                continue
+            combined = _merge_overlapping(existing.text or "", text)
+            if combined is None:
+                continue
+            combined_tokens = count_tokens(combined)
+            extra = combined_tokens - packed_tokens[i]
+            if used + extra <= token_budget:
+                packed[i] = existing.model_copy(update={"text": combined, "score": max(existing.score, ctx.score)})
+                packed_tokens[i] = combined_tokens
+                used += extra
+                merged_chunks += 1
+            else:
+                dropped_tokens += extra
+                dropped_chunks += 1
+            merged = True
+            break
+        if merged:
+            continue
+
+        # 2. 整块装入
+        tokens = count_tokens(text)
+        remaining = token_budget - used
+        if tokens <= remaining:
+            packed.append(ctx)
+            packed_tokens.append(tokens)
+            used += tokens
+            continue
+
+        # 3. 截断装入或丢弃
+        if remaining >= MIN_TRIM_TOKENS:
+            trimmed = truncate_to_tokens(text, remaining)
+            trimmed_tokens = count_tokens(trimmed)
+            packed.append(ctx.model_copy(update={"text": trimmed}))
+            packed_tokens.append(trimmed_tokens)
+            used += trimmed_tokens
+            dropped_tokens += tokens - trimmed_tokens
+            trimmed_chunks += 1
+        else:
+            dropped_tokens += tokens
+            dropped_chunks += 1
+
+    stats = {
+        "token_budget": token_budget,
+        "context_tokens": used,
+        "dropped_tokens": dropped_tokens,
+        "dropped_chunks": dropped_chunks,
+        "merged_chunks": merged_chunks,
+        "trimmed_chunks": trimmed_chunks,
+    }
+    return packed, stats
@@ -0,0 +1,340 @@
+# app/services/corpus_filter.py
+
+# 摄取前的语料过滤: 在切分/嵌入之前丢掉对检索没有价值、却占据大部分代码块的文件。
+#   - gitignore 风格规则 (源码树中的 .gitignore + INGESTION_EXCLUDE_PATTERNS)
+#   - vendor 目录 (node_modules、vendor、third_party、虚拟环境等) 和隐藏文件
+#   - 锁文件、压缩 (minified) 代码、生成代码 (按文件名和文件开头的标记/行长判断)
+#   - 二进制文件 (嗅探文件开头的 NUL 字节) 和超过 INGESTION_MAX_FILE_BYTES 的文件
+# 路径级规则只看路径和大小 (压缩包成员在解压前判断)；内容级规则只读文件开头 SNIFF_BYTES 字节。
+# 每个被跳过的文件记入 SkipReport (原因、字节数)，最终写入 KB 的 parsing_state。
+
+import logging
+import os
+import re
+from collections import defaultdict
+from pathlib import Path, PurePosixPath
+from typing import Dict, Iterable, List, Optional, Pattern, Tuple
+
+from app.core.config import settings
+from app.services import archive_reader
+
+logger = logging.getLogger(__name__)
+
+SNIFF_BYTES = 8192
+REPORT_EXAMPLES = 5
+
+# 跳过原因
+IGNORED = "ignored"
+HIDDEN = "hidden"
+VENDOR = "vendor"
+LOCKFILE = "lockfile"
+MINIFIED = "minified"
+GENERATED = "generated"
+BINARY = "binary"
+TOO_LARGE = "too_large"
+
+VENDOR_DIRS = {
+    'node_modules', 'bower_components', 'jspm_packages', 'vendor', 'third_party', 'thirdparty', 'third-party',
+    'venv', 'site-packages', '__pycache__', 'Pods', 'Carthage', 'dist',
+}
+LOCKFILES = {
+    'package-lock.json', 'npm-shrinkwrap.json', 'yarn.lock', 'pnpm-lock.yaml', 'bun.lockb',
+    'poetry.lock', 'Pipfile.lock', 'pdm.lock', 'uv.lock', 'Cargo.lock', 'go.sum',
+    'composer.lock', 'Gemfile.lock', 'packages.lock.json', 'flake.lock',
+}
+# 需要 LlamaIndex 文件阅读器解析的富文档 (本身是二进制格式，不做内容嗅探)
+RICH_DOCUMENT_SUFFIXES = ('.pdf', '.docx', '.pptx', '.ppt', '.pptm', '.epub', '.ipynb', '.csv', '.hwp', '.mbox')
+
+_MINIFIED_NAME_RE = re.compile(r"(\.|-)min\.(js|css|mjs)$|\.bundle\.js$|\.(js|css)\.map$", re.IGNORECASE)
+_GENERATED_NAME_RE = re.compile(
+    r"_pb2(_grpc)?\.pyi?$|\.pb\.(go|cc|h)$|\.pb\.gw\.go$|_generated\.|\.generated\.|\.g\.dart$|\.designer\.cs$",
+    re.IGNORECASE
+)
+_GENERATED_MARKER_RE = re.compile(
+    rb"@generated|do not edit|code generated by|auto-?generated|generated by the protocol buffer compiler",
+    re.IGNORECASE
+)
+# 只在文件开头这么多字节内查找生成标记 (避免把提到 "DO NOT EDIT" 的普通代码误判)
+MARKER_BYTES = 1024
+# 按平均行长判断压缩代码只适用于这些格式 (其他文本，例如不换行的 Markdown 段落、CJK 文档，行长本来就可能很长)
+MINIFIED_SUFFIXES = ('.js', '.mjs', '.cjs', '.css', '.json', '.map', '.geojson')
+# 文件开头不足这么多字符时不按行长判断 (短文件一两行很正常)
+MINIFIED_MIN_CHARS = 1024
+
+
+# --- gitignore 风格规则 ---
+
+def _translate(pattern: str) -> str:
+    """ gitignore glob -> 正则 (**、*、?、[...]) """
+    i, out = 0, []
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?"); i += 3
+        elif pattern.startswith("/**", i) and i + 3 == len(pattern):
+            out.append("(?:/.*)?"); i += 3
+        elif pattern.startswith("**", i):
+            out.append(".*"); i += 2
+        elif pattern[i] == "*":
+            out.append("[^/]*"); i += 1
+        elif pattern[i] == "?":
+            out.append("[^/]"); i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 1:]:
+            end = pattern.index("]", i + 1)
+            body = pattern[i + 1:end].replace("\\", "\\\\")
+            out.append("[^" + body[1:] + "]" if body.startswith("!") else "[" + body + "]")
+            i = end + 1
+        else:
+            out.append(re.escape(pattern[i])); i += 1
+    return "".join(out)
+
+
+class IgnoreRules:
+    """ 按 gitignore 语义匹配相对根的 posix 路径 (后出现的规则优先，! 取反，/ 结尾只匹配目录) """
+
+    def __init__(self):
+        # (规则所在目录, 正则, 取反, 只匹配目录)
+        self._rules: List[Tuple[str, Pattern, bool, bool]] = []
+
+    def __bool__(self) -> bool:
+        return bool(self._rules)
+
+    def add(self, lines: Iterable[str], base: str = "") -> None:
+        base = base.strip("/")
+        for raw in lines:
+            line = raw.rstrip("\r\n").rstrip(" ")
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            elif line.startswith("\\"):
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+            anchored = "/" in line
+            line = line.lstrip("/")
+            regex = _translate(line) if anchored else "(?:.*/)?" + _translate(line)
+            self._rules.append((base, re.compile(f"^{regex}$"), negate, dir_only))
+
+    def _match(self, path: str, is_dir: bool) -> bool:
+        ignored = False
+        for base, regex, negate, dir_only in self._rules:
+            if base:
+                if not path.startswith(base + "/"):
+                    continue
+                rel = path[len(base) + 1:]
+            else:
+                rel = path
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel):
+                ignored = not negate
+        return ignored
+
+    def is_ignored(self, path: str, is_dir: bool = False) -> bool:
+        """ 父目录被忽略时其中的文件也被忽略 (与 git 一样，不能再用 ! 找回) """
+        parts = PurePosixPath(path).parts
+        for depth in range(1, len(parts)):
+            if self._match("/".join(parts[:depth]), True):
+                return True
+        return self._match(path, is_dir)
+
+
+# --- 跳过报告 ---
+
+class SkipReport:
+    """ 被跳过的文件: 按路径去重 (压缩包的计数扫描和读取扫描会各判断一次) """
+
+    def __init__(self):
+        self._skipped: Dict[str, Tuple[str, int, int]] = {}  # path -> (原因, 文件数, 字节数)
+
+    def add(self, path: str, reason: str, size: int, files: int = 1) -> None:
+        self._skipped[path] = (reason, files, size)
+
+    @property
+    def files(self) -> int:
+        return sum(files for _, files, _ in self._skipped.values())
+
+    @property
+    def bytes(self) -> int:
+        return sum(size for _, _, size in self._skipped.values())
+
+    def as_dict(self) -> dict:
+        reasons: Dict[str, dict] = defaultdict(lambda: {"files": 0, "bytes": 0, "examples": []})
+        for path, (reason, files, size) in sorted(self._skipped.items()):
+            entry = reasons[reason]
+            entry["files"] += files
+            entry["bytes"] += size
+            if len(entry["examples"]) < REPORT_EXAMPLES:
+                entry["examples"].append(path)
+        return {"files": self.files, "bytes": self.bytes, "reasons": dict(reasons)}
+
+    def summary(self) -> str:
+        if not self._skipped:
+            return "no files filtered"
+        by_reason: Dict[str, int] = defaultdict(int)
+        for reason, files, _ in self._skipped.values():
+            by_reason[reason] += files
+        detail = ", ".join(f"{reason}: {n}" for reason, n in sorted(by_reason.items(), key=lambda kv: -kv[1]))
+        return f"filtered {self.files} file(s), {self.bytes / (1024 * 1024):.1f} MB ({detail})"
+
+
+# --- 过滤器 ---
+
+def is_vendor_path(path: str) -> bool:
+    return any(part in VENDOR_DIRS for part in PurePosixPath(path).parts[:-1])
+
+
+def is_hidden_path(path: str) -> bool:
+    return any(part.startswith('.') for part in PurePosixPath(path).parts)
+
+
+class CorpusFilter:
+    """ 一次摄取运行的过滤器: 规则 + 本次的跳过报告 """
+
+    def __init__(self, max_bytes: Optional[int] = None, patterns: Optional[Iterable[str]] = None, enabled: Optional[bool] = None):
+        self.enabled = settings.INGESTION_FILTER_ENABLED if enabled is None else enabled
+        self.max_bytes = settings.INGESTION_MAX_FILE_BYTES if max_bytes is None else max_bytes
+        self.rules = IgnoreRules()
+        self.rules.add(settings.INGESTION_EXCLUDE_PATTERNS if patterns is None else patterns)
+        self.vendor_roots: List[str] = []  # 压缩包中含 pyvenv.cfg 的目录
+        self.report = SkipReport()
+
+    def add_gitignore(self, directory: str, text: str) -> None:
+        if settings.INGESTION_RESPECT_GITIGNORE:
+            self.rules.add(text.splitlines(), base=directory)
+
+    def path_reason(self, path: str, size: int) -> Optional[str]:
+        """ 只看路径和大小的规则。隐藏文件总是跳过 (与 SimpleDirectoryReader(exclude_hidden=True) 一致) """
+        if is_hidden_path(path):
+            return HIDDEN
+        if not self.enabled:
+            return None
+        name = PurePosixPath(path).name
+        if is_vendor_path(path) or any(path.startswith(root + "/") for root in self.vendor_roots):
+            return VENDOR
+        if self.rules and self.rules.is_ignored(path):
+            return IGNORED
+        if name in LOCKFILES:
+            return LOCKFILE
+        if _MINIFIED_NAME_RE.search(name):
+            return MINIFIED
+        if _GENERATED_NAME_RE.search(name):
+            return GENERATED
+        if self.max_bytes and size > self.max_bytes:
+            return TOO_LARGE
+        return None
+
+    def content_reason(self, path: str, head: bytes) -> Optional[str]:
+        """ 根据文件开头的字节判断: 二进制、生成代码标记、压缩代码 (js/css/json 的平均行长) """
+        if not self.enabled or not head or path.lower().endswith(RICH_DOCUMENT_SUFFIXES):
+            return None
+        if b"\0" in head:
+            return BINARY
+        if _GENERATED_MARKER_RE.search(head[:MARKER_BYTES]):
+            return GENERATED
+        if path.lower().endswith(MINIFIED_SUFFIXES):
+            # 按字符而不是字节计算行长 (多字节 UTF-8 字符不应放大行长)
+            text = head.decode("utf-8", errors="ignore")
+            if len(text) >= MINIFIED_MIN_CHARS and len(text) / (text.count("\n") + 1) > settings.INGESTION_MINIFIED_AVG_LINE_LENGTH:
+                return MINIFIED
+        return None
+
+    def accept_path(self, path: str, size: int) -> bool:
+        reason = self.path_reason(path, size)
+        if reason is not None:
+            self.report.add(path, reason, size)
+            return False
+        return True
+
+    def accept_content(self, path: str, head: bytes, size: int) -> bool:
+        reason = self.content_reason(path, head)
+        if reason is not None:
+            self.report.add(path, reason, size)
+            return False
+        return True
+
+    def load_archive_rules(self, archive_path: Path) -> None:
+        """
+        先读入压缩包中的 .gitignore 成员 (以及标记虚拟环境目录的 pyvenv.cfg)，再用 accept_path 过滤其他成员。
+        ZIP/RAR 只解压这几个小文件；tar 需要多一次顺序扫描。
+        """
+        if not self.enabled:
+            return
+        for path, data in archive_reader.iter_members(archive_path, lambda p, _: PurePosixPath(p).name in (".gitignore", "pyvenv.cfg")):
+            parent = str(PurePosixPath(path).parent)
+            parent = "" if parent == "." else parent
+            if PurePosixPath(path).name == "pyvenv.cfg":
+                if parent:
+                    self.vendor_roots.append(parent)
+            else:
+                self.add_gitignore(parent, data.decode("utf-8", errors="ignore"))
+
+    def walk_directory(self, root: Path) -> List[Path]:
+        """
+        枚举目录中要摄取的文件 (自顶向下，逐层读取 .gitignore)。
+        被整体跳过的目录 (vendor / 被忽略 / 虚拟环境) 不再深入，只统计其文件数和字节数。
+        """
+        accepted: List[Path] = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            current = Path(dirpath)
+            rel_dir = current.relative_to(root).as_posix()
+            rel_dir = "" if rel_dir == "." else rel_dir
+            if ".gitignore" in filenames:
+                try:
+                    self.add_gitignore(rel_dir, (current / ".gitignore").read_text(encoding="utf-8", errors="ignore"))
+                except OSError as e:
+                    logger.warning(f"Failed to read {current / '.gitignore'}: {e}")
+
+            kept = []
+            for name in sorted(dirnames):
+                rel = f"{rel_dir}/{name}" if rel_dir else name
+                reason = self._directory_reason(current / name, rel)
+                if reason is None:
+                    kept.append(name)
+                else:
+                    files, size = _tree_size(current / name)
+                    self.report.add(rel + "/", reason, size, files)
+            dirnames[:] = kept
+
+            for name in sorted(filenames):
+                file_path = current / name
+                rel = f"{rel_dir}/{name}" if rel_dir else name
+                try:
+                    size = file_path.stat().st_size
+                    if not self.accept_path(rel, size):
+                        continue
+                    with file_path.open("rb") as f:
+                        head = f.read(SNIFF_BYTES)
+                except OSError as e:
+                    logger.warning(f"Skipping unreadable file {file_path}: {e}")
+                    continue
+                if self.accept_content(rel, head, size):
+                    accepted.append(file_path)
+        return accepted
+
+    def _directory_reason(self, directory: Path, rel: str) -> Optional[str]:
+        if directory.name.startswith('.'):
+            return HIDDEN
+        if not self.enabled:
+            return None
+        if directory.name in VENDOR_DIRS or (directory / "pyvenv.cfg").is_file():
+            return VENDOR
+        if self.rules and self.rules.is_ignored(rel, is_dir=True):
+            return IGNORED
+        return None
+
+
+def _tree_size(directory: Path) -> Tuple[int, int]:
+    """ 被跳过目录的文件数和总字节数 (只做 stat，不读内容) """
+    files = size = 0
+    for dirpath, _, filenames in os.walk(directory):
+        for name in filenames:
+            try:
+                size += os.stat(os.path.join(dirpath, name)).st_size
+                files += 1
+            except OSError:
+                continue
+    return files, size
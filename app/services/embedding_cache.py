@@ -0,0 +1,158 @@
+# app/services/embedding_cache.py
+
+import asyncio
+import hashlib
+import logging
+import threading
+from array import array
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.crud import crud_embedding_cache
+from app.db.session import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# 每写入这么多条新向量检查一次容量 (避免每个批次都 count(*))
+EVICTION_CHECK_INTERVAL = 1000
+# 超出容量时一次淘汰到上限的 90%，避免频繁触发
+EVICTION_TARGET_RATIO = 0.9
+
+
+class CacheStats:
+    """ 线程安全的命中/未命中计数器 """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hits: int, misses: int) -> None:
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": round(self.hit_rate, 4)}
+
+
+# 进程级统计 (见 /health/cache-stats)
+stats = CacheStats()
+_inserts_since_check = 0
+_inserts_lock = threading.Lock()
+
+
+def make_cache_key(model_name: str, dimensions: Optional[int], text: str) -> str:
+    """ hash(模型名, 维度, 文本) """
+    h = hashlib.sha256()
+    h.update(model_name.encode("utf-8"))
+    h.update(b"\x00")
+    h.update(str(dimensions or 0).encode("ascii"))
+    h.update(b"\x00")
+    h.update(text.encode("utf-8"))
+    return h.hexdigest()
+
+
+def _encode(vector: List[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _decode(blob: bytes) -> List[float]:
+    vec = array("f")
+    vec.frombytes(blob)
+    return vec.tolist()
+
+
+def lookup(db: Session, model_name: str, dimensions: Optional[int], texts: List[str]) -> List[Optional[List[float]]]:
+    """ 返回与 texts 对齐的列表，未命中的位置为 None """
+    keys = [make_cache_key(model_name, dimensions, t) for t in texts]
+    try:
+        entries = crud_embedding_cache.get_entries(db, list(set(keys)))
+        if entries:
+            crud_embedding_cache.touch_entries(db, list(entries.keys()))
+    except Exception as e:
+        logger.warning(f"Embedding cache lookup failed, treating as miss: {e}")
+        db.rollback()
+        return [None] * len(texts)
+    return [_decode(entries[k].vector) if k in entries else None for k in keys]
+
+
+def store(db: Session, model_name: str, dimensions: Optional[int], texts: List[str], vectors: List[List[float]]) -> None:
+    """ 写入新计算的向量，并按需触发 LRU 淘汰 """
+    global _inserts_since_check
+    rows = {}
+    for text, vector in zip(texts, vectors):
+        key = make_cache_key(model_name, dimensions, text)
+        rows[key] = {
+            "cache_key": key,
+            "model_name": model_name,
+            "dimensions": len(vector),
+            "vector": _encode(vector),
+        }
+    try:
+        crud_embedding_cache.insert_entries(db, list(rows.values()))
+    except Exception as e:
+        logger.warning(f"Embedding cache store failed: {e}")
+        db.rollback()
+        return
+
+    with _inserts_lock:
+        _inserts_since_check += len(rows)
+        should_check = _inserts_since_check >= EVICTION_CHECK_INTERVAL
+        if should_check:
+            _inserts_since_check = 0
+    if should_check:
+        evict_if_needed(db)
+
+
+def _in_session(fn, *args):
+    db = SessionLocal()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+
+async def lookup_async(model_name: str, dimensions: Optional[int], texts: List[str]) -> List[Optional[List[float]]]:
+    """ lookup 的异步版本: 在工作线程中使用独立会话，不阻塞事件循环，也不在并发的批次间共享 Session """
+    return await asyncio.to_thread(_in_session, lookup, model_name, dimensions, texts)
+
+
+async def store_async(model_name: str, dimensions: Optional[int], texts: List[str], vectors: List[List[float]]) -> None:
+    """ store 的异步版本 (同 lookup_async) """
+    await asyncio.to_thread(_in_session, store, model_name, dimensions, texts, vectors)
+
+
+def evict_if_needed(db: Session) -> int:
+    """ 条目数超过 EMBEDDING_CACHE_MAX_ENTRIES 时删除最久未使用的条目 """
+    try:
+        count = crud_embedding_cache.count_entries(db)
+        if count <= settings.EMBEDDING_CACHE_MAX_ENTRIES:
+            return 0
+        target = int(settings.EMBEDDING_CACHE_MAX_ENTRIES * EVICTION_TARGET_RATIO)
+        removed = crud_embedding_cache.delete_least_recently_used(db, count - target)
+        logger.info(f"Embedding cache evicted {removed} LRU entries ({count} -> {count - removed}).")
+        return removed
+    except Exception as e:
+        logger.warning(f"Embedding cache eviction failed: {e}")
+        db.rollback()
+        return 0
+
+
+def get_stats(db: Optional[Session] = None) -> Dict[str, Any]:
+    """ 命中率统计；传入 db 时附带当前条目数，便于评估容量 """
+    result = stats.as_dict()
+    result["max_entries"] = settings.EMBEDDING_CACHE_MAX_ENTRIES
+    if db is not None:
+        try:
+            result["entries"] = crud_embedding_cache.count_entries(db)
+        except Exception as e:
+            result["entries"] = f"error: {e}"
+    return result
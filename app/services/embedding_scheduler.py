@@ -0,0 +1,73 @@
+# app/services/embedding_scheduler.py
+
+import asyncio
+import logging
+from collections import deque
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Deque, Iterable, List, Optional, Tuple, Union
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 一个批次可以是文本列表，也可以是节点列表 (由 embed_fn 负责取出文本)
+Batch = List[Any]
+EmbedFn = Callable[[Batch], Awaitable[List[List[float]]]]
+
+
+def get_endpoint_concurrency(endpoint_url: Optional[str]) -> int:
+    """ 返回某个嵌入端点允许同时在途的批次数 (优先使用按端点配置的覆盖值) """
+    limit = settings.EMBEDDING_ENDPOINT_CONCURRENCY.get(endpoint_url or "", settings.EMBEDDING_MAX_CONCURRENCY)
+    return max(1, int(limit))
+
+
+async def _aiter(batches: Union[Iterable[Batch], AsyncIterable[Batch]]) -> AsyncIterator[Batch]:
+    if hasattr(batches, "__aiter__"):
+        async for batch in batches:
+            yield batch
+    else:
+        for batch in batches:
+            yield batch
+
+
+class EmbeddingScheduler:
+    """
+    在同一个事件循环中保持最多 max_concurrency 个嵌入批次同时在途，
+    并按提交顺序返回结果。
+    """
+
+    def __init__(self, embed_fn: EmbedFn, max_concurrency: int):
+        self._embed_fn = embed_fn
+        self.max_concurrency = max(1, max_concurrency)
+
+    async def _embed_batch(self, batch: Batch) -> List[List[float]]:
+        embeddings = await self._embed_fn(batch)
+        if len(embeddings) != len(batch):
+            raise ValueError(f"API embed count mismatch: got {len(embeddings)} for {len(batch)} texts.")
+        return embeddings
+
+    async def iter_embeddings(
+        self, batches: Union[Iterable[Batch], AsyncIterable[Batch]]
+    ) -> AsyncIterator[Tuple[Batch, List[List[float]]]]:
+        """
+        逐批产出 (batch, embeddings)。
+        窗口满时等待最早提交的批次完成，因此结果顺序与输入一致；
+        批次来源按需拉取，未处理的批次不会提前堆积在内存中。
+        """
+        pending: Deque[Tuple[Batch, asyncio.Task]] = deque()
+        try:
+            async for batch in _aiter(batches):
+                if not batch:
+                    continue
+                pending.append((batch, asyncio.create_task(self._embed_batch(batch))))
+                if len(pending) >= self.max_concurrency:
+                    head_batch, head_task = pending.popleft()
+                    yield head_batch, await head_task
+            while pending:
+                head_batch, head_task = pending.popleft()
+                yield head_batch, await head_task
+        finally:
+            # 调用方提前退出 (取消/出错) 时，不留下悬空的请求
+            for _, task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*(task for _, task in pending), return_exceptions=True)
@@ -4,15 +4,16 @@ import aiofiles
 from pathlib import Path
 import openai
 from sqlalchemy.orm import Session
-from openai import AsyncOpenAI
 import httpx
 from datetime import datetime, timezone
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import os
 
-from qdrant_client import QdrantClient
-from app.services.rag_service import retrieve_contexts_only
-from app.schemas.rag import RagRetrieveRequest
+from qdrant_client import AsyncQdrantClient
+from app.services.retrieval_engine import RetrievalEngine
+from app.services import archive_reader, graph_store, hierarchical_summary, llm_output_cache
+from app.core.llm_clients import get_openai_client
+from app.core.config import settings
 
 # 导入数据库模型和 CRUD
 import app.crud.crud_knowledgebase as crud_kb
@@ -28,15 +29,18 @@ logger = logging.getLogger(__name__)
 
 # (保持不变)
 FILE_SIZE_THRESHOLD_BYTES = 10 * 1024 
+# 缓存键中的提示词版本 (最终摘要的缓存键已包含完整提示词，这里只用于强制失效)
+SUMMARY_PROMPT_VERSION = "1"
 
 
 async def _perform_rag_retrieval(
     db: Session,                # (3) <-- 新增 db
-    qdrant: QdrantClient,       # (4) <-- 新增 qdrant
-    parent_kb: models_kb
+    qdrant: AsyncQdrantClient,  # (4) <-- 新增 qdrant
+    parent_kb: models_kb,
+    token_budget: Optional[int] = None
 ) -> str:
     """
-    使用 app.services.rag_service 执行 RAG 检索以获取相关代码块。
+    使用共享的 RetrievalEngine 执行 RAG 检索以获取相关代码块。
     """
     logger.info(f"[KB {parent_kb.id}] 文件过大，启动 RAG 检索 (使用 rag_service)...")
 
@@ -51,27 +55,12 @@ async def _perform_rag_retrieval(
     5.  公共 API 接口：如果适用，识别暴露给系统其他部分的公共函数或类方法。
     """
 
-    # --- 4b. 准备 RAG 检索请求 (使用您提供的 schema) ---
-    # "条件放的宽一点"，检索更多块以保证不遗漏关键信息
-    rag_request = RagRetrieveRequest(
-        query=query_text,
-        knowledgebase_ids=[parent_kb.id], # 仅检索父知识库
-        top_k=20 # (满足要求 3)
-    )
-
-    # --- 4c. 调用您框架内的 RAG 服务 ---
+    # --- 4b/4c. 调用共享检索引擎 ---
+    # "条件放的宽一点"，检索更多块以保证不遗漏关键信息 (仅检索父知识库)
     try:
-        logger.info(f"正在调用 retrieve_contexts_only (k=20) for KB {parent_kb.id}...")
-        
-        # (!! 核心替换 !!)
-        # 调用 rag_service.py 中的函数
-        rag_response = await retrieve_contexts_only(
-            db=db,
-            qdrant=qdrant,
-            request=rag_request
-        )
-        
-        retrieved_contexts = rag_response.retrieved_contexts
+        logger.info(f"正在调用 RetrievalEngine (k=20) for KB {parent_kb.id}...")
+        retrieval = await RetrievalEngine(db, qdrant).retrieve(query_text, [parent_kb.id], top_k=20, token_budget=token_budget)
+        retrieved_contexts = retrieval.contexts
         
         if not retrieved_contexts:
             raise ValueError("RAG 检索未返回任何代码块，无法生成摘要。")
@@ -79,13 +68,13 @@ async def _perform_rag_retrieval(
         logger.info(f"RAG 服务成功检索到 {len(retrieved_contexts)} 个代码块。")
 
     except Exception as e:
-        logger.error(f"调用 RAG 检索服务 (retrieve_contexts_only) 失败: {e}", exc_info=True)
+        logger.error(f"调用 RAG 检索引擎失败: {e}", exc_info=True)
         raise RuntimeError(f"Failed to retrieve contexts for KB {parent_kb.id}: {e}")
 
     # --- 4d. 格式化上下文 (使用 rag.py 中的 RetrievedContext 格式) ---
     context_chunks = []
     for i, ctx in enumerate(retrieved_contexts):
-        chunk_header = f"--- 相关代码块 {i+1} (相似度: {ctx.score:.4f}) (来源: {ctx.file_path}) ---"
+        chunk_header = f"--- 相关代码块 {i+1} (相关度: {ctx.score:.4f}) (来源: {ctx.file_path}) ---"
         context_chunks.append(f"{chunk_header}\n{ctx.text}")
         
     return "\n\n".join(context_chunks)
@@ -93,15 +82,17 @@ async def _perform_rag_retrieval(
 
 async def generate_summary_pipeline(
     db: Session,
-    qdrant: QdrantClient, # (5) <-- 关键: 新增 Qdrant 客户端依赖
+    qdrant: AsyncQdrantClient, # (5) <-- 关键: 新增 Qdrant 客户端依赖
     parent_kb: models_kb,
-    generation_model: models_model
+    generation_model: models_model,
     # embedding_model: models_model # (6) (保持) L1 解析时使用的模型
+    mode: str = "standard"
 ) -> models_kb:
     """
     RAG 循环 B (L2a) 核心管道。
     (已更新) 采用混合策略。
     (已更新) RAG 检索现在调用 rag_service。
+    mode="hierarchical" 时改为 文件 -> 目录 -> 仓库 的分层摘要 (见 hierarchical_summary)。
     """
     
     logger.info(f"开始为 KB ID: {parent_kb.id} 生成 L2a 摘要...")
@@ -119,7 +110,7 @@ async def generate_summary_pipeline(
     if not source_file_path.exists():
         raise FileNotFoundError(f"Source file not found: {source_file_path}")
 
-    # --- 2. “机会主义” L2b 检查 (保持不变) ---
+    # --- 2. “机会主义” L2b 检查 (子图在拿到代码上下文后再查询) ---
     logger.info(f"[KB {parent_kb.id}] 正在检查是否存在 L2b 知识图谱...")
     knowledge_graph_content = ""
     
@@ -129,12 +120,8 @@ async def generate_summary_pipeline(
         kb_type="l2b_graph"
     )
 
-    if l2b_graph_kb and l2b_graph_kb.source_file_path:
-        logger.info(f"[KB {parent_kb.id}] 找到了 L2b 图谱: {l2b_graph_kb.source_file_path}")
-        graph_path = Path(l2b_graph_kb.source_file_path)
-        if graph_path.exists():
-            async with aiofiles.open(graph_path, mode='r', encoding='utf-8') as f:
-                knowledge_graph_content = await f.read()
+    if l2b_graph_kb:
+        logger.info(f"[KB {parent_kb.id}] 找到了 L2b 图谱 (KB ID: {l2b_graph_kb.id})")
     else:
         logger.info(f"[KB {parent_kb.id}] 未找到 L2b 图谱，将生成标准摘要。")
 
@@ -142,17 +129,29 @@ async def generate_summary_pipeline(
     code_content: str
     context_source: str # 用于提示词
     
+    # 检索到的代码块按生成模型的上下文 token 预算打包
+    token_budget = generation_model.context_token_budget or settings.RAG_CONTEXT_TOKEN_BUDGET
     try:
         file_size = os.path.getsize(source_file_path_str)
-        file_suffix = source_file_path.suffix.lower()
         logger.info(f"源文件大小: {file_size} 字节. (阈值: {FILE_SIZE_THRESHOLD_BYTES} 字节)")
-        if file_suffix in ['.zip', '.rar']:
+        if mode == "hierarchical":
+            # 策略 3 (分层): 覆盖全部源文件，最终摘要基于各顶层目录/文件的摘要
+            logger.info("使用分层摘要 (文件 -> 目录 -> 仓库)...")
+            code_content, tree_stats = await hierarchical_summary.build_summary_tree(
+                db=db,
+                parent_kb=parent_kb,
+                generation_model=generation_model,
+                token_budget=token_budget
+            )
+            context_source = f"各模块的分层摘要 (共 {tree_stats['files']} 个文件)"
+        elif archive_reader.is_archive(source_file_path):
             # 策略 2 (RAG): 如果是压缩包，必须使用 RAG
             logger.info("源是压缩包。强制启动 RAG 检索 (调用 _perform_rag_retrieval)...")
             code_content = await _perform_rag_retrieval(
                 db=db,
                 qdrant=qdrant,
-                parent_kb=parent_kb
+                parent_kb=parent_kb,
+                token_budget=token_budget
             )
             context_source = "RAG 检索到的相关代码块"
         elif file_size < FILE_SIZE_THRESHOLD_BYTES:
@@ -167,7 +166,8 @@ async def generate_summary_pipeline(
             code_content = await _perform_rag_retrieval(
                 db=db,                    # <-- 传入 db
                 qdrant=qdrant,            # <-- 传入 qdrant
-                parent_kb=parent_kb
+                parent_kb=parent_kb,
+                token_budget=token_budget
                 # (注意: 不再需要传入 embedding_model, 
                 #  因为 rag_service 会自己处理)
             )
@@ -180,6 +180,15 @@ async def generate_summary_pipeline(
         logger.error(f"获取上下文内容失败 (KB ID: {parent_kb.id}): {e}", exc_info=True)
         raise RuntimeError(f"Failed to get context for summary: {e}")
 
+    # --- 3b. 只取与代码上下文相关的子图 (而不是整个图谱 JSON) ---
+    if l2b_graph_kb:
+        try:
+            knowledge_graph_content = graph_store.build_summary_context(
+                db, l2b_graph_kb, code_content, max_edges=settings.GRAPH_SUMMARY_MAX_EDGES
+            )
+        except Exception as e:
+            logger.warning(f"[KB {parent_kb.id}] 查询 L2b 子图失败，将生成标准摘要: {e}")
+
 
     # --- 4. 准备动态 Prompt (保持不变) ---
     prompt: str
@@ -203,7 +212,7 @@ async def generate_summary_pipeline(
         
         为了帮助您理解，这里有两份上下文：
         
-        [上下文 1: 关键结构关系知识图谱 (JSON 格式)]:
+        [上下文 1: 关键结构关系知识图谱 (每行一条关系: 主体 -[关系]-> 客体)]:
         {knowledge_graph_content}
 
         [上下文 2: {context_source}]:
@@ -224,31 +233,37 @@ async def generate_summary_pipeline(
         {code_content}
         """
 
-    # --- 5. 调用 LLM API (保持不变) ---
-    logger.info(f"正在调用 LLM: {generation_model.name} (上下文来源: {context_source})")
-    client = AsyncOpenAI(
-        api_key=generation_model.api_key or "DUMMY_KEY",
-        base_url=generation_model.endpoint_url
-    )
-    
-    try:
-        completion = await client.chat.completions.create(
-            model=generation_model.name,
-            messages=[
-                {"role": "system", "content": "You are an expert senior software architect."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.2, 
+    # --- 5. 调用 LLM API (提示词完全相同时复用缓存的摘要，例如源码未改动后重新生成) ---
+    summary_content = llm_output_cache.get(db, llm_output_cache.SUMMARY, generation_model.name, SUMMARY_PROMPT_VERSION, prompt)
+    if summary_content is not None:
+        logger.info(f"[KB {parent_kb.id}] 输入未变化，使用缓存的摘要。")
+    else:
+        logger.info(f"正在调用 LLM: {generation_model.name} (上下文来源: {context_source})")
+        client = get_openai_client(
+            generation_model.endpoint_url,
+            generation_model.api_key or "DUMMY_KEY",
+            "generative"
         )
+    
+        try:
+            completion = await client.chat.completions.create(
+                model=generation_model.name,
+                messages=[
+                    {"role": "system", "content": "You are an expert senior software architect."},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.2, 
+            )
         
-        summary_content = completion.choices[0].message.content
-        if not summary_content:
-            raise ValueError("LLM returned an empty summary.")
+            summary_content = completion.choices[0].message.content
+            if not summary_content:
+                raise ValueError("LLM returned an empty summary.")
             
-    except (httpx.ConnectError, openai.APIError) as e:
-        raise RuntimeError(f"Failed to call generation API: {str(e)}")
-    except Exception as e:
-        raise RuntimeError(f"LLM call failed: {str(e)}")
+        except (httpx.ConnectError, openai.APIError) as e:
+            raise RuntimeError(f"Failed to call generation API: {str(e)}")
+        except Exception as e:
+            raise RuntimeError(f"LLM call failed: {str(e)}")
+        llm_output_cache.put(db, llm_output_cache.SUMMARY, generation_model.name, SUMMARY_PROMPT_VERSION, prompt, summary_content)
 
     # --- 6. 将摘要保存为新文件 (保持不变) ---
     summary_dir = Path("uploads/summaries")
@@ -0,0 +1,207 @@
+# app/services/graph_store.py
+
+# L2b 知识图谱的索引存储 (graph_entities / graph_edges 表):
+#   - 按实体名唯一索引查找种子实体
+#   - 按 (kb_id, source_id) / (kb_id, target_id) 索引做逐跳邻域扩展
+# 摘要管道和 /graph/* 接口只取需要的子图，不再整体加载图谱 JSON。
+
+import json
+import logging
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+import app.crud.crud_graph as crud_graph
+import app.crud.crud_knowledgebase as crud_kb
+from app.models.knowledgebase import KnowledgeBase as models_kb
+
+logger = logging.getLogger(__name__)
+
+# 路径查询时最多访问的实体数 (防止经过超级节点时无限扩展)
+PATH_MAX_VISITED = 20000
+# 从代码中挑选种子实体时最多尝试的标识符个数
+SEED_CANDIDATES = 500
+
+_IDENT_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_.]*")
+
+Edge = Dict[str, str]
+
+
+def _clean_triplets(triplets) -> List[Tuple[str, str, str]]:
+    cleaned = []
+    for t in triplets:
+        if isinstance(t, (list, tuple)) and len(t) == 3 and all(t):
+            cleaned.append((str(t[0]), str(t[1]), str(t[2])))
+        else:
+            logger.warning(f"格式不佳的三元组，已跳过: {t}")
+    return cleaned
+
+
+def store_triplets(db: Session, kb_id: int, triplets) -> Tuple[int, int]:
+    """ 将三元组写入索引表 (整体替换该图谱 KB 已有的数据) """
+    entities, edges = crud_graph.replace_graph(db, kb_id, _clean_triplets(triplets))
+    logger.info(f"[Graph KB {kb_id}] 已索引 {entities} 个实体, {edges} 条边。")
+    return entities, edges
+
+
+def _load_graph_json(path: Path) -> List[Tuple[str, str, str]]:
+    """ 读取 SimpleGraphStore 持久化的 JSON: {"graph_dict": {subj: [[rel, obj], ...]}} """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    graph_dict = data.get("graph_dict", {}) if isinstance(data, dict) else {}
+    return [(subj, rel, obj) for subj, rels in graph_dict.items() for rel, obj in rels]
+
+
+def is_indexed(db: Session, graph_kb_id: int) -> bool:
+    """ 图谱是否已有索引数据 (检索路径只做这个检查，不导入 JSON) """
+    return crud_graph.has_entities(db, graph_kb_id)
+
+
+def ensure_indexed(db: Session, graph_kb: models_kb) -> bool:
+    """
+    旧版本生成的图谱只有 JSON 文件: 首次访问时导入索引表。
+    返回该图谱是否有可查询的数据。
+    """
+    if is_indexed(db, graph_kb.id):
+        return True
+    if not graph_kb.source_file_path or not Path(graph_kb.source_file_path).exists():
+        return False
+    try:
+        triplets = _load_graph_json(Path(graph_kb.source_file_path))
+    except (OSError, ValueError) as e:
+        logger.error(f"[Graph KB {graph_kb.id}] 读取图谱 JSON 失败: {e}")
+        return False
+    if not triplets:
+        return False
+    logger.info(f"[Graph KB {graph_kb.id}] 正在将旧版图谱 JSON 导入索引表...")
+    store_triplets(db, graph_kb.id, triplets)
+    return True
+
+
+def import_legacy_graphs(db: Session) -> int:
+    """
+    worker 启动时把所有只有 JSON 的旧图谱导入索引表，检索时的图谱扩展不必再同步导入。
+    返回导入的图谱数。
+    """
+    imported = 0
+    graph_kb_ids = [kb_id for (kb_id,) in db.query(models_kb.id).filter(models_kb.kb_type == "l2b_graph").all()]
+    for kb_id in graph_kb_ids:
+        if is_indexed(db, kb_id):
+            continue
+        graph_kb = crud_kb.get_kb(db, kb_id)
+        if graph_kb is not None and ensure_indexed(db, graph_kb):
+            imported += 1
+    return imported
+
+
+def resolve_graph_kb(db: Session, kb_id: int) -> Optional[models_kb]:
+    """ kb_id 可以是 L2b 图谱 KB 本身，也可以是它的父 KB """
+    kb = crud_kb.get_kb(db, kb_id)
+    if kb is None:
+        return None
+    if kb.kb_type == "l2b_graph":
+        return kb
+    return crud_kb.find_child_by_type(db=db, parent_id=kb.id, kb_type="l2b_graph")
+
+
+def _to_edges(db: Session, kb_id: int, rows) -> List[Edge]:
+    names = crud_graph.get_entity_names(db, kb_id, {r.source_id for r in rows} | {r.target_id for r in rows})
+    return [{"source": names[r.source_id], "relation": r.relation, "target": names[r.target_id]} for r in rows]
+
+
+def get_neighborhood(db: Session, kb_id: int, seed_names: List[str], hops: int = 1, max_edges: int = 200) -> Dict:
+    """
+    从种子实体出发做 hops 跳的邻域扩展 (出边和入边都算)，最多返回 max_edges 条边。
+    每一跳只查询一次 (IN 当前边界)，结果按 BFS 顺序，离种子越近越靠前。
+    """
+    seeds = crud_graph.get_entity_ids(db, kb_id, seed_names)
+    visited: Set[int] = set(seeds.values())
+    frontier = set(visited)
+    rows, seen_edges = [], set()
+    truncated = False
+
+    for _ in range(max(0, hops)):
+        if not frontier:
+            break
+        # 已收集的边也会被再次查到 (指向上一跳)，limit 要把它们算进去
+        batch = crud_graph.get_edges_touching(db, kb_id, frontier, limit=max_edges + len(seen_edges) + 1)
+        next_frontier: Set[int] = set()
+        for edge in batch:
+            if edge.id in seen_edges:
+                continue
+            if len(rows) >= max_edges:
+                truncated = True
+                break
+            seen_edges.add(edge.id)
+            rows.append(edge)
+            for eid in (edge.source_id, edge.target_id):
+                if eid not in visited:
+                    visited.add(eid)
+                    next_frontier.add(eid)
+        if truncated:
+            break
+        frontier = next_frontier
+
+    return {
+        "seeds": sorted(seeds.keys()),
+        "missing": sorted(set(seed_names) - set(seeds.keys())),
+        "edges": _to_edges(db, kb_id, rows),
+        "truncated": truncated,
+    }
+
+
+def find_path(db: Session, kb_id: int, source: str, target: str, max_hops: int = 4) -> Optional[List[Edge]]:
+    """ 两个实体之间的最短路径 (忽略边方向)，返回沿途的边；找不到时返回 None """
+    ids = crud_graph.get_entity_ids(db, kb_id, [source, target])
+    if source not in ids or target not in ids:
+        return None
+    start, goal = ids[source], ids[target]
+    if start == goal:
+        return []
+
+    parents: Dict[int, object] = {start: None}  # entity_id -> 到达它的边
+    frontier = {start}
+    for _ in range(max(0, max_hops)):
+        if not frontier or len(parents) > PATH_MAX_VISITED:
+            break
+        next_frontier: Set[int] = set()
+        for edge in crud_graph.get_edges_touching(db, kb_id, frontier):
+            for here, there in ((edge.source_id, edge.target_id), (edge.target_id, edge.source_id)):
+                if here in frontier and there not in parents:
+                    parents[there] = edge
+                    next_frontier.add(there)
+        if goal in parents:
+            path, node = [], goal
+            while parents[node] is not None:
+                edge = parents[node]
+                path.append(edge)
+                node = edge.source_id if edge.target_id == node else edge.target_id
+            return _to_edges(db, kb_id, list(reversed(path)))
+        frontier = next_frontier
+    return None
+
+
+def format_edges(edges: List[Edge]) -> str:
+    """ 紧凑的文本格式 (每行一条边)，比 JSON 节省大量 token """
+    return "\n".join(f"{e['source']} -[{e['relation']}]-> {e['target']}" for e in edges)
+
+
+def build_summary_context(db: Session, graph_kb: models_kb, code_content: str, max_edges: int) -> str:
+    """
+    为摘要管道挑选相关子图: 以代码中出现的实体为种子取 1 跳邻域；
+    没有命中时退回度数最高的核心实体。
+    """
+    if not ensure_indexed(db, graph_kb):
+        return ""
+    counts = Counter(_IDENT_RE.findall(code_content or ""))
+    candidates = [name for name, _ in counts.most_common(SEED_CANDIDATES)]
+    seeds = list(crud_graph.get_entity_ids(db, graph_kb.id, candidates).keys())
+    if not seeds:
+        hub_ids = crud_graph.get_top_entities(db, graph_kb.id, limit=20)
+        seeds = list(crud_graph.get_entity_names(db, graph_kb.id, hub_ids).values())
+    result = get_neighborhood(db, graph_kb.id, seeds, hops=1, max_edges=max_edges)
+    logger.info(f"[Graph KB {graph_kb.id}] 摘要子图: {len(seeds)} 个种子实体, {len(result['edges'])} 条边 (截断: {result['truncated']})。")
+    return format_edges(result["edges"])
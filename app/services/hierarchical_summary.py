@@ -0,0 +1,299 @@
+# app/services/hierarchical_summary.py
+
+# L2a 分层 (map-reduce) 摘要: 文件 -> 目录 -> 仓库。
+#   1. map:    每个文件单独摘要，固定数量的 worker 并发 (受 llm_throttle 的并发/速率上限约束)
+#   2. reduce: 目录按深度自底向上汇总子节点摘要，同一深度的目录并发执行
+#   3. 根目录的子节点摘要交给 generation_service 做最终的仓库级摘要
+# 中间结果在每个文件/目录完成时立即写入 summary_nodes 表，输入哈希未变的节点 (源码未改动的文件/目录) 直接复用，
+# 因此中途失败 (例如 API 不可用) 后重新运行只需处理尚未完成的节点。
+
+import asyncio
+import hashlib
+import logging
+from collections import defaultdict
+from pathlib import Path, PurePosixPath
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import openai
+from sqlalchemy.orm import Session
+
+import app.crud.crud_summary_node as crud_summary_node
+from app.core.llm_clients import get_openai_client
+from app.core.llm_throttle import get_model_throttle, call_with_retry
+from app.db.session import SessionLocal
+from app.models.knowledgebase import KnowledgeBase as models_kb
+from app.models.model import Model as models_model
+from app.services import source_files, llm_output_cache
+from app.services.context_packing import count_tokens, truncate_to_tokens
+
+logger = logging.getLogger(__name__)
+
+# 修改提示词时递增，使已持久化的中间摘要失效
+PROMPT_VERSION = "1"
+ROOT_PATH = "."
+# reduce 分组汇总的最大轮数，超过后截断子节点一次汇总
+MAX_REDUCE_DEPTH = 4
+
+
+def _file_prompt(path: str, code: str) -> str:
+    return f"""
+    请为下面的源文件撰写简洁的 Markdown 摘要 (不超过 200 字)，包括:
+    1. 文件的主要职责。
+    2. 定义的关键类、函数或组件，以及对外暴露的接口。
+    3. 它依赖或调用的其他模块 (如果能看出来)。
+    只返回摘要本身。
+    ---
+    源文件 ({path}):
+    ---
+    {code}
+    """
+
+
+def _directory_prompt(path: str, children: str) -> str:
+    return f"""
+    下面是目录 "{path}" 中各文件/子目录的摘要。
+    请把它们汇总为该目录的 Markdown 摘要 (不超过 300 字): 目录整体职责、核心组件、组件之间的协作关系。
+    只返回摘要本身。
+    ---
+    {children}
+    """
+
+
+def _hash(*parts: str) -> str:
+    digest = hashlib.sha256(PROMPT_VERSION.encode("utf-8"))
+    for part in parts:
+        digest.update(b"\0")
+        digest.update(part.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _parent(path: str) -> str:
+    parent = str(PurePosixPath(path).parent)
+    return ROOT_PATH if parent in ("", ".") else parent
+
+
+def _format_children(children: List[Tuple[str, str]]) -> str:
+    return "\n\n".join(f"### {name}\n{summary}" for name, summary in children)
+
+
+def _upsert_nodes(kb_id: int, model_id: int, rows: List[dict]) -> None:
+    db = SessionLocal()
+    try:
+        crud_summary_node.upsert_nodes(db, kb_id, model_id, rows)
+    finally:
+        db.close()
+
+
+class _Summarizer:
+    """ 一次分层摘要运行的共享状态 (LLM 客户端、限流器、token 预算) """
+
+    def __init__(self, kb_id: int, generation_model: models_model, token_budget: int):
+        self.kb_id = kb_id
+        self.model = generation_model
+        self.token_budget = token_budget
+        # 重试由 call_with_retry 在限流器外完成，关闭 SDK 自带的重试 (共享同一个连接池)
+        self.client = get_openai_client(generation_model.endpoint_url, generation_model.api_key or "DUMMY_KEY", "generative").with_options(max_retries=0)
+        self.throttle = get_model_throttle(generation_model.endpoint_url, generation_model.name)
+        self.calls = 0
+        self.new_nodes = 0
+
+    async def save(self, rows: List[dict]) -> None:
+        """ 节点完成后立即持久化 (工作线程 + 独立会话，并发的 worker 不共享 Session) """
+        if not rows:
+            return
+        self.new_nodes += len(rows)
+        try:
+            await asyncio.to_thread(_upsert_nodes, self.kb_id, self.model.id, rows)
+        except Exception as e:
+            logger.warning(f"[KB {self.kb_id}] 保存摘要节点失败 ({rows[0]['path']} 等 {len(rows)} 个): {e}")
+
+    async def complete(self, prompt: str, description: str) -> str:
+        try:
+            completion = await call_with_retry(
+                self.throttle,
+                lambda: self.client.chat.completions.create(
+                    model=self.model.name,
+                    messages=[
+                        {"role": "system", "content": "You are an expert senior software architect."},
+                        {"role": "user", "content": prompt}
+                    ],
+                    temperature=0.2,
+                ),
+                description=description
+            )
+        except (httpx.ConnectError, openai.APIError) as e:
+            raise RuntimeError(f"Failed to call generation API: {str(e)}")
+        self.calls += 1
+        content = completion.choices[0].message.content
+        if not content or not content.strip():
+            raise ValueError(f"LLM returned an empty summary for {description}.")
+        return content.strip()
+
+    async def reduce(self, path: str, children: List[Tuple[str, str]], depth: int = 0) -> str:
+        """
+        汇总子节点摘要。超出 token 预算时先按预算分组分别汇总，再对分组结果递归汇总。
+        每一轮的分组数必须少于子节点数 (否则没有进展)，且最多 MAX_REDUCE_DEPTH 轮；
+        不满足时把每个子节点截断到预算的平均份额后一次汇总。
+        """
+        # 单个子节点截断到预算的一半。加上标题后两个子节点仍可能超出预算，所以下面还要检查分组是否有进展
+        per_child = max(1, self.token_budget // 2)
+        children = [(name, truncate_to_tokens(summary, per_child)) for name, summary in children]
+        text = _format_children(children)
+        if count_tokens(text) <= self.token_budget:
+            return await self.complete(_directory_prompt(path, text), f"summary of {path}/")
+
+        groups: List[List[Tuple[str, str]]] = [[]]
+        used = 0
+        for child in children:
+            tokens = count_tokens(_format_children([child]))
+            if groups[-1] and used + tokens > self.token_budget:
+                groups.append([])
+                used = 0
+            groups[-1].append(child)
+            used += tokens
+        if len(groups) >= len(children) or depth >= MAX_REDUCE_DEPTH:
+            share = max(1, self.token_budget // len(children))
+            text = _format_children([(name, truncate_to_tokens(summary, share)) for name, summary in children])
+            return await self.complete(_directory_prompt(path, text), f"summary of {path}/")
+        partials = await asyncio.gather(*(
+            self.complete(_directory_prompt(path, _format_children(group)), f"summary of {path}/ (part {i + 1})")
+            for i, group in enumerate(groups)
+        ))
+        return await self.reduce(path, [(f"{path} (part {i + 1})", p) for i, p in enumerate(partials)], depth + 1)
+
+
+async def _map_files(summarizer: _Summarizer, sources: Dict[str, str], todo: List[str], file_hashes: Dict[str, str]) -> Dict[str, str]:
+    """ 并发摘要需要重新生成的文件，固定数量的 worker 从队列取任务；每个文件完成即写入节点和 LLM 输出缓存 """
+    results: Dict[str, str] = {}
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in enumerate(todo):
+        queue.put_nowait(item)
+
+    async def worker():
+        while True:
+            try:
+                i, path = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            logger.info(f"正在摘要文件 {i + 1}/{len(todo)}: {path}")
+            code = truncate_to_tokens(sources[path], summarizer.token_budget)
+            try:
+                summary = await summarizer.complete(_file_prompt(path, code), path)
+            except ValueError as e:
+                logger.warning(f"跳过文件 {path}: {e}")
+                continue
+            results[path] = summary
+            await summarizer.save([{"path": path, "level": "file", "input_hash": file_hashes[path], "summary": summary}])
+            await llm_output_cache.put_async(
+                llm_output_cache.FILE_SUMMARY, summarizer.model.name, PROMPT_VERSION, sources[path], summary
+            )
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(summarizer.throttle.concurrency, len(todo)))]
+    try:
+        await asyncio.gather(*workers)
+    except BaseException:
+        # API 不可用等致命错误时停止其余 worker
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        raise
+    return results
+
+
+async def build_summary_tree(
+    db: Session,
+    parent_kb: models_kb,
+    generation_model: models_model,
+    token_budget: int
+) -> Tuple[str, Dict[str, int]]:
+    """
+    生成 (或复用) 整棵摘要树，返回 (根目录子节点摘要的拼接文本, 统计信息)。
+    返回文本不超过 token_budget，作为最终仓库级摘要的输入。
+    """
+    source_path = Path(parent_kb.source_file_path)
+    sources: Dict[str, str] = dict(await asyncio.to_thread(lambda: list(source_files.iter_source_texts(source_path))))
+    if not sources:
+        raise ValueError(f"在 {source_path} 中未找到可摘要的源代码文件。")
+
+    existing = crud_summary_node.get_nodes(db, parent_kb.id, generation_model.id)
+    summarizer = _Summarizer(parent_kb.id, generation_model, token_budget)
+    nodes: Dict[str, Tuple[str, str]] = {}   # path -> (input_hash, summary)
+
+    # --- 1. map: 文件级摘要 (内容哈希未变的文件复用已有摘要) ---
+    file_hashes = {path: _hash(path, text) for path, text in sources.items()}
+    todo = []
+    for path, input_hash in file_hashes.items():
+        node = existing.get(path)
+        if node is not None and node.input_hash == input_hash:
+            nodes[path] = (input_hash, node.summary)
+        else:
+            todo.append(path)
+    # 本 KB 没有记录的文件再查全局 LLM 输出缓存 (其他 KB / 改名 / 移动的同内容文件)
+    cached = llm_output_cache.lookup(
+        db, llm_output_cache.FILE_SUMMARY, generation_model.name, PROMPT_VERSION, [sources[p] for p in todo]
+    )
+    summaries = {path: summary for path, summary in zip(todo, cached) if summary is not None}
+    todo = [path for path in todo if path not in summaries]
+    logger.info(f"[KB {parent_kb.id}] 分层摘要: {len(sources)} 个文件，{len(todo)} 个需要调用模型。")
+    await summarizer.save([
+        {"path": path, "level": "file", "input_hash": file_hashes[path], "summary": summary}
+        for path, summary in summaries.items()
+    ])
+
+    summaries.update(await _map_files(summarizer, sources, todo, file_hashes))
+    for path, summary in summaries.items():
+        nodes[path] = (file_hashes[path], summary)
+
+    # --- 2. 构建目录树 ---
+    children: Dict[str, List[str]] = defaultdict(list)
+    for path in nodes:
+        child = path
+        while child != ROOT_PATH:
+            parent = _parent(child)
+            if child not in children[parent]:
+                children[parent].append(child)
+            child = parent
+
+    # --- 3. reduce: 自底向上汇总目录，同一深度并发 ---
+    directories = [d for d in children if d != ROOT_PATH]
+    by_depth: Dict[int, List[str]] = defaultdict(list)
+    for directory in directories:
+        by_depth[len(PurePosixPath(directory).parts)].append(directory)
+
+    async def summarize_directory(directory: str) -> None:
+        kids = sorted(children[directory])
+        if len(kids) == 1:
+            # 只有一个子节点的目录 (例如 src/app/) 直接沿用子节点摘要
+            nodes[directory] = nodes[kids[0]]
+            return
+        kid_summaries = [(PurePosixPath(k).name, nodes[k][1]) for k in kids]
+        input_hash = _hash(directory, *(nodes[k][0] for k in kids))
+        node = existing.get(directory)
+        if node is not None and node.input_hash == input_hash:
+            nodes[directory] = (input_hash, node.summary)
+            return
+        summary = await summarizer.reduce(directory, kid_summaries)
+        nodes[directory] = (input_hash, summary)
+        await summarizer.save([{"path": directory, "level": "directory", "input_hash": input_hash, "summary": summary}])
+
+    for depth in sorted(by_depth, reverse=True):
+        await asyncio.gather(*(summarize_directory(d) for d in by_depth[depth]))
+
+    # --- 4. 删除已不在源码树中的节点 (新节点在完成时已写入) ---
+    crud_summary_node.delete_missing(db, parent_kb.id, generation_model.id, list(nodes))
+
+    # --- 5. 根目录: 子节点摘要超出预算时先分组压缩 ---
+    top_level = [(k, nodes[k][1]) for k in sorted(children[ROOT_PATH])]
+    root_text = _format_children(top_level)
+    if count_tokens(root_text) > token_budget:
+        root_text = await summarizer.reduce(parent_kb.name, top_level)
+
+    stats = {
+        "files": len(sources),
+        "directories": len(directories),
+        "reused_nodes": len(nodes) - summarizer.new_nodes,
+        "llm_calls": summarizer.calls,
+    }
+    logger.info(f"[KB {parent_kb.id}] 分层摘要完成: {stats}")
+    return root_text, stats
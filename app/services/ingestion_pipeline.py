@@ -2,41 +2,55 @@
 
 
 import logging
-import time
-import zipfile
-import rarfile  # <-- 1. 新增导入
-from pathlib import Path
-from typing import Optional, List, Dict, Any
+import tempfile
+from pathlib import Path, PurePosixPath
+from typing import Optional, List, Dict, Any, Iterator, AsyncIterator, Tuple, Deque
 import asyncio
+import hashlib
+import multiprocessing
 import os
-import shutil
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from sqlalchemy.sql import func
 # (导入 OpenAI 库)
-from openai import AsyncOpenAI, APIError, APIConnectionError, RateLimitError
+from openai import APIError, APIConnectionError, RateLimitError
 
 from sqlalchemy.orm import Session
 from qdrant_client import QdrantClient, models
-from llama_index.core import SimpleDirectoryReader
+from llama_index.core import SimpleDirectoryReader, Document
+from llama_index.core.schema import BaseNode
 
-from llama_index.core.node_parser import SentenceSplitter, CodeSplitter, MarkdownNodeParser
 
-from app.crud import crud_knowledgebase
+from app.crud import crud_knowledgebase, crud_kb_file_manifest
 
 from app.db.session import SessionLocal
+from app.core.llm_clients import get_openai_client, close_openai_clients
+from app.core.config import settings
+from app.services import archive_reader, corpus_filter, embedding_cache, vector_store, static_extractor
+from app.services.splitting import split_documents
+from app.services.embedding_scheduler import EmbeddingScheduler, get_endpoint_concurrency
 
 logger = logging.getLogger(__name__)
 
 # --- Configuration Constants ---
-CHUNK_SIZE = 1024 
-CHUNK_OVERLAP = 100 
-CODE_CHUNK_LINES = 100       
-CODE_CHUNK_OVERLAP = 20      
-CODE_MAX_CHARS = 4000        
+# (Chunk sizes live in app/services/splitting.py)
 BATCH_SIZE = 10
+PARALLEL_SPLIT_MIN_FILES = 8 # Smaller sources are split in-process; spawning workers costs more than it saves
+UPSERT_BATCH_SIZE = 256      # Points buffered before each Qdrant upsert
+MANIFEST_WRITE_BATCH = 500
+SOURCE_PATH_KEY = "metadata.source_path" # Payload key used to address all chunks of one file
 
 # --- Helper Function: Update Status ---
-def _update_parsing_status(db: Session, kb_id: int, stage: str, progress: Optional[int] = None, message: str = "") -> bool:
-    """ Updates the parsing status in the database. Returns False if processing should stop. """
+def _update_parsing_status(db: Session, kb_id: int, stage: str, progress: Optional[int] = None, message: str = "", extra: Optional[Dict[str, Any]] = None, cancel_event: Optional[threading.Event] = None) -> bool:
+    """
+    Updates the parsing status in the database. Returns False if processing should stop.
+    cancel_event is set by the worker when its job lease is lost: another run may own the KB now, so nothing is written.
+    """
+    if cancel_event is not None and cancel_event.is_set():
+        logger.warning(f"[KB {kb_id}] Job lease lost, stopping without updating status.")
+        return False
     try:
         db_kb = crud_knowledgebase.get_kb(db, kb_id)
         if db_kb:
@@ -45,6 +59,7 @@ def _update_parsing_status(db: Session, kb_id: int, stage: str, progress: Option
                 return False
             new_state = {"stage": stage, "message": message}
             if progress is not None: new_state["progress"] = progress
+            if extra: new_state.update(extra)
             db_kb.parsing_state = new_state
             # db_kb.updated_at = func.now()
             db.commit()
@@ -59,42 +74,37 @@ def _update_parsing_status(db: Session, kb_id: int, stage: str, progress: Option
         except Exception as rb_err: logger.error(f"[KB {kb_id}] Rollback failed: {rb_err}")
         return False
 
-# --- Helper Function: Extract Archive (ZIP or RAR) ---
-# <-- 2. 函数被重构
-def _extract_archive(archive_path: Path, extract_to: Path):
-    """ Extracts a ZIP or RAR file. """
-    suffix = archive_path.suffix.lower()
-    logger.info(f"Attempting to extract '{archive_path}' (format: {suffix}) to '{extract_to}'")
-
-    if suffix == '.zip':
-        try:
-            with zipfile.ZipFile(archive_path, 'r') as zip_ref:
-                zip_ref.extractall(extract_to)
-            logger.info(f"Successfully extracted ZIP '{archive_path}'")
-        except zipfile.BadZipFile:
-            logger.error(f"Error: '{archive_path}' is not a valid zip file or is corrupted.")
-            raise ValueError("Invalid or corrupted zip file.")
-        except Exception as e:
-            logger.error(f"Error extracting zip file '{archive_path}': {e}")
-            raise
-    
-    elif suffix == '.rar':
+# --- Helper Function: Stream Archive Members As Documents (no extraction to disk) ---
+def _load_rich_member(member_path: str, data: bytes) -> List[Document]:
+    """ Rich formats are parsed from a single short-lived temp file (only that member ever touches disk). """
+    fd, tmp_name = tempfile.mkstemp(suffix=PurePosixPath(member_path).suffix)
+    try:
+        with os.fdopen(fd, 'wb') as tmp: tmp.write(data)
+        return SimpleDirectoryReader(input_files=[tmp_name]).load_data()
+    finally:
+        try: os.unlink(tmp_name)
+        except OSError: pass
+
+def _iter_archive_documents(archive_path: Path, corpus: corpus_filter.CorpusFilter) -> Iterator[List[Document]]:
+    """ One document list per accepted member, decompressed straight into memory in archive order. """
+    # Formats that need a LlamaIndex file reader; every other member is decoded as text in memory
+    for member_path, data in archive_reader.iter_members(archive_path, corpus.accept_path):
+        if not corpus.accept_content(member_path, data[:corpus_filter.SNIFF_BYTES], len(data)):
+            yield []
+            continue
+        name = PurePosixPath(member_path).name
         try:
-            with rarfile.RarFile(archive_path, 'r') as rar_ref:
-                rar_ref.extractall(extract_to)
-            logger.info(f"Successfully extracted RAR '{archive_path}'")
-        except rarfile.BadRarFile:
-             logger.error(f"Error: '{archive_path}' is not a valid RAR file or is corrupted.")
-             raise ValueError("Invalid or corrupted RAR file.")
+            if member_path.lower().endswith(corpus_filter.RICH_DOCUMENT_SUFFIXES):
+                docs = _load_rich_member(member_path, data)
+            else:
+                docs = [Document(text=data.decode("utf-8", errors="ignore"))]
         except Exception as e:
-            logger.error(f"Error extracting RAR file '{archive_path}': {e}")
-            raise
-    else:
-        logger.error(f"Unsupported archive format for extraction: {suffix}")
-        raise ValueError(f"Unsupported archive format: {suffix}. Only .zip and .rar are supported.")
-
+            logger.warning(f"Failed to load '{member_path}' from '{archive_path.name}': {e}")
+            docs = []
+        for doc in docs:
+            doc.metadata = {**(doc.metadata or {}), "file_path": member_path, "file_name": name, "file_size": len(data), "source_path": member_path}
+        yield docs
 
-# --- Helper Function: Get Embeddings via DashScope OpenAI Compatible API ---
 async def get_embeddings_from_api(
     texts: List[str],
     base_url: str, # <-- 使用 base_url
@@ -111,8 +121,8 @@ async def get_embeddings_from_api(
          raise ValueError("DashScope API key is required.")
 
 
-    # 初始化 OpenAI 异步客户端，指定 base_url
-    client = AsyncOpenAI(api_key=api_key, base_url=base_url)
+    # 复用按端点缓存的 OpenAI 异步客户端 (保持 HTTP keep-alive 连接)
+    client = get_openai_client(base_url, api_key, "embedding")
 
     # 准备传递给 create 方法的参数
     create_params = {
@@ -158,26 +168,336 @@ async def get_embeddings_from_api(
         logger.error(f"Error getting embeddings from DashScope API (model: {model_name}): {e}", exc_info=True)
         raise ValueError(f"Failed to get embeddings from DashScope: {e}")
 
+# --- Helper Function: Get Embeddings Through The Persistent Cache ---
+async def get_embeddings_with_cache(
+    texts: List[str],
+    base_url: str,
+    model_name: str,
+    api_key: str,
+    dimensions: Optional[int] = None,
+    run_stats: Optional[embedding_cache.CacheStats] = None
+) -> List[List[float]]:
+    """
+    Serves cached vectors and only calls the embedding API for the misses.
+    Cache reads/writes run in a worker thread on their own session: this is called concurrently
+    from the embedding fan-out, and must neither block the event loop nor commit on a shared Session.
+    """
+    if not settings.EMBEDDING_CACHE_ENABLED:
+        return await get_embeddings_from_api(texts=texts, base_url=base_url, model_name=model_name, api_key=api_key, dimensions=dimensions)
+
+    cached = await embedding_cache.lookup_async(model_name, dimensions, texts)
+    miss_indices = [i for i, vec in enumerate(cached) if vec is None]
+    hits = len(texts) - len(miss_indices)
+    embedding_cache.stats.record(hits, len(miss_indices))
+    if run_stats: run_stats.record(hits, len(miss_indices))
+
+    if miss_indices:
+        miss_texts = [texts[i] for i in miss_indices]
+        fresh = await get_embeddings_from_api(texts=miss_texts, base_url=base_url, model_name=model_name, api_key=api_key, dimensions=dimensions)
+        await embedding_cache.store_async(model_name, dimensions, miss_texts, fresh)
+        for i, vec in zip(miss_indices, fresh):
+            cached[i] = vec
+    return cached
+
+# --- Helper Function: Ensure Collection Matches The Discovered Dimension ---
+def _get_collection_dimension(qdrant: QdrantClient, collection_name: str) -> Optional[int]:
+    """ Returns the (unnamed) vector size of an existing collection, or None. """
+    if not qdrant.collection_exists(collection_name): return None
+    params = qdrant.get_collection(collection_name).config.params.vectors
+    if isinstance(params, models.VectorParams): return params.size
+    if isinstance(params, dict) and params: return (params.get('') or next(iter(params.values()))).size
+    return None
+
+def _ensure_collection(qdrant: QdrantClient, kb_id: int, collection_name: str, model_dimensions: Optional[int], discovered_dimension: int, keep_existing: bool = False, storage_profile: Optional[str] = None) -> bool:
+    """
+    Validates or (re)creates the Qdrant collection once the first batch reveals the vector size.
+    Returns whether the collection carries the sparse (BM25) vector; legacy collections kept in incremental mode do not.
+    """
+    if discovered_dimension <= 0:
+        raise ValueError(f"API returned an invalid dimension: {discovered_dimension}")
+    if vector_store.is_shared_collection(collection_name):
+        # Shared collection: created once for the model, never recreated on behalf of a single KB
+        if model_dimensions and model_dimensions != discovered_dimension:
+            raise ValueError(f"Configuration mismatch: DB dimension ({model_dimensions}) != API dimension ({discovered_dimension})")
+        vector_store.ensure_shared_collection(qdrant, collection_name, discovered_dimension)
+    else:
+        _ensure_collection_vectors(qdrant, kb_id, collection_name, model_dimensions, discovered_dimension, keep_existing, storage_profile)
+    # Index used to delete/replace the chunks of a single file during incremental re-parses
+    # and to look up chunks by the entities they define (graph-expanded retrieval)
+    for key in (SOURCE_PATH_KEY, vector_store.DEFINES_KEY):
+        try: qdrant.create_payload_index(collection_name, field_name=key, field_schema=models.PayloadSchemaType.KEYWORD)
+        except Exception as e: logger.debug(f"[KB {kb_id}] Payload index on '{key}' not created: {e}")
+    with_sparse = vector_store.has_sparse_vectors(qdrant, collection_name)
+    if not with_sparse: logger.warning(f"[KB {kb_id}] Collection '{collection_name}' has no sparse vectors; writing dense-only points (full re-parse enables hybrid search).")
+    return with_sparse
+
+def _ensure_collection_vectors(qdrant: QdrantClient, kb_id: int, collection_name: str, model_dimensions: Optional[int], discovered_dimension: int, keep_existing: bool, storage_profile: Optional[str] = None):
+
+    # 检查预设维度 (来自 kb_service, 对于 Ollama 是 None)
+    if model_dimensions:
+        # (情况 A) 维度是预设的 (例如 BAAI, OpenAI)
+        # kb_service.py 应该已经创建了集合
+        logger.info(f"[KB {kb_id}] Using pre-configured Qdrant collection '{collection_name}' (Expected dim: {model_dimensions}).")
+        if model_dimensions != discovered_dimension:
+            # 这是一个严重的配置错误
+            logger.error(f"[KB {kb_id}] FATAL: Pre-set dimension ({model_dimensions}) does not match API discovered dimension ({discovered_dimension}).")
+            raise ValueError(f"Configuration mismatch: DB dimension ({model_dimensions}) != API dimension ({discovered_dimension})")
+
+        # (可选的安全检查) 确保集合存在
+        try:
+            if not qdrant.collection_exists(collection_name):
+                logger.warning(f"[KB {kb_id}] Collection was missing! Recreating with pre-set dim: {model_dimensions}")
+                vector_store.recreate_collection(qdrant, collection_name, model_dimensions, storage_profile)
+        except Exception as e:
+            logger.error(f"[KB {kb_id}] Failed safety check for collection: {e}")
+            raise
+
+    elif keep_existing and _get_collection_dimension(qdrant, collection_name) == discovered_dimension:
+        # (情况 B1) 增量模式: 沿用上次解析创建的集合
+        logger.info(f"[KB {kb_id}] Incremental mode: keeping existing collection '{collection_name}' (dim {discovered_dimension}).")
+        vector_store.apply_storage_profile(qdrant, collection_name, storage_profile)
+
+    else:
+        # (情况 B) 维度是 None (例如 Ollama)
+        # 我们 *必须* 在这里创建集合
+        logger.warning(f"[KB {kb_id}] Model dimension was None. Creating collection '{collection_name}' with discovered dimension: {discovered_dimension}")
+        try:
+            # 使用 recreate_collection 来安全地覆盖任何旧的、维度错误的集合
+            vector_store.recreate_collection(qdrant, collection_name, discovered_dimension, storage_profile)
+            logger.info(f"[KB {kb_id}] Successfully created/recreated collection '{collection_name}' with dim {discovered_dimension}.")
+        except Exception as e:
+            logger.error(f"[KB {kb_id}] Failed to dynamically create Qdrant collection: {e}", exc_info=True)
+            raise ValueError(f"Failed to create Qdrant collection: {e}")
+
+# --- Helper Functions: Stable File Identity For Incremental Re-Parsing ---
+def _relative_source_path(file_path_meta: str, source_root: Path) -> str:
+    """ Path of a document relative to the archive/directory root (stable across temp extract dirs). """
+    try: return Path(file_path_meta).resolve().relative_to(source_root.resolve()).as_posix()
+    except ValueError: return Path(file_path_meta).name
+
+def _hash_documents(docs: List[Document]) -> str:
+    h = hashlib.sha256()
+    for doc in docs:
+        h.update(doc.get_content().encode("utf-8")); h.update(b"\x00")
+    return h.hexdigest()
+
+def _make_point_id(kb_id: int, source_path: str, chunk_index: int) -> str:
+    """ Deterministic point ID: the same file/chunk position always maps to the same point. """
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"kb://{kb_id}/{source_path}#{chunk_index}"))
+
+def _delete_file_points(qdrant: QdrantClient, kb_id: int, collection_name: str, source_paths: List[str]):
+    """ Removes every chunk belonging to the given files (only this KB's points in a shared collection). """
+    if not source_paths: return
+    file_filter = models.Filter(must=[models.FieldCondition(key=SOURCE_PATH_KEY, match=models.MatchAny(any=source_paths))])
+    qdrant.delete(
+        collection_name=collection_name,
+        points_selector=models.FilterSelector(filter=vector_store.scope_filter(collection_name, [kb_id], file_filter)),
+        wait=True
+    )
+
+def _delete_point_ids(qdrant: QdrantClient, collection_name: str, point_ids: List[str]):
+    """ Removes specific points; IDs are derived from (kb_id, path, chunk index), so they never touch another KB. """
+    for i in range(0, len(point_ids), UPSERT_BATCH_SIZE):
+        qdrant.delete(collection_name=collection_name, points_selector=models.PointIdsList(points=point_ids[i:i + UPSERT_BATCH_SIZE]), wait=True)
+
+def _resolve_split_workers(total_files: int) -> int:
+    """ Number of splitting processes for this run (INGESTION_SPLIT_WORKERS, 0 = one per CPU core). """
+    if total_files < PARALLEL_SPLIT_MIN_FILES: return 1
+    configured = settings.INGESTION_SPLIT_WORKERS or (os.cpu_count() or 1)
+    return max(1, min(configured, total_files))
+
+# --- Streaming Stages: files -> splitter -> embedding batches -> batched Qdrant upserts ---
+async def _run_streaming_stages(
+    db: Session,
+    qdrant: QdrantClient,
+    kb_id: int,
+    collection_name: str,
+    file_documents: Iterator[List[Document]],
+    total_files: int,
+    source_root: Path,
+    batch_size: int,
+    model_base_url: str,
+    model_name: str,
+    model_api_key: str,
+    model_dimensions: Optional[int],
+    embedding_model_id: Optional[int] = None,
+    incremental: bool = False,
+    storage_profile: Optional[str] = None,
+    cancel_event: Optional[threading.Event] = None
+) -> Optional[Dict[str, int]]:
+    """
+    Runs the staged pipeline on one event loop, holding only a bounded window in memory:
+    at most `concurrency` embedding batches in flight plus one pending upsert buffer.
+    In incremental mode, files whose content hash matches the manifest are skipped,
+    changed files are re-split and re-embedded, and files that disappeared are removed.
+    Returns the run counters, or None if processing should stop.
+    """
+    counters = {"files": 0, "skipped": 0, "empty": 0, "deleted": 0, "nodes": 0, "uploaded": 0}
+    manifest = await asyncio.to_thread(crud_kb_file_manifest.get_manifest, db, kb_id) if incremental else {}
+    seen_paths = set()
+    manifest_updates: List[dict] = []
+    # Chunks of changed files beyond their new chunk count; deleted only after the new chunks are upserted
+    stale_point_ids: List[str] = []
+
+    def read_next_file() -> Optional[Tuple[str, str, List[Document]]]:
+        # Runs in a worker thread: loads one file, hashes it and diffs it against the manifest
+        docs = next(file_documents, None)
+        if docs is None: return None
+        counters["files"] += 1
+        if not docs:
+            counters["empty"] += 1 # Unreadable, or dropped by the content filter
+            return ("", "", [])
+        # Archive members already carry their in-archive path
+        source_path = docs[0].metadata.get('source_path') or _relative_source_path(docs[0].metadata.get('file_path', ''), source_root)
+        content_hash = _hash_documents(docs)
+        seen_paths.add(source_path)
+        previous = manifest.get(source_path)
+        if previous and previous.content_hash == content_hash and previous.embedding_model_id == embedding_model_id:
+            counters["skipped"] += 1
+            return (source_path, content_hash, [])
+        # Changed files keep serving their old chunks until the new ones overwrite them (same point IDs)
+        return (source_path, content_hash, docs)
+
+    def assign_identity(source_path: str, content_hash: str, nodes: List[BaseNode]) -> List[BaseNode]:
+        previous = manifest.get(source_path)
+        if previous and previous.chunk_count > len(nodes):
+            stale_point_ids.extend(_make_point_id(kb_id, source_path, i) for i in range(len(nodes), previous.chunk_count))
+        for chunk_index, node in enumerate(nodes):
+            node.id_ = _make_point_id(kb_id, source_path, chunk_index)
+            node.metadata = {**(node.metadata or {}), "source_path": source_path, "chunk_index": chunk_index}
+        manifest_updates.append({"file_path": source_path, "content_hash": content_hash, "chunk_count": len(nodes), "embedding_model_id": embedding_model_id})
+        return nodes
+
+    split_workers = _resolve_split_workers(total_files)
+    split_pool = ProcessPoolExecutor(max_workers=split_workers, mp_context=multiprocessing.get_context("spawn")) if split_workers > 1 else None
+
+    async def split_files() -> AsyncIterator[List[BaseNode]]:
+        # Fans files out to the process pool (or one thread) and yields their nodes in file order,
+        # keeping at most `window` files in flight so results merge deterministically with bounded memory
+        loop = asyncio.get_running_loop()
+        window = 2 * split_workers if split_pool else 1
+        pending: Deque[Tuple[str, str, asyncio.Future]] = deque()
+        while True:
+            item = await asyncio.to_thread(read_next_file)
+            if item is None: break
+            source_path, content_hash, docs = item
+            if not docs: continue
+            if split_pool: future = loop.run_in_executor(split_pool, split_documents, kb_id, docs)
+            else: future = asyncio.ensure_future(asyncio.to_thread(split_documents, kb_id, docs))
+            pending.append((source_path, content_hash, future))
+            if len(pending) >= window:
+                source_path, content_hash, future = pending.popleft()
+                yield assign_identity(source_path, content_hash, await future)
+        while pending:
+            source_path, content_hash, future = pending.popleft()
+            yield assign_identity(source_path, content_hash, await future)
+
+    async def node_batches() -> AsyncIterator[List[BaseNode]]:
+        buffer: List[BaseNode] = []
+        async for nodes in split_files():
+            counters["nodes"] += len(nodes)
+            buffer.extend(nodes)
+            while len(buffer) >= batch_size:
+                yield buffer[:batch_size]
+                buffer = buffer[batch_size:]
+        if buffer: yield buffer
+
+    cache_stats = embedding_cache.CacheStats()
+
+    async def embed_fn(node_batch: List[BaseNode]) -> List[List[float]]:
+        return await get_embeddings_with_cache(
+            texts=[node.get_content() for node in node_batch],
+            base_url=model_base_url, # Pass base_url
+            model_name=model_name,
+            api_key=model_api_key,
+            dimensions=model_dimensions, # Pass dimensions
+            run_stats=cache_stats
+        )
+
+    async def flush(points: List[models.PointStruct]):
+        await asyncio.to_thread(qdrant.upsert, collection_name=collection_name, points=points, wait=True)
+        counters["uploaded"] += len(points)
+        logger.debug(f"[KB {kb_id}] Upserted {len(points)} points ({counters['uploaded']} total).")
+
+    scheduler = EmbeddingScheduler(embed_fn, get_endpoint_concurrency(model_base_url))
+    logger.info(f"[KB {kb_id}] Streaming {total_files} file(s) through splitter ({split_workers} worker(s)) -> embedding (batch {batch_size}, concurrency {scheduler.max_concurrency}) -> Qdrant (upsert batch {UPSERT_BATCH_SIZE}).")
+
+    collection_ready = False
+    with_sparse = True
+    points_to_upload: List[models.PointStruct] = []
+    batches_done = 0
+    try:
+        async for node_batch, embeddings_batch in scheduler.iter_embeddings(node_batches()):
+            if not collection_ready:
+                with_sparse = await asyncio.to_thread(_ensure_collection, qdrant, kb_id, collection_name, model_dimensions, len(embeddings_batch[0]), incremental, storage_profile)
+                collection_ready = True
+            for node, vector in zip(node_batch, embeddings_batch):
+                text = node.get_content()
+                payload = {"text": text, "metadata": node.metadata or {}, vector_store.DEFINES_KEY: static_extractor.defined_names(text), vector_store.KB_ID_KEY: vector_store.kb_id_value(kb_id)}
+                points_to_upload.append(vector_store.make_point(str(node.node_id), vector, text, payload, with_sparse))
+            if len(points_to_upload) >= UPSERT_BATCH_SIZE:
+                await flush(points_to_upload); points_to_upload = []
+
+            batches_done += 1
+            progress = 20 + int(75 * counters["files"] / max(total_files, 1))
+            if not _update_parsing_status(db, kb_id, "embedding", progress, f"Files {counters['files']}/{total_files} ({counters['skipped']} unchanged), embedded batch {batches_done}, {counters['uploaded']} points uploaded...", cancel_event=cancel_event):
+                return None
+
+        if points_to_upload:
+            if not _update_parsing_status(db, kb_id, "uploading", 95, f"Uploading final {len(points_to_upload)} points to Qdrant...", cancel_event=cancel_event): return None
+            await flush(points_to_upload)
+    except ValueError as api_err:
+        logger.error(f"[KB {kb_id}] Streaming ingestion failed after batch {batches_done}: {api_err}"); raise
+    finally:
+        # 本循环随 asyncio.run 结束，关闭在其上创建的连接池
+        await close_openai_clients()
+        if split_pool: await asyncio.to_thread(split_pool.shutdown, wait=True, cancel_futures=True)
+
+    if counters["nodes"] == 0 and not incremental: raise ValueError("Splitting resulted in zero nodes across all files.")
+
+    # Every new chunk is stored now: drop the leftover tail of files that shrank
+    if stale_point_ids:
+        await asyncio.to_thread(_delete_point_ids, qdrant, collection_name, stale_point_ids)
+
+    # Files present in the manifest but missing from this upload were deleted
+    # (blocking Qdrant/DB calls run in a thread like every other call here; nothing else uses db meanwhile)
+    deleted_paths = [path for path in manifest if path not in seen_paths]
+    if deleted_paths:
+        await asyncio.to_thread(_delete_file_points, qdrant, kb_id, collection_name, deleted_paths)
+        await asyncio.to_thread(crud_kb_file_manifest.delete_entries, db, kb_id, deleted_paths)
+        counters["deleted"] = len(deleted_paths)
+    for i in range(0, len(manifest_updates), MANIFEST_WRITE_BATCH):
+        await asyncio.to_thread(crud_kb_file_manifest.upsert_entries, db, kb_id, manifest_updates[i:i + MANIFEST_WRITE_BATCH])
+
+    logger.info(f"[KB {kb_id}] Streamed {counters['files']} file(s) ({counters['skipped']} unchanged, {counters['deleted']} deleted), {counters['nodes']} nodes, {counters['uploaded']} points into '{collection_name}'.")
+    logger.info(f"[KB {kb_id}] Embedding cache: {cache_stats.hits} hits / {cache_stats.misses} misses (hit rate {cache_stats.hit_rate:.1%}).")
+    return counters
+
 # --- Main Pipeline Function (Accepts detailed model info) ---
 def run_ingestion_pipeline(
     kb_id: int,
     embedding_model_details: Dict[str, Any], # 接收包含 name, url, key, dimensions 的字典
     file_path_str: str,
     qdrant_host: str,
-    qdrant_port: int
+    qdrant_port: int,
+    incremental: bool = False,
+    cancel_event: Optional[threading.Event] = None
 ):
-    """ The main ingestion pipeline using the DashScope client. """
+    """
+    The main ingestion pipeline using the DashScope client.
+    incremental=True re-embeds only new/changed files (kb_service decides whether that is safe).
+    cancel_event (set by the worker when it loses the job lease) stops the run at the next status update.
+    """
     db = SessionLocal()
     qdrant = None
     file_path = Path(file_path_str)
-    collection_name = f"kb_{kb_id}"
-    temp_extract_dir = None
 
     # 提取所有需要的模型信息
     model_base_url = embedding_model_details.get("endpoint_url") # 即 base_url
     model_api_key = embedding_model_details.get("api_key")
     model_name = embedding_model_details.get("name")
     model_dimensions = embedding_model_details.get("dimensions") # 获取维度
+    model_id = embedding_model_details.get("id")
 
  
     if model_base_url and ("localhost" in model_base_url or "127.0.0.1" or '172.31.192.1' in model_base_url):
@@ -187,196 +507,103 @@ def run_ingestion_pipeline(
     # 2. 验证模型信息 (!! 已修改 !!)
     if not model_base_url:
         logger.error(f"[KB {kb_id}] Model base_url (endpoint_url) is missing.") #
-        _update_parsing_status(db, kb_id, "error", None, "Model config error: Base URL missing.")
+        _update_parsing_status(db, kb_id, "error", None, "Model config error: Base URL missing.", cancel_event=cancel_event)
         db.close(); return
 
     if not model_api_key:
         logger.error(f"[KB {kb_id}] Model API Key is missing for a non-local model.") #
-        _update_parsing_status(db, kb_id, "error", None, "Model config error: API Key missing.") #
+        _update_parsing_status(db, kb_id, "error", None, "Model config error: API Key missing.", cancel_event=cancel_event) #
         db.close(); return
     if not model_name:
          logger.error(f"[KB {kb_id}] Model name is missing.")
-         _update_parsing_status(db, kb_id, "error", None, "Model config error: Model name missing.")
+         _update_parsing_status(db, kb_id, "error", None, "Model config error: Model name missing.", cancel_event=cancel_event)
          db.close(); return
     # 对 dimensions 进行可选性检查
     if model_name in ["text-embedding-v3", "text-embedding-v4"] and not model_dimensions:
         logger.warning(f"[KB {kb_id}] Model {model_name} might require dimensions, but none provided.")
 
+    db_kb = crud_knowledgebase.get_kb(db, kb_id)
+    # kb_service recorded the target collection (per-KB kb_{id} or a shared per-model collection)
+    collection_name = vector_store.collection_for_kb(db_kb, kb_id)
     logger.info(f"[KB {kb_id}] Starting ingestion for '{file_path}' using model '{model_name}' at '{model_base_url}' (dim: {model_dimensions}) into collection '{collection_name}'")
+    # Upload-time sha256 of the source being parsed; recorded on success so an unchanged re-upload can skip parsing
+    source_content_hash = getattr(db_kb, "source_content_hash", None)
+    storage_profile = getattr(db_kb, "storage_profile", None) # None = VECTOR_STORAGE_PROFILE
 
     try:
         qdrant = QdrantClient(host=qdrant_host, port=qdrant_port)
 
         # --- Stage 1: File Loading & Extraction ---
-        if not _update_parsing_status(db, kb_id, "loading", 5, f"Processing file: {file_path.name}"): return
-        input_dir = file_path.parent
-        
-        # <-- 3. 修改了 IF 检查
-        if file_path.suffix.lower() in ['.zip', '.rar']:
-            temp_extract_dir = Path(f"./temp_extract_{kb_id}_{int(time.time())}")
-            temp_extract_dir.mkdir(parents=True, exist_ok=True)
-            if not _update_parsing_status(db, kb_id, "loading", 10, "Extracting archive file..."): return
-            
-            # <-- 4. 修改了函数调用
-            _extract_archive(file_path, temp_extract_dir)
-            input_dir = temp_extract_dir
-            logger.info(f"[KB {kb_id}] Reading from extracted directory: {input_dir}")
-        else:
-             logger.info(f"[KB {kb_id}] Reading from directory: {input_dir}")
-             if not input_dir.is_dir(): raise ValueError(f"Input path is not a directory: {input_dir}")
-
-        # --- Stage 2: Document Loading (LlamaIndex) ---
-        if not _update_parsing_status(db, kb_id, "loading", 20, "Loading documents..."): return
-        reader = SimpleDirectoryReader(input_dir=str(input_dir), recursive=True, exclude_hidden=True)
-        documents = reader.load_data()
-        if not documents: raise ValueError(f"No documents found or loaded from '{input_dir}'.")
-        logger.info(f"[KB {kb_id}] Loaded {len(documents)} document(s).")
-
-        # --- Stage 3: Document Splitting (Dynamic Splitter) ---
-        if not _update_parsing_status(db, kb_id, "chunking", 30, f"Splitting {len(documents)} document(s)..."): return
-        all_nodes = []
-        logger.info(f"[KB {kb_id}] Starting dynamic splitting...")
-        markdown_splitter = MarkdownNodeParser()
-        for doc_index, doc in enumerate(documents):
-            file_path_meta = doc.metadata.get('file_path', '')
-            _, file_ext = os.path.splitext(file_path_meta); file_ext = file_ext.lower()
-            logger.debug(f"[KB {kb_id}] Processing doc {doc_index+1}/{len(documents)}: '{file_path_meta}' (ext: {file_ext})")
-            splitter_to_use = None; language_for_code_splitter = None
-            # --- Define language support here ---
-            if file_ext in ['.md', '.markdown', '.mdx']: splitter_to_use = markdown_splitter
-            elif file_ext == '.py': language_for_code_splitter = "python"
-            elif file_ext in ['.js', '.jsx', '.ts', '.tsx']: language_for_code_splitter = "javascript"
-            elif file_ext == '.go': language_for_code_splitter = "go"
-            elif file_ext == '.java': language_for_code_splitter = "java"
-            elif file_ext == '.rs': language_for_code_splitter = "rust"
-            elif file_ext in ['.c', '.h']: language_for_code_splitter = "c"
-            elif file_ext in ['.cpp', '.hpp', '.cxx', '.hxx']: language_for_code_splitter = "cpp"
-            else: # Explicit default for non-code/unknown
-                logger.debug(f"[KB {kb_id}] Using SentenceSplitter for {file_path_meta}")
-                splitter_to_use = SentenceSplitter( chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
-            # --- Language support end ---
-            if language_for_code_splitter:
-                logger.debug(f"[KB {kb_id}] Using CodeSplitter for {file_path_meta} (lang: {language_for_code_splitter})")
-                try:
-                    splitter_to_use = CodeSplitter( language=language_for_code_splitter, chunk_lines=CODE_CHUNK_LINES, chunk_lines_overlap=CODE_CHUNK_OVERLAP, max_chars=CODE_MAX_CHARS)
-                except Exception as cs_err:
-                     logger.warning(f"[KB {kb_id}] Failed CodeSplitter init ({language_for_code_splitter}), fallback: {cs_err}")
-                     splitter_to_use = SentenceSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP) # Fallback
-
-            if splitter_to_use:
-                 try:
-                     doc_nodes = splitter_to_use.get_nodes_from_documents([doc])
-                     all_nodes.extend(doc_nodes)
-                     logger.debug(f"[KB {kb_id}] Split '{os.path.basename(file_path_meta)}' into {len(doc_nodes)} nodes.")
-                 except ValueError as split_err: logger.warning(f"[KB {kb_id}] Skip split '{file_path_meta}': {split_err}.")
-                 except Exception as split_err: logger.error(f"[KB {kb_id}] Error split '{file_path_meta}': {split_err}", exc_info=False)
-            else: logger.warning(f"[KB {kb_id}] No splitter for file: {file_path_meta}, skipping.")
-        if not all_nodes: raise ValueError("Splitting resulted in zero nodes across all files.")
-        logger.info(f"[KB {kb_id}] Finished splitting. Total nodes created: {len(all_nodes)}")
-
-        # --- Stage 4: Embedding Generation (via DashScope API) ---
-        if not _update_parsing_status(db, kb_id, "embedding", 40, f"Preparing API call to {model_base_url} with model {model_name}..."): return
-        points_to_upload = []
-        texts_to_embed = [node.get_content() for node in all_nodes]
-        all_embeddings = []
-        current_batch_size = min(BATCH_SIZE, 10) # Use DashScope limit
-        num_batches = (len(texts_to_embed) + current_batch_size - 1) // current_batch_size
-        logger.info(f"[KB {kb_id}] Starting embedding generation in {num_batches} batches (size {current_batch_size}).")
-        for i in range(num_batches):
-            batch_start = i * current_batch_size
-            batch_end = min((i + 1) * current_batch_size, len(texts_to_embed))
-            text_batch = texts_to_embed[batch_start:batch_end]
-            if not text_batch: continue
-            progress = 50 + int(30 * (i + 1) / num_batches)
-            if not _update_parsing_status(db, kb_id, "embedding", progress, f"Generating embeddings (batch {i+1}/{num_batches})..."): return
-            try:
-                 embeddings_batch = asyncio.run(get_embeddings_from_api(
-                     texts=text_batch,
-                     base_url=model_base_url, # Pass base_url
-                     model_name=model_name,
-                     api_key=model_api_key,
-                     dimensions=model_dimensions # Pass dimensions
-                 ))
-                 if len(embeddings_batch) != len(text_batch): raise ValueError(f"API embed count mismatch batch {i+1}.")
-                 all_embeddings.extend(embeddings_batch)
-                 logger.debug(f"[KB {kb_id}] Batch {i+1} embeddings received.")
-            except ValueError as api_err: logger.error(f"[KB {kb_id}] API call failed batch {i+1}: {api_err}"); raise
-
-        if len(all_embeddings) != len(all_nodes): raise ValueError(f"Embed count ({len(all_embeddings)}) != chunk count ({len(all_nodes)}).")
-
-        if not all_embeddings:
-            raise ValueError("Embedding generation resulted in zero vectors. Cannot proceed.")
-
-
-        discovered_dimension = len(all_embeddings[0])
-        if discovered_dimension <= 0:
-            raise ValueError(f"API returned an invalid dimension: {discovered_dimension}")
-
-        # 检查预设维度 (来自 kb_service, 对于 Ollama 是 None)
-        if model_dimensions:
-            # (情况 A) 维度是预设的 (例如 BAAI, OpenAI)
-            # kb_service.py 应该已经创建了集合
-            logger.info(f"[KB {kb_id}] Using pre-configured Qdrant collection '{collection_name}' (Expected dim: {model_dimensions}).")
-            if model_dimensions != discovered_dimension:
-                # 这是一个严重的配置错误
-                logger.error(f"[KB {kb_id}] FATAL: Pre-set dimension ({model_dimensions}) does not match API discovered dimension ({discovered_dimension}).")
-                raise ValueError(f"Configuration mismatch: DB dimension ({model_dimensions}) != API dimension ({discovered_dimension})")
-            
-            # (可选的安全检查) 确保集合存在
-            try:
-                if not qdrant.collection_exists(collection_name):
-                    logger.warning(f"[KB {kb_id}] Collection was missing! Recreating with pre-set dim: {model_dimensions}")
-                    qdrant.recreate_collection(
-                        collection_name=collection_name,
-                        vectors_config=models.VectorParams(size=model_dimensions, distance=models.Distance.COSINE)
-                    )
-            except Exception as e:
-                logger.error(f"[KB {kb_id}] Failed safety check for collection: {e}")
-                raise
-
+        if not _update_parsing_status(db, kb_id, "loading", 5, f"Processing file: {file_path.name}", cancel_event=cancel_event): return
+
+        # Vendored deps, lockfiles, minified/generated code and binaries are dropped before splitting
+        corpus = corpus_filter.CorpusFilter()
+        if archive_reader.is_archive(file_path):
+            # Members are decompressed one at a time into memory and fed straight to the splitter
+            if not _update_parsing_status(db, kb_id, "loading", 10, "Reading archive index...", cancel_event=cancel_event): return
+            logger.info(f"[KB {kb_id}] Streaming members from archive: {file_path}")
+            source_root = file_path.parent
+            corpus.load_archive_rules(file_path)
+            total_files = len(archive_reader.list_members(file_path, corpus.accept_path))
+            file_documents = _iter_archive_documents(file_path, corpus)
+        elif file_path.is_dir():
+            logger.info(f"[KB {kb_id}] Reading from directory: {file_path}")
+            source_root = file_path
+            input_files = corpus.walk_directory(file_path)
+            if not input_files: raise ValueError(f"No documents found in '{file_path}' ({corpus.report.summary()}).")
+            reader = SimpleDirectoryReader(input_files=[str(f) for f in input_files])
+            total_files, file_documents = len(reader.input_files), reader.iter_data()
+        elif file_path.is_file():
+            # Only the uploaded file itself, not every other upload sitting next to it
+            logger.info(f"[KB {kb_id}] Reading single file: {file_path}")
+            source_root = file_path.parent
+            reader = SimpleDirectoryReader(input_files=[str(file_path)])
+            total_files, file_documents = len(reader.input_files), reader.iter_data()
         else:
-            # (情况 B) 维度是 None (例如 Ollama)
-            # 我们 *必须* 在这里创建集合
-            logger.warning(f"[KB {kb_id}] Model dimension was None. Creating collection '{collection_name}' with discovered dimension: {discovered_dimension}")
-            try:
-                # 使用 recreate_collection 来安全地覆盖任何旧的、维度错误的集合
-                qdrant.recreate_collection(
-                    collection_name=collection_name,
-                    vectors_config=models.VectorParams(size=discovered_dimension, distance=models.Distance.COSINE)
-                )
-                logger.info(f"[KB {kb_id}] Successfully created/recreated collection '{collection_name}' with dim {discovered_dimension}.")
-            except Exception as e:
-                logger.error(f"[KB {kb_id}] Failed to dynamically create Qdrant collection: {e}", exc_info=True)
-                raise ValueError(f"Failed to create Qdrant collection: {e}")
-
-        # (!! --- 修复结束 --- !!)
-
-
-        # Prepare Qdrant points (保持不变)
-        points_to_upload = []
-        for i, node in enumerate(all_nodes):
-            points_to_upload.append( models.PointStruct( id=str(node.node_id), vector=all_embeddings[i], payload={"text": node.get_content(), "metadata": node.metadata or {}}))
-        logger.info(f"[KB {kb_id}] Prepared {len(points_to_upload)} points for Qdrant.")
-
-
-        # --- Stage 5: Upload to Qdrant (Unchanged) ---
-        if not _update_parsing_status(db, kb_id, "uploading", 80, f"Uploading {len(points_to_upload)} points to Qdrant..."): return
-        qdrant.upsert(collection_name=collection_name, points=points_to_upload, wait=True)
-        logger.info(f"[KB {kb_id}] Successfully uploaded points to Qdrant collection '{collection_name}'.")
+            raise ValueError(f"Input path does not exist: {file_path}")
+
+        # --- Stage 2-5: Streaming Load -> Split -> Embed -> Upload ---
+        # Documents are loaded lazily, one file at a time (reader.iter_data / archive members), instead of load_data()
+        if total_files == 0: raise ValueError(f"No documents found in '{file_path}' ({corpus.report.summary()}).")
+        mode = "incremental" if incremental else "full"
+        if not _update_parsing_status(db, kb_id, "embedding", 20, f"Streaming {total_files} file(s) to {model_base_url} with model {model_name} ({mode})...", cancel_event=cancel_event): return
+        counters = asyncio.run(_run_streaming_stages(
+            db=db,
+            qdrant=qdrant,
+            kb_id=kb_id,
+            collection_name=collection_name,
+            file_documents=file_documents,
+            total_files=total_files,
+            source_root=source_root,
+            batch_size=min(BATCH_SIZE, 10), # Use DashScope limit
+            model_base_url=model_base_url,
+            model_name=model_name,
+            model_api_key=model_api_key,
+            model_dimensions=model_dimensions,
+            embedding_model_id=model_id,
+            incremental=incremental,
+            storage_profile=storage_profile,
+            cancel_event=cancel_event
+        ))
+        if counters is None: return # Cancelled externally or lease lost
+        logger.info(f"[KB {kb_id}] Successfully uploaded {counters['uploaded']} points to Qdrant collection '{collection_name}'.")
 
         # --- Stage 6: Finalize (Unchanged) ---
-        if not _update_parsing_status(db, kb_id, "complete", 100, "Ingestion pipeline finished successfully."): return
+        logger.info(f"[KB {kb_id}] Corpus filter: {corpus.report.summary()}.")
+        summary = f"Ingestion pipeline finished successfully ({mode}: {counters['files'] - counters['skipped'] - counters['empty']} file(s) indexed, {counters['skipped']} unchanged, {counters['deleted']} removed; {corpus.report.summary()})."
+        if not _update_parsing_status(db, kb_id, "complete", 100, summary, extra={"filtered": corpus.report.as_dict()}, cancel_event=cancel_event): return
         db_kb_final = crud_knowledgebase.get_kb(db, kb_id)
         
-        if db_kb_final and db_kb_final.status == 'processing':
-            db_kb_final.status = 'ready'; db.commit()
+        if db_kb_final and db_kb_final.status == 'processing' and not (cancel_event and cancel_event.is_set()):
+            db_kb_final.status = 'ready'; db_kb_final.parsed_content_hash = source_content_hash; db.commit()
             logger.info(f"[KB {kb_id}] KnowledgeBase status set to 'ready'.")
 
     except Exception as e:
         # --- Error Handling (Unchanged) ---
         error_message = f"Pipeline failed: {str(e)}"
         logger.error(f"[KB {kb_id}] Ingestion pipeline failed: {e}", exc_info=True)
-        _update_parsing_status(db, kb_id, "error", None, error_message)
+        if cancel_event and cancel_event.is_set(): return # Lease lost: the KB belongs to another run now
+        _update_parsing_status(db, kb_id, "error", None, error_message, cancel_event=cancel_event)
         try:
             db_kb_error = crud_knowledgebase.get_kb(db, kb_id)
             if db_kb_error and db_kb_error.status != 'error': db_kb_error.status = 'error'; db.commit()
@@ -384,7 +611,4 @@ def run_ingestion_pipeline(
 
     finally:
         # --- Cleanup (Unchanged) ---
-        if temp_extract_dir:
-            try: shutil.rmtree(temp_extract_dir); logger.info(f"[KB {kb_id}] Cleaned up temp directory: {temp_extract_dir}")
-            except Exception as e: logger.error(f"[KB {kb_id}] Failed cleanup temp dir '{temp_extract_dir}': {e}")
-        if db: db.close(); logger.debug(f"[KB {kb_id}] DB session closed.")
\ No newline at end of file
+        if db: db.close(); logger.debug(f"[KB {kb_id}] DB session closed.")
@@ -0,0 +1,203 @@
+# app/services/job_queue.py
+
+import logging
+import threading
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.crud import crud_ingestion_job, crud_knowledgebase, crud_model
+from app.db.session import SessionLocal, engine
+from app.models.ingestion_job import IngestionJob
+from app.models.knowledgebase import KnowledgeBase
+from app.services.ingestion_pipeline import run_ingestion_pipeline
+
+logger = logging.getLogger(__name__)
+
+# API 进程和 worker 启动时都会执行恢复，用 PostgreSQL advisory lock 保证同一时刻只有一个进程在做
+RECOVERY_LOCK_KEY = 0x6B625F726563
+
+
+def enqueue_ingestion(db: Session, kb_id: int, embedding_model_id: int, incremental: bool = False) -> IngestionJob:
+    """
+    将摄取任务写入持久化队列，由 worker 进程执行。
+    同一 KB 尚未开始的旧任务会被作废。
+    """
+    crud_ingestion_job.cancel_jobs_for_kb(db, kb_id)
+    job = crud_ingestion_job.create_job(
+        db,
+        kb_id=kb_id,
+        payload={"embedding_model_id": embedding_model_id, "incremental": incremental},
+        max_attempts=settings.INGESTION_JOB_MAX_ATTEMPTS
+    )
+    logger.info(f"[KB {kb_id}] Ingestion job {job.id} queued (incremental={incremental}).")
+    return job
+
+
+def recover_orphaned_kbs(db: Session) -> int:
+    """
+    启动时恢复卡在 'processing' 但已没有任何排队/运行任务的 KB
+    (例如旧版本 BackgroundTasks 时代或进程重启丢失的任务)。
+    租约过期的 running 任务不在此处理，由 worker 的 reclaim_expired_jobs 结算。
+    如果另一个进程正在恢复，直接跳过并返回 0。
+    """
+    # 单独的连接持有会话级锁，不受 db 中途 commit 的影响
+    with engine.connect() as lock_conn:
+        if not lock_conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": RECOVERY_LOCK_KEY}).scalar():
+            logger.info("Another process is recovering orphaned knowledge bases, skipping.")
+            return 0
+        try:
+            return _recover_orphaned_kbs(db)
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": RECOVERY_LOCK_KEY})
+
+
+def _recover_orphaned_kbs(db: Session) -> int:
+    recovered = 0
+    stuck_kbs = db.query(KnowledgeBase).filter(KnowledgeBase.status == "processing").all()
+    for kb in stuck_kbs:
+        has_job = db.query(IngestionJob.id).filter(
+            IngestionJob.kb_id == kb.id,
+            IngestionJob.status.in_(crud_ingestion_job.ACTIVE_STATUSES)
+        ).first()
+        if has_job:
+            continue
+        if kb.embedding_model_id and kb.source_file_path:
+            enqueue_ingestion(db, kb.id, kb.embedding_model_id, incremental=False)
+            kb.parsing_state = {"stage": "pending", "progress": 0, "message": "Re-queued after interrupted processing..."}
+        else:
+            kb.status = "error"
+            kb.parsing_state = {"stage": "error", "message": "Processing was interrupted and cannot be resumed. Please parse again."}
+        db.commit()
+        recovered += 1
+        logger.warning(f"[KB {kb.id}] Recovered orphaned 'processing' knowledge base.")
+    return recovered
+
+
+def reclaim_expired_jobs(db: Session) -> int:
+    """
+    结算租约已过期的 running 任务 (worker 崩溃或失联)。
+    这次中断计为一次失败尝试: 超过 max_attempts 标记为 failed，否则与失败路径一样按指数退避重新排队。
+    """
+    reclaimed = 0
+    while True:
+        job = crud_ingestion_job.claim_expired_job(db)
+        if not job:
+            db.rollback()
+            return reclaimed
+        kb = crud_knowledgebase.get_kb(db, job.kb_id)
+        # KB 已 ready 说明管道已完成，只是 worker 在结束任务前退出
+        error = None if kb is not None and kb.status == "ready" else f"Worker {job.lease_owner} lost its lease before the job finished."
+        logger.warning(f"[Job {job.id}] Lease expired (owner {job.lease_owner}), settling attempt {job.attempts}/{job.max_attempts}.")
+        _settle_job(db, job, job.lease_owner, kb, error)
+        reclaimed += 1
+
+
+def execute_job(job_id: int, cancel_event: Optional[threading.Event] = None) -> Optional[str]:
+    """
+    执行任务 (在 worker 线程中调用)。返回意外异常的描述，正常结束返回 None。
+    cancel_event 在 worker 失去租约时被置位，管道在下一次更新状态时停止且不再写 KB 状态。
+    """
+    db = SessionLocal()
+    try:
+        job = crud_ingestion_job.get_job(db, job_id)
+        if not job:
+            return None
+        kb = crud_knowledgebase.get_kb(db, job.kb_id)
+        if not kb or kb.status != "processing":
+            logger.info(f"[Job {job_id}] KB {job.kb_id} is no longer processing, skipping.")
+            return None
+        db_model = crud_model.get_model(db, job.payload.get("embedding_model_id"))
+        if not db_model:
+            return "Embedding model not found"
+        embedding_model_details = {
+            "name": db_model.name,
+            "endpoint_url": db_model.endpoint_url,
+            "api_key": db_model.api_key,
+            "dimensions": db_model.dimensions,
+            "id": db_model.id
+        }
+        kb_id, file_path_str = kb.id, kb.source_file_path
+        incremental = bool(job.payload.get("incremental", False))
+    finally:
+        db.close()
+
+    logger.info(f"[Job {job_id}] Running ingestion for KB {kb_id} (incremental={incremental}).")
+    try:
+        run_ingestion_pipeline(
+            kb_id=kb_id,
+            embedding_model_details=embedding_model_details,
+            file_path_str=file_path_str,
+            qdrant_host=settings.QDRANT_HOST,
+            qdrant_port=settings.QDRANT_PORT,
+            incremental=incremental,
+            cancel_event=cancel_event
+        )
+    except Exception as e:
+        logger.error(f"[Job {job_id}] Pipeline raised unexpectedly: {e}", exc_info=True)
+        return str(e)
+    return None
+
+
+def _settle_job(db: Session, job: IngestionJob, owner: str, kb: Optional[KnowledgeBase], error: Optional[str]) -> None:
+    """
+    根据 KB 的最终状态结束任务，失败且仍有重试次数时按指数退避重新排队。
+    任务状态只在 owner 仍持有租约时更新 (条件 UPDATE)；租约已被回收时什么都不做，KB 状态也不动。
+    """
+    job_id = job.id
+    state = (kb.parsing_state or {}) if kb else {}
+
+    if kb is None or state.get("stage") == "cancelled":
+        if crud_ingestion_job.finish_job(db, job_id, owner, "cancelled"):
+            logger.info(f"[Job {job_id}] Cancelled.")
+    elif kb.status == "ready" and not error:
+        if crud_ingestion_job.finish_job(db, job_id, owner, "succeeded"):
+            logger.info(f"[Job {job_id}] Succeeded (KB {kb.id}).")
+    elif kb.status in ("error", "processing") or error:
+        # 'processing' 表示管道中途退出但未写入终态 (例如数据库短暂不可用)
+        reason = error or state.get("message") or "Ingestion did not complete."
+        if job.attempts < job.max_attempts:
+            delay = settings.INGESTION_JOB_RETRY_BASE_SECONDS * (2 ** (job.attempts - 1))
+            if not crud_ingestion_job.reschedule_job(db, job_id, owner, delay, reason):
+                logger.warning(f"[Job {job_id}] Lease no longer held by {owner}, not rescheduling.")
+                return
+            kb.status = "processing"
+            kb.parsing_state = {
+                "stage": "pending", "progress": 0,
+                "message": f"Attempt {job.attempts}/{job.max_attempts} failed, retrying in {int(delay)}s: {reason}"
+            }
+            db.commit()
+            logger.warning(f"[Job {job_id}] Attempt {job.attempts}/{job.max_attempts} failed, retrying in {delay}s: {reason}")
+        else:
+            if not crud_ingestion_job.finish_job(db, job_id, owner, "failed", reason):
+                logger.warning(f"[Job {job_id}] Lease no longer held by {owner}, not marking it failed.")
+                return
+            if kb.status != "error":
+                kb.status = "error"
+                kb.parsing_state = {"stage": "error", "message": f"Pipeline failed: {reason}"}
+                db.commit()
+            logger.error(f"[Job {job_id}] Failed after {job.attempts} attempt(s): {reason}")
+    else:
+        # 状态被外部改写 (例如取消后重新上传)
+        crud_ingestion_job.finish_job(db, job_id, owner, "cancelled")
+
+
+def finalize_job(job_id: int, owner: str, error: Optional[str] = None) -> None:
+    """ worker 执行完任务后结算 (租约已被其他 worker 回收时不做任何事) """
+    db = SessionLocal()
+    try:
+        job = crud_ingestion_job.get_job(db, job_id)
+        if not job:
+            return # KB 已被删除 (任务级联删除)
+        if job.status != "running" or job.lease_owner != owner:
+            logger.warning(f"[Job {job_id}] Lease no longer held by {owner}, skipping finalize.")
+            return
+        kb = crud_knowledgebase.get_kb(db, job.kb_id)
+        _settle_job(db, job, owner, kb, error)
+    except Exception as e:
+        logger.error(f"[Job {job_id}] Failed to finalize job: {e}", exc_info=True)
+        db.rollback()
+    finally:
+        db.close()
@@ -1,23 +1,25 @@
 # app/services/kb_service.py
 
+import hashlib
 import logging
 import os
-import shutil
 from pathlib import Path
-from fastapi import UploadFile, BackgroundTasks, HTTPException
+import aiofiles
+from fastapi import UploadFile, HTTPException
 from sqlalchemy.orm import Session
 from qdrant_client import QdrantClient, models
-from qdrant_client.http.models import Distance, VectorParams
 from typing import List, Optional
 
-from app.crud import crud_knowledgebase, crud_model
+from app.crud import crud_knowledgebase, crud_model, crud_kb_file_manifest, crud_ingestion_job
 from app.models.knowledgebase import KnowledgeBase
 from app.schemas.knowledgebase import KnowledgeBaseCreate, KnowledgeBaseUpdate
-from app.services.ingestion_pipeline import run_ingestion_pipeline
+from app.services import job_queue, vector_store
 from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 UPLOADS_DIR = Path("./uploads")
+# 一次性上传时每次从 UploadFile 读取的字节数
+UPLOAD_READ_SIZE = 1024 * 1024
 
 
 def get_all_kbs(db: Session) -> List[KnowledgeBase]:
@@ -44,6 +46,25 @@ def update_kb_details(db: Session, kb_id: int, kb_in: KnowledgeBaseUpdate) -> Op
     # 调用 crud 函数进行更新，它会返回刷新后的对象
     return crud_knowledgebase.update_kb(db, db_kb=db_kb, kb_in=kb_in)
 
+def set_storage_profile(db: Session, qdrant: QdrantClient, kb_id: int, profile: Optional[str]) -> Optional[KnowledgeBase]:
+    """
+    记录 KB 的存储配置 (None = 部署默认值)。集合已存在时原地迁移 (update_collection)，
+    否则在下一次解析创建集合时生效。
+    """
+    vector_store.validate_storage_profile(profile)
+    db_kb = crud_knowledgebase.get_kb(db, kb_id)
+    if not db_kb:
+        return None
+    db_kb.storage_profile = profile
+    db.commit()
+    db.refresh(db_kb)
+    collection_name = vector_store.collection_for_kb(db_kb)
+    if vector_store.is_shared_collection(collection_name):
+        logger.info(f"[KB {kb_id}] Vectors live in shared collection '{collection_name}'; the profile applies once the KB uses its own collection.")
+    elif vector_store.apply_storage_profile(qdrant, collection_name, profile):
+        logger.info(f"[KB {kb_id}] Storage profile set to '{profile or settings.VECTOR_STORAGE_PROFILE}', migrating '{collection_name}'.")
+    return db_kb
+
 def delete_kb_by_id(db: Session, qdrant: QdrantClient, kb_id: int) -> Optional[KnowledgeBase]:
     """
     (deleteKnowledgeBase) 删除 KB，包括 Qdrant 集合。
@@ -55,15 +76,14 @@ def delete_kb_by_id(db: Session, qdrant: QdrantClient, kb_id: int) -> Optional[K
 
     # (新增) 记录文件路径
     file_to_delete = db_kb.source_file_path
+    collection_name = vector_store.collection_for_kb(db_kb)
     db_kb = crud_knowledgebase.delete_kb(db, kb_id)
     if not db_kb: return None
-    collection_name = f"kb_{db_kb.id}"
     try:
-        if qdrant.collection_exists(collection_name):
-            qdrant.delete_collection(collection_name)
-            logger.info(f"Qdrant collection '{collection_name}' deleted.")
+        # 独占集合整体删除；共享集合只删除本 KB 的点
+        vector_store.delete_kb_vectors(qdrant, collection_name, kb_id)
     except Exception as e:
-        logger.error(f"Failed to delete Qdrant collection '{collection_name}': {e}")
+        logger.error(f"Failed to delete vectors of KB {kb_id} from Qdrant collection '{collection_name}': {e}")
     if file_to_delete:
         try:
             file_path = Path(file_to_delete)
@@ -77,23 +97,43 @@ def delete_kb_by_id(db: Session, qdrant: QdrantClient, kb_id: int) -> Optional[K
     return db_kb
 
 
-def save_kb_file(db: Session, kb_id: int, file: UploadFile) -> Optional[KnowledgeBase]:
+async def save_kb_file(db: Session, kb_id: int, file: UploadFile) -> Optional[KnowledgeBase]:
     """
-    保存文件，更新数据库，并通过重新查询确保返回最新对象。
+    一次性上传: 分块流式写盘 (不占用线程池)，边写边计算 sha256 并执行大小上限。
+    大文件请使用可续传的分块上传 (upload_service)。
     """
-    file_path = UPLOADS_DIR / f"kb_{kb_id}_{file.filename}"
+    file_path = UPLOADS_DIR / f"kb_{kb_id}_{Path(file.filename or 'upload').name}"
     file_path_str = str(file_path)
 
     # 1. 保存文件到磁盘
+    hasher = hashlib.sha256()
+    size = 0
     try:
         logger.debug(f"[KB {kb_id}] Attempting to save file to {file_path_str}")
-        with file_path.open("wb") as buffer: shutil.copyfileobj(file.file, buffer)
-        logger.info(f"[KB {kb_id}] File successfully saved to {file_path_str}")
+        async with aiofiles.open(file_path, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_READ_SIZE):
+                size += len(chunk)
+                if size > settings.UPLOAD_MAX_BYTES:
+                    raise ValueError(f"File exceeds the maximum allowed size of {settings.UPLOAD_MAX_BYTES} bytes.")
+                hasher.update(chunk)
+                await buffer.write(chunk)
+        logger.info(f"[KB {kb_id}] File successfully saved to {file_path_str} ({size} bytes)")
     except Exception as e:
         logger.error(f"Save file {file_path_str} failed: {e}", exc_info=True)
+        try: file_path.unlink(missing_ok=True)
+        except OSError: pass
         raise ValueError(f"File save failed: {e}")
     finally:
-        file.file.close()
+        await file.close()
+
+    return attach_source_file(db, kb_id, file_path, hasher.hexdigest())
+
+
+def attach_source_file(db: Session, kb_id: int, file_path: Path, content_hash: str) -> Optional[KnowledgeBase]:
+    """
+    把已写入磁盘的源文件挂到 KB 上，重置解析状态，并通过重新查询确保返回最新对象。
+    """
+    file_path_str = str(file_path)
 
     # 2. 获取要更新的对象
     db_kb_to_update = crud_knowledgebase.get_kb(db, kb_id)
@@ -107,6 +147,7 @@ def save_kb_file(db: Session, kb_id: int, file: UploadFile) -> Optional[Knowledg
     try:
         # 重置知识库状态到初始状态
         db_kb_to_update.source_file_path = file_path_str
+        db_kb_to_update.source_content_hash = content_hash
         db_kb_to_update.status = "error"  # 重置为 error 状态，表示需要重新解析
         db_kb_to_update.parsing_state = {"stage": "idle", "progress": 0}  # 重置解析状态
         db_kb_to_update.embedding_model_id = None  # 清除之前使用的模型
@@ -153,11 +194,13 @@ def start_kb_parsing(
     qdrant: QdrantClient,
     kb_id: int,
     embedding_model_id: int,
-    background_tasks: BackgroundTasks
+    incremental: bool = False
 ) -> Optional[KnowledgeBase]:
     """
     (startParsing) Validates, prepares Qdrant collection (if possible),
-    and triggers the background knowledge ingestion pipeline.
+    and enqueues the knowledge ingestion job (executed by `python -m app.worker`).
+    incremental=True 时仅在上次解析使用同一嵌入模型且集合仍存在的情况下生效，
+    否则回退为全量重建。
     """
     # 1. Get KnowledgeBase object (保持不变)
     db_kb = crud_knowledgebase.get_kb(db, kb_id)
@@ -165,6 +208,11 @@ def start_kb_parsing(
         logger.error(f"[KB {kb_id}] KnowledgeBase not found for starting parsing.")
         return None
 
+    # 1b. 同一 KB 不允许两个摄取任务同时运行 (排队中的任务会被新任务替换)
+    active_job = crud_ingestion_job.get_active_job_for_kb(db, kb_id)
+    if active_job and active_job.status == "running":
+        raise ValueError("This KnowledgeBase is already being parsed. Cancel it or wait for it to finish.")
+
     # 2. Validate file path (保持不变)
     if not db_kb.source_file_path:
         raise ValueError("No source file uploaded for this KnowledgeBase. Please upload a file first.")
@@ -199,10 +247,66 @@ def start_kb_parsing(
         raise ValueError(f"Model '{db_model.name}' is missing the 'name' identifier.")
 
     # 4. (!! 关键修复 2: 使 Qdrant 准备工作变为可选 !!)
-    collection_name = f"kb_{db_kb.id}"
+    # 目标集合由 VECTOR_COLLECTION_MODE 决定 (kb_{id} 或共享的 kb_shared_{model_id})
+    collection_name = vector_store.target_collection(db_kb.id, db_model.id)
+    previous_collection = vector_store.collection_for_kb(db_kb)
+
+    # 4-pre. 决定增量还是全量: 增量依赖上次的文件清单和向量都还有效
+    if incremental:
+        previous_model_id = crud_kb_file_manifest.get_manifest_model_id(db, kb_id)
+        collection_ok = previous_collection == collection_name and qdrant.collection_exists(collection_name)
+        # 没有稀疏向量的旧集合需要全量重建才能启用混合检索
+        if collection_ok and not vector_store.has_sparse_vectors(qdrant, collection_name):
+            logger.info(f"[KB {kb_id}] Collection '{collection_name}' predates hybrid search.")
+            collection_ok = False
+        if previous_model_id != db_model.id or not collection_ok:
+            logger.info(f"[KB {kb_id}] Incremental parse not possible (previous model: {previous_model_id}, collection usable: {collection_ok}). Falling back to full rebuild.")
+            incremental = False
+    # 4-pre-b. 上传的源文件与上次成功解析时完全相同 (sha256 一致)，增量解析无事可做。
+    # 不看 status: attach_source_file 每次上传都会把状态重置为 'error'。
+    # parsed_content_hash 只在解析成功时写入、开始新解析时清空，因此相等即说明向量与该文件一致。
+    if incremental and db_kb.source_content_hash and db_kb.source_content_hash == db_kb.parsed_content_hash:
+        logger.info(f"[KB {kb_id}] Source content unchanged since last parse ({db_kb.source_content_hash[:12]}); nothing to do.")
+        db_kb.status = "ready"
+        db_kb.parsing_state = {"stage": "complete", "progress": 100, "message": "Source content unchanged since last parse; nothing to do."}
+        db_kb.embedding_model_id = db_model.id
+        try:
+            db.commit()
+            db.refresh(db_kb)
+        except Exception as commit_err:
+            logger.error(f"[KB {kb_id}] Failed to restore 'ready' status: {commit_err}", exc_info=True)
+            db.rollback()
+            raise HTTPException(status_code=500, detail=f"Database error setting status for KB {kb_id}")
+        return db_kb
+    if not incremental:
+        crud_kb_file_manifest.clear_manifest(db, kb_id)
+    # 4-pre-c. 集合模式切换 (独占 <-> 共享) 后，旧集合中本 KB 的向量不再使用
+    if previous_collection != collection_name:
+        try:
+            vector_store.delete_kb_vectors(qdrant, previous_collection, kb_id)
+        except Exception as e:
+            logger.warning(f"[KB {kb_id}] Failed to remove vectors from previous collection '{previous_collection}': {e}")
     
+    if vector_store.is_shared_collection(collection_name):
+        # 共享集合不能为一个 KB 重建: 全量解析只删除本 KB 的点 (维度未知时由 pipeline 创建集合)
+        logger.info(f"[KB {kb_id}] Using shared Qdrant collection '{collection_name}'.")
+        try:
+            if required_dimension:
+                vector_store.ensure_shared_collection(qdrant, collection_name, required_dimension)
+            if not incremental:
+                vector_store.delete_kb_vectors(qdrant, collection_name, kb_id)
+        except ValueError:
+            raise
+        except Exception as shared_err:
+            logger.error(f"[KB {kb_id}] Failed to prepare shared collection '{collection_name}': {shared_err}", exc_info=True)
+            db_kb.status = "error"
+            db_kb.parsing_state = {"stage": "error", "message": f"Qdrant Check/Create Error: {shared_err}"}
+            try: db.commit()
+            except Exception as commit_err: logger.error(f"Commit error status failed: {commit_err}"); db.rollback()
+            return db_kb
+
     # (!! 仅当维度已知时才配置 Qdrant !!)
-    if required_dimension:
+    elif required_dimension:
         logger.info(f"[KB {kb_id}] Pre-configuring Qdrant collection '{collection_name}' with known dimension: {required_dimension}")
         try:
             # 4a. 尝试获取现有集合信息
@@ -226,27 +330,24 @@ def start_kb_parsing(
             # 4c. 比较维度 (保持不变)
             if current_dimension is None:
                  logger.warning(f"[KB {kb_id}] Could not determine vector dimension for existing collection. Recreating...")
-                 qdrant.recreate_collection(
-                     collection_name=collection_name,
-                     vectors_config=VectorParams(size=required_dimension, distance=Distance.COSINE)
-                 )
+                 vector_store.recreate_collection(qdrant, collection_name, required_dimension, db_kb.storage_profile)
             elif current_dimension != required_dimension:
                 logger.warning(f"[KB {kb_id}] Qdrant '{collection_name}' dim mismatch ({current_dimension} vs {required_dimension}). Recreating...")
-                qdrant.recreate_collection(
-                    collection_name=collection_name,
-                    vectors_config=VectorParams(size=required_dimension, distance=Distance.COSINE)
-                )
+                vector_store.recreate_collection(qdrant, collection_name, required_dimension, db_kb.storage_profile)
+            elif not incremental:
+                # 全量重建: 清掉旧向量，避免与新写入的点重复
+                logger.info(f"[KB {kb_id}] Full rebuild: recreating Qdrant collection '{collection_name}' (dim {current_dimension}).")
+                vector_store.recreate_collection(qdrant, collection_name, required_dimension, db_kb.storage_profile)
             else:
                  logger.info(f"[KB {kb_id}] Qdrant collection '{collection_name}' exists with correct dimension ({current_dimension}).")
+                 # 增量模式沿用集合: 存储配置 (或部署默认值) 变化时原地迁移
+                 vector_store.apply_storage_profile(qdrant, collection_name, db_kb.storage_profile)
 
         except Exception as get_coll_err:
             # 4d. 创建集合 (保持不变)
             logger.info(f"[KB {kb_id}] Qdrant collection '{collection_name}' not found or error checking. Attempting creation with dim {required_dimension}...")
             try:
-                qdrant.create_collection(
-                    collection_name=collection_name,
-                    vectors_config=VectorParams(size=required_dimension, distance=Distance.COSINE)
-                )
+                vector_store.create_collection(qdrant, collection_name, required_dimension, db_kb.storage_profile)
                 logger.info(f"[KB {kb_id}] Qdrant collection '{collection_name}' created successfully.")
             except Exception as create_err:
                 logger.error(f"[KB {kb_id}] Failed to create Qdrant collection '{collection_name}': {create_err}", exc_info=True)
@@ -262,9 +363,9 @@ def start_kb_parsing(
         logger.warning(f"[KB {kb_id}] The ingestion pipeline MUST now handle collection creation.")
         
         # (推荐) 作为安全措施，删除任何可能存在的旧集合，
-        # 因为它可能具有来自先前模型的错误维度。
+        # 因为它可能具有来自先前模型的错误维度。(增量模式下沿用同一模型创建的集合)
         try:
-            if qdrant.collection_exists(collection_name):
+            if not incremental and qdrant.collection_exists(collection_name):
                 logger.warning(f"[KB {kb_id}] Deleting existing collection '{collection_name}' to allow pipeline to recreate it with dynamic dimensions.")
                 qdrant.delete_collection(collection_name)
         except Exception as e:
@@ -277,6 +378,8 @@ def start_kb_parsing(
     db_kb.status = "processing"
     db_kb.parsing_state = {"stage": "pending", "progress": 0, "message": "Queued for processing..."}
     db_kb.embedding_model_id = db_model.id 
+    db_kb.vector_collection = collection_name
+    db_kb.parsed_content_hash = None # 解析成功后由 pipeline 重新写入
     try:
         db.commit()
         db.refresh(db_kb) 
@@ -285,26 +388,14 @@ def start_kb_parsing(
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Database error setting status for KB {kb_id}")
 
-    # 6. 添加后台任务 (保持不变)
+    # 6. 写入持久化任务队列 (由 worker 进程领取执行，API 重启不会丢失任务)
     try:
-        background_tasks.add_task(
-            run_ingestion_pipeline,
-            kb_id=kb_id,
-            embedding_model_details={
-                "name": db_model.name,
-                "endpoint_url": db_model.endpoint_url,
-                "api_key": db_model.api_key,
-                "dimensions": db_model.dimensions # (保持不变, 传递 None 过去)
-            },
-            file_path_str=db_kb.source_file_path,
-            qdrant_host=settings.QDRANT_HOST,
-            qdrant_port=settings.QDRANT_PORT
-        )
-        logger.info(f"[KB {kb_id}] Background task 'run_ingestion_pipeline' added.")
+        job_queue.enqueue_ingestion(db, kb_id, db_model.id, incremental=incremental)
     except Exception as task_err:
-        logger.error(f"[KB {kb_id}] Failed to add background task: {task_err}", exc_info=True)
+        logger.error(f"[KB {kb_id}] Failed to enqueue ingestion job: {task_err}", exc_info=True)
+        db.rollback()
         db_kb.status = "error"
-        db_kb.parsing_state = {"stage": "error", "message": "Failed to queue background task"}
+        db_kb.parsing_state = {"stage": "error", "message": "Failed to queue ingestion job"}
         try:
             db.commit()
         except Exception:
@@ -321,6 +412,8 @@ def cancel_kb_parsing(db: Session, kb_id: int) -> Optional[KnowledgeBase]:
         logger.warning(f"[KB {kb_id}] Requesting cancel parsing... (Updating status only)")
         db_kb.status = "ready" # Or 'cancelled'
         db_kb.parsing_state = {"stage": "cancelled"}
+        # 排队中的任务直接作废；运行中的任务会在下一次状态检查时自行停止
+        crud_ingestion_job.cancel_jobs_for_kb(db, kb_id)
         # db_kb.updated_at = datetime.now(timezone.utc)
         try:
             db.commit(); db.refresh(db_kb)
@@ -0,0 +1,146 @@
+# app/services/llm_output_cache.py
+
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.crud import crud_llm_output_cache
+from app.db.session import SessionLocal
+from app.services.embedding_cache import CacheStats
+
+logger = logging.getLogger(__name__)
+
+# 每写入这么多条新输出检查一次容量 (避免每次都 sum(size_bytes))
+EVICTION_CHECK_INTERVAL = 200
+# 超出容量时一次淘汰到上限的 90%，避免频繁触发
+EVICTION_TARGET_RATIO = 0.9
+
+# 缓存用途 (同一输入在不同用途下的输出互不相同)
+FILE_SUMMARY = "file_summary"
+KG_TRIPLETS = "kg_triplets"
+SUMMARY = "summary"
+
+# 进程级统计 (见 /health/cache-stats)
+stats = CacheStats()
+_inserts_since_check = 0
+_inserts_lock = threading.Lock()
+
+
+def make_cache_key(kind: str, model_name: str, prompt_version: str, content: str) -> str:
+    """ hash(用途, 模型名, 提示词版本, 输入内容) """
+    h = hashlib.sha256()
+    for part in (kind, model_name, prompt_version):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    h.update(content.encode("utf-8"))
+    return h.hexdigest()
+
+
+def lookup(db: Session, kind: str, model_name: str, prompt_version: str, contents: List[str]) -> List[Optional[str]]:
+    """ 返回与 contents 对齐的列表，未命中 (或缓存关闭) 的位置为 None """
+    if not settings.LLM_OUTPUT_CACHE_ENABLED or not contents:
+        return [None] * len(contents)
+    keys = [make_cache_key(kind, model_name, prompt_version, c) for c in contents]
+    try:
+        entries = crud_llm_output_cache.get_entries(db, list(set(keys)))
+        if entries:
+            crud_llm_output_cache.touch_entries(db, list(entries.keys()))
+    except Exception as e:
+        logger.warning(f"LLM output cache lookup failed, treating as miss: {e}")
+        db.rollback()
+        return [None] * len(contents)
+    results = [entries[k].output if k in entries else None for k in keys]
+    hits = sum(1 for r in results if r is not None)
+    stats.record(hits, len(results) - hits)
+    return results
+
+
+def get(db: Session, kind: str, model_name: str, prompt_version: str, content: str) -> Optional[str]:
+    return lookup(db, kind, model_name, prompt_version, [content])[0]
+
+
+def store(db: Session, kind: str, model_name: str, prompt_version: str, items: Dict[str, str]) -> None:
+    """ 写入新生成的输出 ({输入内容: 输出})，并按需触发淘汰 """
+    global _inserts_since_check
+    if not settings.LLM_OUTPUT_CACHE_ENABLED or not items:
+        return
+    rows = {}
+    for content, output in items.items():
+        key = make_cache_key(kind, model_name, prompt_version, content)
+        rows[key] = {
+            "cache_key": key,
+            "kind": kind,
+            "model_name": model_name,
+            "output": output,
+            "size_bytes": len(output.encode("utf-8")),
+        }
+    try:
+        crud_llm_output_cache.insert_entries(db, list(rows.values()))
+    except Exception as e:
+        logger.warning(f"LLM output cache store failed: {e}")
+        db.rollback()
+        return
+
+    with _inserts_lock:
+        _inserts_since_check += len(rows)
+        should_check = _inserts_since_check >= EVICTION_CHECK_INTERVAL
+        if should_check:
+            _inserts_since_check = 0
+    if should_check:
+        evict_if_needed(db)
+
+
+def put(db: Session, kind: str, model_name: str, prompt_version: str, content: str, output: str) -> None:
+    store(db, kind, model_name, prompt_version, {content: output})
+
+
+def _in_session(fn, *args):
+    db = SessionLocal()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+
+async def get_async(kind: str, model_name: str, prompt_version: str, content: str) -> Optional[str]:
+    """ get 的异步版本: 在工作线程中使用独立会话 (供并发的 LLM 调用使用，不共享调用方的 Session) """
+    return await asyncio.to_thread(_in_session, get, kind, model_name, prompt_version, content)
+
+
+async def put_async(kind: str, model_name: str, prompt_version: str, content: str, output: str) -> None:
+    """ put 的异步版本 (同 get_async) """
+    await asyncio.to_thread(_in_session, put, kind, model_name, prompt_version, content, output)
+
+
+def evict_if_needed(db: Session) -> int:
+    """ 总字节数超过 LLM_OUTPUT_CACHE_MAX_BYTES 时删除最久未使用的条目 """
+    try:
+        size = crud_llm_output_cache.total_size(db)
+        if size <= settings.LLM_OUTPUT_CACHE_MAX_BYTES:
+            return 0
+        target = int(settings.LLM_OUTPUT_CACHE_MAX_BYTES * EVICTION_TARGET_RATIO)
+        removed = crud_llm_output_cache.delete_least_recently_used_bytes(db, size - target)
+        logger.info(f"LLM output cache evicted {removed} LRU entries (freeing >= {size - target} bytes).")
+        return removed
+    except Exception as e:
+        logger.warning(f"LLM output cache eviction failed: {e}")
+        db.rollback()
+        return 0
+
+
+def get_stats(db: Optional[Session] = None) -> Dict[str, Any]:
+    """ 命中率统计；传入 db 时附带当前条目数和总字节数 """
+    result = stats.as_dict()
+    result["max_bytes"] = settings.LLM_OUTPUT_CACHE_MAX_BYTES
+    if db is not None:
+        try:
+            result["entries"] = crud_llm_output_cache.count_entries(db)
+            result["size_bytes"] = crud_llm_output_cache.total_size(db)
+        except Exception as e:
+            result["entries"] = f"error: {e}"
+    return result
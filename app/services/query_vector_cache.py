@@ -0,0 +1,73 @@
+# app/services/query_vector_cache.py
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.services.embedding_cache import CacheStats
+
+# (embedding model id, dimensions, 规范化后的查询)
+QueryKey = Tuple[int, int, str]
+
+
+def normalize_query(query: str) -> str:
+    """ 去掉首尾空白并合并连续空白 (不改变大小写，嵌入结果对大小写敏感) """
+    return " ".join(query.split())
+
+
+class QueryVectorCache:
+    """ 进程内查询向量缓存: 容量上限按 LRU 淘汰，条目超过 TTL 后失效 """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[QueryKey, Tuple[float, List[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = CacheStats()
+
+    @staticmethod
+    def make_key(model_id: int, dimensions: Optional[int], query: str) -> QueryKey:
+        return (model_id, dimensions or 0, normalize_query(query))
+
+    def get(self, model_id: int, dimensions: Optional[int], query: str) -> Optional[List[float]]:
+        key = self.make_key(model_id, dimensions, query)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.stats.record(1, 0)
+                return entry[1]
+            if entry is not None:
+                del self._entries[key] # 已过期
+        self.stats.record(0, 1)
+        return None
+
+    def put(self, model_id: int, dimensions: Optional[int], query: str, vector: List[float]) -> None:
+        key = self.make_key(model_id, dimensions, query)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        result = self.stats.as_dict()
+        with self._lock:
+            result["entries"] = len(self._entries)
+        result["max_entries"] = self.max_entries
+        result["ttl_seconds"] = self.ttl_seconds
+        return result
+
+
+# 进程级实例 (见 /health/cache-stats)
+query_vector_cache = QueryVectorCache(
+    max_entries=settings.QUERY_VECTOR_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.QUERY_VECTOR_CACHE_TTL_SECONDS
+)
@@ -1,23 +1,28 @@
 # app/services/rag_service.py
+import json
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator, Tuple
 from sqlalchemy.orm import Session
-from qdrant_client import QdrantClient, models
-from openai import AsyncOpenAI
+from qdrant_client import AsyncQdrantClient
 
 from app.schemas.rag import RagQueryRequest, RagQueryResponse, RetrievedContext, RagRetrieveRequest, RagRetrieveResponse
-from app.crud import crud_model, crud_knowledgebase
-from app.services.ingestion_pipeline import get_embeddings_from_api 
+from app.crud import crud_model
+from app.services.retrieval_engine import RetrievalEngine, RetrievalResult
+from app.core.llm_clients import get_openai_client
+from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
+NO_CONTEXT_ANSWER = "Sorry, I couldn't find any relevant context in the selected knowledge bases."
+
 async def _call_generative_api(model_details: Dict[str, Any], prompt: str) -> str:
     """
     辅助函数：调用 Generative LLM API
     """
-    client = AsyncOpenAI(
-        api_key=model_details.get("api_key"),
-        base_url=model_details.get("endpoint_url")
+    client = get_openai_client(
+        model_details.get("endpoint_url"),
+        model_details.get("api_key"),
+        "generative"
     )
     
     try:
@@ -31,13 +36,57 @@ async def _call_generative_api(model_details: Dict[str, Any], prompt: str) -> st
         logger.error(f"Error calling Generative API ({model_details.get('name')}): {e}", exc_info=True)
         raise ValueError(f"Failed to get answer from generative model: {e}")
 
-async def generate_rag_response(
-    db: Session, 
-    qdrant: QdrantClient, 
+async def _stream_generative_api(model_details: Dict[str, Any], prompt: str) -> AsyncIterator[str]:
+    """
+    辅助函数：以流式方式调用 Generative LLM API，逐段产出文本。
+    生成器被关闭 (例如客户端断开) 时会关闭上游 HTTP 流，从而中止生成。
+    """
+    client = get_openai_client(
+        model_details.get("endpoint_url"),
+        model_details.get("api_key"),
+        "generative"
+    )
+    stream = await client.chat.completions.create(
+        model=model_details.get("name"),
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0.1,
+        stream=True,
+    )
+    async with stream:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+
+def _build_answer_prompt(query: str, contexts: List[RetrievedContext]) -> str:
+    context_string = "\n\n---\n\n".join([ctx.text for ctx in contexts])
+    
+    return f"""
+Please answer the user's question based *only* on the provided context information.
+If the context does not contain the answer, state that you cannot find the information in the provided context.
+
+[CONTEXT INFORMATION]:
+{context_string}
+
+[USER'S QUESTION]:
+{query}
+
+[YOUR ANSWER]:
+"""
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    """ 编码一条 Server-Sent Event """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def prepare_rag_query(
+    db: Session,
+    qdrant: AsyncQdrantClient,
     request: RagQueryRequest
-) -> RagQueryResponse:
+) -> Tuple[Dict[str, Any], RetrievalResult]:
     """
-    (核心) 执行完整的 RAG 流程
+    RAG 查询的准备阶段 (校验生成模型 + 检索)，普通接口和流式接口共用。
     """
     if not request.knowledgebase_ids:
         raise ValueError("No knowledge bases selected for query.")
@@ -54,94 +103,89 @@ async def generate_rag_response(
         "api_key": gen_model.api_key
     }
 
-    # 1b. 获取用于 *嵌入* 的模型
-    first_kb = crud_knowledgebase.get_kb(db, request.knowledgebase_ids[0])
-    if not first_kb or not first_kb.embedding_model_id:
-        raise ValueError(f"Selected KnowledgeBase (ID: {first_kb.id}) has no embedding model configured.")
-        
-    embed_model = crud_model.get_model(db, first_kb.embedding_model_id)
-    if not embed_model or embed_model.model_type != 'embedding':
-        raise ValueError(f"Invalid or non-embedding model found for KB (ID: {embed_model.id}).")
+    # --- 2. 检索 (嵌入模型取自第一个 KB) ---
+    # 上下文按生成模型的 token 预算打包，提示词大小 (以及延迟/成本) 可预期
+    token_budget = gen_model.context_token_budget or settings.RAG_CONTEXT_TOKEN_BUDGET
+    retrieval = await RetrievalEngine(db, qdrant).retrieve(
+        request.query, request.knowledgebase_ids, request.top_k,
+        token_budget=token_budget, rerank_model_id=request.rerank_model_id,
+        graph_hops=request.graph_expansion_hops
+    )
+    logger.info(f"RAG Query: Using Embedding Model '{retrieval.embed_model.name}' and Generative Model '{gen_model.name}'")
 
-    logger.info(f"RAG Query: Using Embedding Model '{embed_model.name}' and Generative Model '{gen_model.name}'")
+    return gen_model_details, retrieval
 
-    # --- 2. 向量化查询 (Retrieve) ---
-    try:
-        query_vector = (await get_embeddings_from_api(
-            texts=[request.query],
-            base_url=embed_model.endpoint_url,
-            model_name=embed_model.name,
-            api_key=embed_model.api_key,
-            dimensions=embed_model.dimensions
-        ))[0]
-    except Exception as e:
-        logger.error(f"Failed to embed query '{request.query}': {e}", exc_info=True)
-        raise ValueError(f"Failed to process query vector: {e}")
-
-    # --- 3. 并行检索 Qdrant (Retrieve) ---
-    all_contexts = []
-    seen_texts = set()
-
-    for kb_id in request.knowledgebase_ids:
-        collection_name = f"kb_{kb_id}"
-        try:
-            search_results = qdrant.search(
-                collection_name=collection_name,
-                query_vector=query_vector,
-                limit=request.top_k,
-                with_payload=True
-            )
-            
-            for point in search_results:
-                text = point.payload.get("text")
-                if text not in seen_texts:
-                    all_contexts.append(RetrievedContext(
-                        source_kb_id=kb_id,
-                        file_path=point.payload.get("metadata", {}).get("file_path", "N/A"),
-                        text=text,
-                        score=point.score
-                    ))
-                    seen_texts.add(text)
-                    
-        except Exception as e:
-            logger.warning(f"Failed to search collection '{collection_name}': {e}")
+async def generate_rag_response(
+    db: Session, 
+    qdrant: AsyncQdrantClient, 
+    request: RagQueryRequest
+) -> RagQueryResponse:
+    """
+    (核心) 执行完整的 RAG 流程
+    """
+    # --- 1-2. 获取模型配置并检索 ---
+    gen_model_details, retrieval = await prepare_rag_query(db, qdrant, request)
+    all_contexts = retrieval.contexts
 
     if not all_contexts:
-        return RagQueryResponse(answer="Sorry, I couldn't find any relevant context in the selected knowledge bases.", retrieved_contexts=[])
-
-    # --- 4. 构建 Metaprompt (Augment) ---
-    context_string = "\n\n---\n\n".join([ctx.text for ctx in all_contexts])
-    
-    metaprompt = f"""
-Please answer the user's question based *only* on the provided context information.
-If the context does not contain the answer, state that you cannot find the information in the provided context.
+        return RagQueryResponse(answer=NO_CONTEXT_ANSWER, retrieved_contexts=[], timings=retrieval.timings, packing=retrieval.packing)
 
-[CONTEXT INFORMATION]:
-{context_string}
-
-[USER'S QUESTION]:
-{request.query}
+    # --- 3. 构建 Metaprompt (Augment) ---
+    metaprompt = _build_answer_prompt(request.query, all_contexts)
 
-[YOUR ANSWER]:
-"""
-
-    # --- 5. 调用 LLM 生成答案 (Generate) ---
+    # --- 4. 调用 LLM 生成答案 (Generate) ---
     try:
         final_answer = await _call_generative_api(gen_model_details, metaprompt)
         
         return RagQueryResponse(
             answer=final_answer,
-            retrieved_contexts=all_contexts
+            retrieved_contexts=all_contexts,
+            timings=retrieval.timings,
+            packing=retrieval.packing
         )
     except Exception as e:
         return RagQueryResponse(
             answer=f"Error during answer generation: {e}",
-            retrieved_contexts=all_contexts
+            retrieved_contexts=all_contexts,
+            timings=retrieval.timings,
+            packing=retrieval.packing
         )
 
+async def stream_rag_answer(
+    request: RagQueryRequest,
+    gen_model_details: Dict[str, Any],
+    retrieval: RetrievalResult
+) -> AsyncIterator[str]:
+    """
+    流式 RAG 答案 (SSE):
+      event: contexts -> 检索到的上下文 (立即发送)
+      event: token    -> 生成的文本片段
+      event: done / error
+    """
+    yield _sse("contexts", {
+        "retrieved_contexts": [ctx.model_dump() for ctx in retrieval.contexts],
+        "timings": retrieval.timings,
+        "packing": retrieval.packing
+    })
+
+    if not retrieval.contexts:
+        yield _sse("token", {"text": NO_CONTEXT_ANSWER})
+        yield _sse("done", {})
+        return
+
+    metaprompt = _build_answer_prompt(request.query, retrieval.contexts)
+    try:
+        async for text in _stream_generative_api(gen_model_details, metaprompt):
+            yield _sse("token", {"text": text})
+    except Exception as e:
+        logger.error(f"Error streaming from Generative API ({gen_model_details.get('name')}): {e}", exc_info=True)
+        yield _sse("error", {"detail": f"Error during answer generation: {e}"})
+        return
+    yield _sse("done", {})
+
 async def retrieve_contexts_only(
     db: Session, 
-    qdrant: QdrantClient, 
+    qdrant: AsyncQdrantClient, 
     request: RagRetrieveRequest
 ) -> RagRetrieveResponse:
     """
@@ -151,59 +195,15 @@ async def retrieve_contexts_only(
     if not request.knowledgebase_ids:
         raise ValueError("No knowledge bases selected for query.")
 
-    # --- 1. 获取嵌入模型配置 ---
-    first_kb = crud_knowledgebase.get_kb(db, request.knowledgebase_ids[0])
-    if not first_kb or not first_kb.embedding_model_id:
-        raise ValueError(f"Selected KnowledgeBase (ID: {first_kb.id}) has no embedding model configured.")
-        
-    embed_model = crud_model.get_model(db, first_kb.embedding_model_id)
-    if not embed_model or embed_model.model_type != 'embedding':
-        raise ValueError(f"Invalid or non-embedding model found for KB (ID: {embed_model.id}).")
-
-    logger.info(f"RAG Retrieve: Using Embedding Model '{embed_model.name}' for retrieval only")
+    # --- 1. 检索 (嵌入模型取自第一个 KB) ---
+    retrieval = await RetrievalEngine(db, qdrant).retrieve(
+        request.query, request.knowledgebase_ids, request.top_k, rerank_model_id=request.rerank_model_id,
+        graph_hops=request.graph_expansion_hops
+    )
+    all_contexts = retrieval.contexts
+    logger.info(f"RAG Retrieve: Using Embedding Model '{retrieval.embed_model.name}' for retrieval only")
 
-    # --- 2. 向量化查询 (Retrieve) ---
-    try:
-        query_vector = (await get_embeddings_from_api(
-            texts=[request.query],
-            base_url=embed_model.endpoint_url,
-            model_name=embed_model.name,
-            api_key=embed_model.api_key,
-            dimensions=embed_model.dimensions
-        ))[0]
-    except Exception as e:
-        logger.error(f"Failed to embed query '{request.query}': {e}", exc_info=True)
-        raise ValueError(f"Failed to process query vector: {e}")
-
-    # --- 3. 并行检索 Qdrant (Retrieve) ---
-    all_contexts = []
-    seen_texts = set()
-
-    for kb_id in request.knowledgebase_ids:
-        collection_name = f"kb_{kb_id}"
-        try:
-            search_results = qdrant.search(
-                collection_name=collection_name,
-                query_vector=query_vector,
-                limit=request.top_k,
-                with_payload=True
-            )
-            
-            for point in search_results:
-                text = point.payload.get("text")
-                if text not in seen_texts:
-                    all_contexts.append(RetrievedContext(
-                        source_kb_id=kb_id,
-                        file_path=point.payload.get("metadata", {}).get("file_path", "N/A"),
-                        text=text,
-                        score=point.score
-                    ))
-                    seen_texts.add(text)
-                    
-        except Exception as e:
-            logger.warning(f"Failed to search collection '{collection_name}': {e}")
-
-    # --- 4. 构建增强提示词 (Augment) ---
+    # --- 2. 构建增强提示词 (Augment) ---
     if all_contexts:
         context_string = "\n\n---\n\n".join([ctx.text for ctx in all_contexts])
         
@@ -237,5 +237,6 @@ async def retrieve_contexts_only(
     return RagRetrieveResponse(
         enhanced_prompt=enhanced_prompt,
         retrieved_contexts=all_contexts,
-        metaprompt=metaprompt if all_contexts else None
+        metaprompt=metaprompt if all_contexts else None,
+        timings=retrieval.timings
     )
\ No newline at end of file
@@ -0,0 +1,112 @@
+# app/services/reranking.py
+
+import logging
+import re
+from typing import List, Optional
+
+from app.core.llm_clients import get_openai_client
+from app.models.model import Model
+from app.schemas.rag import RetrievedContext
+from app.services.sparse_encoder import tokenize
+
+logger = logging.getLogger(__name__)
+
+# 词法重排序的打分权重
+TERM_OVERLAP_WEIGHT = 0.4
+IDENTIFIER_WEIGHT = 0.3
+RETRIEVAL_SCORE_WEIGHT = 0.3
+
+# 查询中 "看起来像标识符" 的词: 含下划线/内部大写/点号，或用反引号包裹
+_BACKTICK_RE = re.compile(r"`([^`]+)`")
+_IDENTIFIER_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_.]*")
+
+
+def _query_identifiers(query: str) -> List[str]:
+    identifiers = set(m.strip() for m in _BACKTICK_RE.findall(query) if m.strip())
+    for word in _IDENTIFIER_RE.findall(query):
+        if len(word) >= 3 and ("_" in word or "." in word.strip(".") or any(c.isupper() for c in word[1:])):
+            identifiers.add(word.strip("."))
+    return sorted(identifiers)
+
+
+class LexicalReranker:
+    """
+    进程内 CPU 重排序: 查询词覆盖率 + 标识符精确命中 + 原始检索分数。
+    不需要任何模型，几十个候选的开销在毫秒级。
+    """
+    name = "lexical"
+
+    async def rerank(self, query: str, contexts: List[RetrievedContext]) -> List[RetrievedContext]:
+        query_tokens = set(tokenize(query))
+        identifiers = _query_identifiers(query)
+        if not contexts or (not query_tokens and not identifiers):
+            return contexts
+
+        max_score = max((ctx.score for ctx in contexts), default=0.0) or 1.0
+        rescored = []
+        for ctx in contexts:
+            text = ctx.text or ""
+            overlap = len(query_tokens & set(tokenize(text))) / len(query_tokens) if query_tokens else 0.0
+            haystack = f"{ctx.file_path}\n{text}"
+            identifier_hits = sum(1 for ident in identifiers if ident in haystack) / len(identifiers) if identifiers else 0.0
+            score = (
+                TERM_OVERLAP_WEIGHT * overlap
+                + IDENTIFIER_WEIGHT * identifier_hits
+                + RETRIEVAL_SCORE_WEIGHT * max(ctx.score, 0.0) / max_score
+            )
+            rescored.append(ctx.model_copy(update={"score": round(score, 6)}))
+        rescored.sort(key=lambda c: c.score, reverse=True)
+        return rescored
+
+
+class ModelReranker:
+    """
+    调用在 models 表中注册的 'rerank' 模型 (OpenAI 兼容服务的 POST {endpoint}/rerank,
+    请求/响应格式与 Jina / Cohere / vLLM / TEI 的 rerank 接口一致)。
+    调用失败时退回词法重排序。
+    """
+    name = "model"
+
+    def __init__(self, model: Model):
+        self.model = model
+        self._fallback = LexicalReranker()
+
+    async def rerank(self, query: str, contexts: List[RetrievedContext]) -> List[RetrievedContext]:
+        if not contexts:
+            return contexts
+        try:
+            # 客户端创建也在 try 中: 端点/密钥配置错误的 rerank 模型同样退回词法重排序
+            client = get_openai_client(self.model.endpoint_url, self.model.api_key, "rerank")
+            response = await client.post(
+                "/rerank",
+                body={
+                    "model": self.model.name,
+                    "query": query,
+                    "documents": [ctx.text or "" for ctx in contexts],
+                    "top_n": len(contexts),
+                },
+                cast_to=object
+            )
+            results = response.get("results") if isinstance(response, dict) else None
+            if not results:
+                raise ValueError(f"Unexpected rerank response: {str(response)[:200]}")
+        except Exception as e:
+            logger.warning(f"Rerank model '{self.model.name}' failed, falling back to lexical reranker: {e}")
+            return await self._fallback.rerank(query, contexts)
+
+        rescored = []
+        for item in results:
+            index = item.get("index")
+            if index is None or not (0 <= index < len(contexts)):
+                continue
+            score = item.get("relevance_score", item.get("score", 0.0))
+            rescored.append(contexts[index].model_copy(update={"score": float(score)}))
+        rescored.sort(key=lambda c: c.score, reverse=True)
+        return rescored
+
+
+def get_reranker(model: Optional[Model], enabled: bool):
+    """ 指定了 rerank 模型时使用模型重排序，否则在启用时使用词法重排序 """
+    if model is not None:
+        return ModelReranker(model)
+    return LexicalReranker() if enabled else None
@@ -0,0 +1,337 @@
+# app/services/retrieval_engine.py
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+from qdrant_client import AsyncQdrantClient, models
+
+from app.core.config import settings
+from app.crud import crud_model, crud_knowledgebase
+from app.models.model import Model
+from app.schemas.rag import RetrievedContext
+from app.services.ingestion_pipeline import get_embeddings_with_cache
+from app.services.query_vector_cache import query_vector_cache
+from app.services.context_packing import pack_contexts
+from app.services import vector_store, graph_store, static_extractor
+from app.services.reranking import get_reranker
+
+logger = logging.getLogger(__name__)
+
+# 图谱扩展时每次向 Qdrant 查询的邻居实体数 (按离种子的远近分批，预算填满即停止)
+GRAPH_LOOKUP_BATCH = 16
+
+
+@dataclass
+class RetrievalState:
+    """ 在各阶段之间传递的检索状态 """
+    query: str
+    kb_ids: List[int]
+    top_k: int
+    filters: Optional[models.Filter] = None
+    # 上下文 token 预算 (None = 不限制)
+    token_budget: Optional[int] = None
+    # 每个集合检索的条数 (启用重排序时过采样)
+    fetch_k: int = 0
+    reranker: Optional[Any] = None
+    # 沿 L2b 图谱扩展的跳数 (0 = 不扩展)
+    graph_hops: int = 0
+    embed_model: Optional[Model] = None
+    query_vector: Optional[List[float]] = None
+    # (kb_id, ScoredPoint)
+    candidates: List[Tuple[int, Any]] = field(default_factory=list)
+    contexts: List[RetrievedContext] = field(default_factory=list)
+    timings: Dict[str, float] = field(default_factory=dict)
+    packing: Optional[Dict[str, int]] = None
+
+
+@dataclass
+class RetrievalResult:
+    contexts: List[RetrievedContext]
+    embed_model: Optional[Model]
+    timings: Dict[str, float]
+    # 上下文打包统计 (仅在设置了 token_budget 时存在)
+    packing: Optional[Dict[str, int]] = None
+
+
+Stage = Callable[["RetrievalEngine", RetrievalState], Awaitable[None]]
+
+
+def resolve_embedding_model(db: Session, kb_ids: List[int]) -> Model:
+    """ 检索使用第一个 KB 的嵌入模型 (所有选中的 KB 应使用同一模型) """
+    first_kb = crud_knowledgebase.get_kb(db, kb_ids[0])
+    if not first_kb or not first_kb.embedding_model_id:
+        raise ValueError(f"Selected KnowledgeBase (ID: {kb_ids[0]}) has no embedding model configured.")
+
+    embed_model = crud_model.get_model(db, first_kb.embedding_model_id)
+    if not embed_model or embed_model.model_type != 'embedding':
+        raise ValueError(f"Invalid or non-embedding model found for KB (ID: {first_kb.id}).")
+    return embed_model
+
+
+# --- 默认阶段 ---
+
+async def embed_stage(engine: "RetrievalEngine", state: RetrievalState) -> None:
+    if state.embed_model is None:
+        state.embed_model = resolve_embedding_model(engine.db, state.kb_ids)
+    embed_model = state.embed_model
+
+    # 重复的查询 (例如前端切换 KB 后重新提问) 直接复用进程内缓存的向量
+    if settings.QUERY_VECTOR_CACHE_ENABLED:
+        cached = query_vector_cache.get(embed_model.id, embed_model.dimensions, state.query)
+        if cached is not None:
+            state.query_vector = cached
+            return
+
+    try:
+        state.query_vector = (await get_embeddings_with_cache(
+            texts=[state.query],
+            base_url=embed_model.endpoint_url,
+            model_name=embed_model.name,
+            api_key=embed_model.api_key,
+            dimensions=embed_model.dimensions
+        ))[0]
+    except Exception as e:
+        logger.error(f"Failed to embed query '{state.query}': {e}", exc_info=True)
+        raise ValueError(f"Failed to process query vector: {e}")
+
+    if settings.QUERY_VECTOR_CACHE_ENABLED:
+        query_vector_cache.put(embed_model.id, embed_model.dimensions, state.query, state.query_vector)
+
+
+async def search_stage(engine: "RetrievalEngine", state: RetrievalState) -> None:
+    """
+    并发检索所有集合 (每个集合稠密 + 稀疏 RRF 融合)，总延迟约等于最慢的一次检索。
+    同一共享集合中的多个 KB 合并为一次按 kb_id 过滤的检索。
+    """
+    groups: Dict[str, List[int]] = {}
+    profiles: Dict[str, Optional[str]] = {}
+    for kb_id in state.kb_ids:
+        kb = crud_knowledgebase.get_kb(engine.db, kb_id)
+        collection = vector_store.collection_for_kb(kb, kb_id)
+        groups.setdefault(collection, []).append(kb_id)
+        profiles[collection] = getattr(kb, "storage_profile", None)
+
+    async def search_one(collection: str, kb_ids: List[int]):
+        shared = vector_store.is_shared_collection(collection)
+        return await vector_store.search(
+            engine.qdrant,
+            collection,
+            state.query_vector,
+            state.query,
+            state.fetch_k,
+            vector_store.scope_filter(collection, kb_ids, state.filters),
+            # 量化集合按存储配置过采样并用原始向量重打分 (共享集合使用部署默认配置)
+            search_params=vector_store.search_params_for(None if shared else profiles[collection])
+        )
+
+    results = await asyncio.gather(*(search_one(c, ids) for c, ids in groups.items()), return_exceptions=True)
+    for (collection, kb_ids), result in zip(groups.items(), results):
+        if isinstance(result, Exception):
+            logger.warning(f"Failed to search collection '{collection}': {result}")
+            continue
+        for point in result:
+            kb_id = int((point.payload or {}).get(vector_store.KB_ID_KEY, kb_ids[0])) if len(kb_ids) > 1 else kb_ids[0]
+            state.candidates.append((kb_id, point))
+
+
+async def merge_stage(engine: "RetrievalEngine", state: RetrievalState) -> None:
+    """ 跨 KB 按分数全局排序 (所有集合的分数都是 RRF 尺度，见 vector_store.search) """
+    state.candidates.sort(key=lambda item: item[1].score, reverse=True)
+    state.contexts = [
+        RetrievedContext(
+            source_kb_id=kb_id,
+            file_path=(point.payload or {}).get("metadata", {}).get("file_path", "N/A"),
+            text=(point.payload or {}).get("text"),
+            score=point.score
+        )
+        for kb_id, point in state.candidates
+    ]
+
+
+async def dedup_stage(engine: "RetrievalEngine", state: RetrievalState) -> None:
+    """ 按文本去重，保留分数最高的一条 """
+    seen_texts = set()
+    unique = []
+    for ctx in state.contexts:
+        if ctx.text in seen_texts:
+            continue
+        seen_texts.add(ctx.text)
+        unique.append(ctx)
+    state.contexts = unique
+
+
+async def rerank_stage(engine: "RetrievalEngine", state: RetrievalState) -> None:
+    """ 对过采样的候选重新打分排序 (未配置重排序时保持检索顺序) """
+    if state.reranker is not None and state.contexts:
+        state.contexts = await state.reranker.rerank(state.query, state.contexts)
+
+
+async def top_k_stage(engine: "RetrievalEngine", state: RetrievalState) -> None:
+    """ 截取全局 top_k """
+    state.contexts = state.contexts[:state.top_k]
+
+
+def _expansion_candidates(edges: List[Dict[str, str]], seeds: set) -> Dict[str, str]:
+    """ 邻居实体 -> 第一次遇到它的边 (按 BFS 顺序，离种子越近越靠前) """
+    neighbors: Dict[str, str] = {}
+    for edge in edges:
+        for name in (edge["source"], edge["target"]):
+            if name not in seeds and name not in neighbors:
+                neighbors[name] = f"{edge['source']} -[{edge['relation']}]-> {edge['target']}"
+    return neighbors
+
+
+async def graph_stage(engine: "RetrievalEngine", state: RetrievalState) -> None:
+    """
+    图谱扩展: 命中片段定义的实体作为种子，在 KB 的 L2b 图谱中扩展 graph_hops 跳，
+    追加定义了调用方/被调用方的片段 (最多 GRAPH_EXPANSION_MAX_CHUNKS 个，不占 top_k 名额)。
+    图谱查询走 graph_edges 索引，片段查询走 Qdrant 的 defines 关键字索引。
+    旧版只有 JSON 的图谱由 worker 启动时导入 (graph_store.import_legacy_graphs)，这里不做同步导入。
+    """
+    if state.graph_hops <= 0 or not state.contexts:
+        return
+    seen_texts = {ctx.text for ctx in state.contexts}
+    # 追加片段的分数低于所有命中片段 (离种子越远越低)，token 预算不足时最先被丢弃
+    floor = min(ctx.score for ctx in state.contexts)
+    penalty = (abs(floor) or 1.0) * 0.5
+    budget = settings.GRAPH_EXPANSION_MAX_CHUNKS
+
+    for kb_id in state.kb_ids:
+        seeds = list(dict.fromkeys(
+            name for ctx in state.contexts if ctx.source_kb_id == kb_id
+            for name in static_extractor.defined_names(ctx.text or "")
+        ))
+        if not seeds or budget <= 0:
+            continue
+        graph_kb = crud_knowledgebase.find_child_by_type(engine.db, parent_id=kb_id, kb_type="l2b_graph")
+        if graph_kb is None or not graph_store.is_indexed(engine.db, graph_kb.id):
+            continue
+
+        neighborhood = graph_store.get_neighborhood(
+            engine.db, graph_kb.id, seeds, hops=state.graph_hops, max_edges=settings.GRAPH_EXPANSION_MAX_EDGES
+        )
+        neighbors = _expansion_candidates(neighborhood["edges"], set(seeds))
+        if not neighbors:
+            continue
+        collection = vector_store.collection_for_kb(crud_knowledgebase.get_kb(engine.db, kb_id), kb_id)
+        query_filter = vector_store.scope_filter(collection, [kb_id], state.filters)
+        names = list(neighbors)
+        rank = {name: i for i, name in enumerate(names)}
+        def first_neighbor(record) -> str:
+            defined = [n for n in (record.payload or {}).get(vector_store.DEFINES_KEY, []) if n in rank]
+            return min(defined, key=rank.get) if defined else ""
+
+        # scroll 按点 id 而不是邻居远近返回，所以按 BFS 顺序分小批查询，离种子近的邻居先占预算
+        for start in range(0, len(names), GRAPH_LOOKUP_BATCH):
+            try:
+                records = await vector_store.scroll_by_defines(
+                    engine.qdrant, collection, names[start:start + GRAPH_LOOKUP_BATCH], limit=budget * 2,
+                    query_filter=query_filter
+                )
+            except Exception as e:
+                logger.warning(f"Graph expansion lookup failed for KB {kb_id} in '{collection}': {e}")
+                break
+
+            for record in sorted(records, key=lambda r: rank.get(first_neighbor(r), len(rank))):
+                payload = record.payload or {}
+                text = payload.get("text")
+                name = first_neighbor(record)
+                if not text or not name or text in seen_texts:
+                    continue
+                seen_texts.add(text)
+                state.contexts.append(RetrievedContext(
+                    source_kb_id=kb_id,
+                    file_path=payload.get("metadata", {}).get("file_path", "N/A"),
+                    text=text,
+                    score=round(floor - penalty * (1 + rank[name] / len(rank)), 6),
+                    graph_relation=neighbors[name]
+                ))
+                budget -= 1
+                if budget <= 0:
+                    break
+            if budget <= 0:
+                break
+
+
+async def budget_stage(engine: "RetrievalEngine", state: RetrievalState) -> None:
+    """ 按 token 预算打包 (合并同文件重叠片段、截断/丢弃超出部分) """
+    if state.token_budget:
+        state.contexts, state.packing = pack_contexts(state.contexts, state.token_budget)
+        if state.packing["dropped_tokens"]:
+            logger.info(f"Context packing dropped {state.packing['dropped_tokens']} tokens (budget {state.token_budget}).")
+
+
+DEFAULT_STAGES: List[Tuple[str, Stage]] = [
+    ("embed", embed_stage),
+    ("search", search_stage),
+    ("merge", merge_stage),
+    ("dedup", dedup_stage),
+    ("rerank", rerank_stage),
+    ("top_k", top_k_stage),
+    ("graph", graph_stage),
+    ("budget", budget_stage),
+]
+
+
+class RetrievalEngine:
+    """
+    RAG 检索的唯一入口 (RAG 查询/纯检索接口和 L2a 摘要管道共用)。
+    检索按阶段链依次执行，每个阶段的耗时记录在 timings 中 (毫秒)。
+    """
+
+    def __init__(self, db: Session, qdrant: AsyncQdrantClient, stages: Optional[List[Tuple[str, Stage]]] = None):
+        self.db = db
+        self.qdrant = qdrant
+        self.stages = list(stages) if stages is not None else list(DEFAULT_STAGES)
+
+    def replace_stage(self, name: str, stage: Stage) -> None:
+        """ 替换同名阶段 (例如自定义 rerank) """
+        for i, (stage_name, _) in enumerate(self.stages):
+            if stage_name == name:
+                self.stages[i] = (name, stage)
+                return
+        raise KeyError(f"Unknown retrieval stage '{name}'")
+
+    async def retrieve(
+        self,
+        query: str,
+        kb_ids: List[int],
+        top_k: int,
+        filters: Optional[models.Filter] = None,
+        token_budget: Optional[int] = None,
+        rerank_model_id: Optional[int] = None,
+        graph_hops: int = 0
+    ) -> RetrievalResult:
+        if not kb_ids:
+            raise ValueError("No knowledge bases selected for query.")
+
+        rerank_model = None
+        if rerank_model_id is not None:
+            rerank_model = crud_model.get_model(self.db, rerank_model_id)
+            if not rerank_model or rerank_model.model_type != 'rerank':
+                raise ValueError(f"Invalid or non-rerank model selected (ID: {rerank_model_id}).")
+        reranker = get_reranker(rerank_model, settings.RAG_RERANK_ENABLED)
+
+        state = RetrievalState(
+            query=query,
+            kb_ids=list(dict.fromkeys(kb_ids)), # 去重并保持顺序
+            top_k=top_k,
+            filters=filters,
+            token_budget=token_budget,
+            fetch_k=top_k * max(1, settings.RAG_RERANK_OVERFETCH) if reranker else top_k,
+            reranker=reranker,
+            graph_hops=graph_hops
+        )
+        started = time.perf_counter()
+        for name, stage in self.stages:
+            stage_started = time.perf_counter()
+            await stage(self, state)
+            state.timings[name] = round((time.perf_counter() - stage_started) * 1000, 2)
+        state.timings["total"] = round((time.perf_counter() - started) * 1000, 2)
+
+        logger.info(f"Retrieval over KBs {state.kb_ids}: {len(state.contexts)} contexts, timings(ms)={state.timings}")
+        return RetrievalResult(contexts=state.contexts, embed_model=state.embed_model, timings=state.timings, packing=state.packing)
@@ -0,0 +1,73 @@
+# app/services/source_files.py
+
+# L2 管道 (知识图谱、分层摘要) 共用的源文件枚举:
+# 目录直接扫描；压缩包逐个成员读入内存 (archive_reader，不解压到磁盘)；单个文件原样返回。
+
+import logging
+from pathlib import Path, PurePosixPath
+from typing import Iterable, Iterator, Tuple
+
+from app.core.config import settings
+from app.services import archive_reader, corpus_filter
+
+logger = logging.getLogger(__name__)
+
+# (与 ingestion_pipeline 中的扩展名一致)
+CODE_EXTENSIONS = [
+    '.py', '.js', '.jsx', '.ts', '.tsx', '.go', '.java',
+    '.rs', '.c', '.h', '.cpp', '.hpp', '.cxx', '.hxx',
+    '.md', '.markdown', '.mdx'
+]
+
+
+def is_excluded_path(path: str) -> bool:
+    """ 隐藏文件/目录和 vendor 目录 (与摄取的语料过滤使用同一份目录列表；path 为相对根的 posix 路径) """
+    return corpus_filter.is_hidden_path(path) or corpus_filter.is_vendor_path(path)
+
+
+def accepts(path: str, size: int, extensions: Iterable[str] = CODE_EXTENSIONS) -> bool:
+    """ 只看路径和大小就能决定是否读取 (压缩包成员在解压前判断) """
+    if PurePosixPath(path).suffix.lower() not in extensions:
+        return False
+    if is_excluded_path(path):
+        logger.debug(f"Skipping vendor/hidden file: {path}")
+        return False
+    if size > settings.SOURCE_FILE_MAX_BYTES:
+        logger.debug(f"Skipping oversized file ({size} bytes): {path}")
+        return False
+    return True
+
+
+def _decode(path: str, data: bytes):
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        logger.warning(f"跳过文件 {path}: 不是有效的 UTF-8 编码。")
+        return None
+
+
+def iter_source_texts(source_path: Path) -> Iterator[Tuple[str, str]]:
+    """
+    产出 (相对路径 (posix), 文本内容)，跳过空文件和非 UTF-8 文件。
+    在工作线程中调用 (文件读取和解压都是阻塞的)。
+    """
+    if archive_reader.is_archive(source_path):
+        logger.info(f"源是压缩包。正在流式读取成员: {source_path}")
+        members = archive_reader.iter_members(source_path, accepts)
+    elif source_path.is_dir():
+        logger.info(f"源是目录。正在查找代码文件: {source_path}")
+        members = (
+            (f.relative_to(source_path).as_posix(), f.read_bytes())
+            for f in sorted(source_path.rglob('*'))
+            if f.is_file() and accepts(f.relative_to(source_path).as_posix(), f.stat().st_size)
+        )
+    elif source_path.is_file():
+        logger.info(f"源是单个文件: {source_path}")
+        members = iter([(source_path.name, source_path.read_bytes())])
+    else:
+        raise ValueError(f"Source path is not a file, directory, or supported archive: {source_path}")
+
+    for path, data in members:
+        text = _decode(path, data)
+        if text is not None and text.strip():
+            yield path, text
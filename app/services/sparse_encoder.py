@@ -0,0 +1,84 @@
+# app/services/sparse_encoder.py
+
+# 进程内的稀疏词法向量编码 (BM25 风格)，不依赖任何网络模型。
+# IDF 由 Qdrant 在检索时计算 (稀疏向量配置 modifier=IDF)，这里只负责词频部分。
+
+import re
+import zlib
+from collections import Counter
+from typing import Dict, List, Tuple
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+AVG_DOC_TOKENS = 200  # 近似的平均片段长度 (token 数)
+
+_WORD_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|[0-9]+|[\u4e00-\u9fff]+")
+_CAMEL_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+_CJK_RE = re.compile(r"[\u4e00-\u9fff]")
+
+STOPWORDS = {
+    "the", "and", "for", "with", "this", "that", "from", "are", "was", "not", "but", "you", "has", "have",
+    "self", "def", "return", "import", "if", "else", "in", "is", "of", "to", "a", "an", "or", "as", "be",
+}
+
+SparseEncoding = Tuple[List[int], List[float]]
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    代码感知分词: 标识符保留完整形式 (小写)，并额外拆出 snake_case / camelCase 的组成部分，
+    例如 `_update_parsing_status` -> _update_parsing_status, update, parsing, status；
+    `getEmbeddingsFromApi` -> getembeddingsfromapi, get, embeddings, from, api。
+    连续的中文按二元组切分。
+    """
+    tokens: List[str] = []
+    for match in _WORD_RE.finditer(text):
+        word = match.group()
+        if _CJK_RE.match(word):
+            if len(word) == 1:
+                tokens.append(word)
+            else:
+                tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+            continue
+
+        lower = word.lower()
+        if len(lower) >= 2 and lower not in STOPWORDS:
+            tokens.append(lower)
+        parts = [p.lower() for piece in word.split("_") for p in _CAMEL_RE.findall(piece)]
+        if len(parts) > 1:
+            tokens.extend(p for p in parts if len(p) >= 2 and p not in STOPWORDS and p != lower)
+    return tokens
+
+
+def _token_index(token: str) -> int:
+    """ 稳定的 token -> 稀疏维度映射 (哈希冲突时权重相加) """
+    return zlib.crc32(token.encode("utf-8")) & 0x7FFFFFFF
+
+
+def _to_sparse(weights: Dict[int, float]) -> SparseEncoding:
+    indices = sorted(weights)
+    return indices, [weights[i] for i in indices]
+
+
+def encode_document(text: str) -> SparseEncoding:
+    """ 文档侧: BM25 词频饱和 + 长度归一化 """
+    tokens = tokenize(text)
+    if not tokens:
+        return [], []
+    doc_len = len(tokens)
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len / AVG_DOC_TOKENS)
+    weights: Dict[int, float] = {}
+    for token, tf in Counter(tokens).items():
+        index = _token_index(token)
+        weights[index] = weights.get(index, 0.0) + tf * (BM25_K1 + 1) / (tf + norm)
+    return _to_sparse(weights)
+
+
+def encode_query(text: str) -> SparseEncoding:
+    """ 查询侧: 每个不同的 token 权重为 1 """
+    weights: Dict[int, float] = {}
+    for token in set(tokenize(text)):
+        index = _token_index(token)
+        weights[index] = weights.get(index, 0.0) + 1.0
+    return _to_sparse(weights)
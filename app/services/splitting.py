@@ -0,0 +1,83 @@
+# app/services/splitting.py
+
+# Document splitting, safe to run inside ProcessPoolExecutor workers.
+# This module is re-imported by every spawned worker process, so it must only
+# depend on llama_index (no database, settings or network clients).
+
+import logging
+import os
+from typing import Dict, List, Optional
+
+from llama_index.core import Document
+from llama_index.core.schema import BaseNode
+from llama_index.core.node_parser import SentenceSplitter, CodeSplitter, MarkdownNodeParser, NodeParser
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration Constants ---
+CHUNK_SIZE = 1024
+CHUNK_OVERLAP = 100
+CODE_CHUNK_LINES = 100
+CODE_CHUNK_OVERLAP = 20
+CODE_MAX_CHARS = 4000
+
+# --- Define language support here ---
+MARKDOWN_EXTENSIONS = {'.md', '.markdown', '.mdx'}
+CODE_LANGUAGES = {
+    '.py': "python",
+    '.js': "javascript", '.jsx': "javascript", '.ts': "javascript", '.tsx': "javascript",
+    '.go': "go",
+    '.java': "java",
+    '.rs': "rust",
+    '.c': "c", '.h': "c",
+    '.cpp': "cpp", '.hpp': "cpp", '.cxx': "cpp", '.hxx': "cpp",
+}
+
+# One splitter instance per kind ("markdown", "text" or a tree-sitter language), per process
+_splitters: Dict[str, NodeParser] = {}
+
+
+def splitter_kind_for(file_path: str) -> str:
+    """ Maps a file path to the splitter kind used for it. """
+    _, file_ext = os.path.splitext(file_path); file_ext = file_ext.lower()
+    if file_ext in MARKDOWN_EXTENSIONS: return "markdown"
+    return CODE_LANGUAGES.get(file_ext, "text") # Explicit default for non-code/unknown
+
+
+def _get_splitter(kind: str, kb_id: Optional[int] = None) -> NodeParser:
+    splitter = _splitters.get(kind)
+    if splitter is not None: return splitter
+    if kind == "markdown":
+        splitter = MarkdownNodeParser()
+    elif kind == "text":
+        splitter = SentenceSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    else:
+        try:
+            splitter = CodeSplitter(language=kind, chunk_lines=CODE_CHUNK_LINES, chunk_lines_overlap=CODE_CHUNK_OVERLAP, max_chars=CODE_MAX_CHARS)
+        except Exception as cs_err:
+            logger.warning(f"[KB {kb_id}] Failed CodeSplitter init ({kind}), fallback: {cs_err}")
+            splitter = _get_splitter("text", kb_id) # Fallback
+    _splitters[kind] = splitter
+    return splitter
+
+
+def split_document(doc: Document, kb_id: Optional[int] = None) -> List[BaseNode]:
+    """ Picks a splitter by file extension and splits a single document. """
+    file_path_meta = doc.metadata.get('file_path', '')
+    kind = splitter_kind_for(file_path_meta)
+    logger.debug(f"[KB {kb_id}] Splitting {file_path_meta} with '{kind}' splitter")
+    try:
+        doc_nodes = _get_splitter(kind, kb_id).get_nodes_from_documents([doc])
+        logger.debug(f"[KB {kb_id}] Split '{os.path.basename(file_path_meta)}' into {len(doc_nodes)} nodes.")
+        return doc_nodes
+    except ValueError as split_err: logger.warning(f"[KB {kb_id}] Skip split '{file_path_meta}': {split_err}.")
+    except Exception as split_err: logger.error(f"[KB {kb_id}] Error split '{file_path_meta}': {split_err}", exc_info=False)
+    return []
+
+
+def split_documents(kb_id: Optional[int], docs: List[Document]) -> List[BaseNode]:
+    """ Splits all documents of one file (process-pool entry point). """
+    nodes: List[BaseNode] = []
+    for doc in docs:
+        nodes.extend(split_document(doc, kb_id))
+    return nodes
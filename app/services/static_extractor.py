@@ -0,0 +1,307 @@
+# app/services/static_extractor.py
+
+# 零 LLM 的知识图谱三元组提取 (与 kg_service 的 LLM 输出格式相同):
+#   [Subject, "INHERITS_FROM", Base] / [Function, "CALLS", Callee] / [Function, "INSTANTIATES", Class]
+# Python 使用标准库 ast；其他语言使用 CodeSplitter 同款的 tree-sitter 语法 (tree_sitter_language_pack)。
+
+import ast
+import logging
+import re
+from pathlib import Path
+from typing import Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    from tree_sitter_language_pack import get_parser
+except ImportError:  # 可选依赖: 缺失时只有 Python 走静态提取
+    get_parser = None
+    logger.warning("tree_sitter_language_pack is not installed; static extraction only covers Python files.")
+
+INHERITS_FROM = "INHERITS_FROM"
+CALLS = "CALLS"
+INSTANTIATES = "INSTANTIATES"
+
+Triplet = List[str]
+
+# 扩展名 -> tree-sitter 语言 (Python 单独用 ast 处理)
+TREE_SITTER_LANGUAGES = {
+    '.js': "javascript", '.jsx': "javascript",
+    '.ts': "typescript", '.tsx': "tsx",
+    '.go': "go",
+    '.java': "java",
+    '.rs': "rust",
+    '.c': "c", '.h': "c",
+    '.cpp': "cpp", '.hpp': "cpp", '.cxx': "cpp", '.hxx': "cpp",
+}
+
+_IDENT_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+# 创建解析器失败的语言 (例如语法包与 tree-sitter 版本不兼容)，只告警一次，之后交给 LLM
+_unavailable_languages: Set[str] = set()
+
+
+def _get_parser(language: str):
+    if get_parser is None or language in _unavailable_languages:
+        return None
+    try:
+        return get_parser(language)
+    except Exception as e:
+        _unavailable_languages.add(language)
+        logger.warning(f"tree-sitter parser for '{language}' is unavailable, static extraction disabled for it: {e}")
+        return None
+
+
+def supports(file_path: Path) -> bool:
+    suffix = file_path.suffix.lower()
+    if suffix == '.py':
+        return True
+    language = TREE_SITTER_LANGUAGES.get(suffix)
+    return language is not None and _get_parser(language) is not None
+
+
+def extract_triplets(file_path: Path, code: str) -> Optional[List[Triplet]]:
+    """ 返回去重后的三元组；语言不支持或解析失败时返回 None (由调用方决定是否交给 LLM) """
+    suffix = file_path.suffix.lower()
+    try:
+        if suffix == '.py':
+            triplets = _extract_python(code, file_path.stem)
+        elif suffix in TREE_SITTER_LANGUAGES:
+            parser = _get_parser(TREE_SITTER_LANGUAGES[suffix])
+            if parser is None:
+                return None
+            triplets = _extract_tree_sitter(code, parser, file_path.stem)
+        else:
+            return None
+    except Exception as e:
+        logger.warning(f"Static extraction failed for {file_path.name}: {e}")
+        return None
+    return _dedup(triplets)
+
+
+# --- 片段级定义名 (检索时把代码块映射到图谱实体) ---
+
+# 代码块通常不是完整的语法单元，这里用逐行正则而不是 ast / tree-sitter
+_DEFINITION_RES = [
+    re.compile(r"^(\s*)(?:async\s+)?def\s+([A-Za-z_]\w*)"),                                        # Python 函数/方法
+    re.compile(r"^(\s*)class\s+([A-Za-z_]\w*)"),                                                    # Python / JS / TS / Java / C++
+    re.compile(r"^(\s*)(?:export\s+)?(?:default\s+)?(?:async\s+)?function\*?\s+([A-Za-z_$][\w$]*)"),  # JS / TS
+    re.compile(r"^(\s*)func\s+(?:\([^)]*\)\s*)?([A-Za-z_]\w*)"),                                   # Go
+    re.compile(r"^(\s*)(?:pub(?:\([^)]*\))?\s+)?(?:async\s+)?fn\s+([A-Za-z_]\w*)"),                 # Rust
+    re.compile(r"^(\s*)(?:pub\s+)?(?:struct|trait|enum|interface)\s+([A-Za-z_]\w*)"),                # Rust / TS / Java
+]
+_PY_CLASS_RE = re.compile(r"^(\s*)class\s+([A-Za-z_]\w*)")
+
+
+def defined_names(text: str) -> List[str]:
+    """
+    代码块中定义的实体名，命名方式与上面的三元组提取一致:
+    类名 / 函数名，Python 方法额外给出 "Class.method" (同时保留裸方法名，兼容 LLM 提取的图谱)。
+    """
+    names: List[str] = []
+    class_stack: List[Tuple[int, str]] = []  # (缩进, 类名)
+    for line in (text or "").splitlines():
+        stripped = line.lstrip()
+        if not stripped:
+            continue
+        indent = len(line) - len(stripped)
+        while class_stack and indent <= class_stack[-1][0]:
+            class_stack.pop()
+        for pattern in _DEFINITION_RES:
+            match = pattern.match(line)
+            if not match:
+                continue
+            name = match.group(2)
+            if class_stack and pattern is _DEFINITION_RES[0]:
+                names.append(f"{class_stack[-1][1]}.{name}")
+            names.append(name)
+            if _PY_CLASS_RE.match(line):
+                class_stack.append((indent, name))
+            break
+    return list(dict.fromkeys(names))
+
+
+def _dedup(triplets: Iterable[Tuple[str, str, str]]) -> List[Triplet]:
+    seen: Set[Tuple[str, str, str]] = set()
+    result = []
+    for t in triplets:
+        if t[0] and t[2] and t not in seen:
+            seen.add(t)
+            result.append(list(t))
+    return result
+
+
+# --- Python (ast) ---
+
+def _dotted_name(node: ast.AST) -> Optional[str]:
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    if isinstance(node, ast.Subscript):  # Generic[T]
+        return _dotted_name(node.value)
+    if isinstance(node, ast.Call):
+        return _dotted_name(node.func)
+    return None
+
+
+def _extract_python(code: str, module_name: str) -> List[Tuple[str, str, str]]:
+    tree = ast.parse(code)
+    local_classes = {n.name for n in ast.walk(tree) if isinstance(n, ast.ClassDef)}
+    triplets: List[Tuple[str, str, str]] = []
+
+    def visit(node: ast.AST, scope: str, class_name: Optional[str]):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, ast.ClassDef):
+                for base in child.bases:
+                    base_name = _dotted_name(base)
+                    if base_name and base_name != "object":
+                        triplets.append((child.name, INHERITS_FROM, base_name))
+                visit(child, child.name, child.name)
+            elif isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                name = f"{class_name}.{child.name}" if class_name else child.name
+                visit(child, name, None)
+            else:
+                if isinstance(child, ast.Call):
+                    callee = _dotted_name(child.func)
+                    if callee:
+                        # 本文件定义的类，或按惯例首字母大写的名字，视为实例化
+                        kind = INSTANTIATES if callee in local_classes or callee[:1].isupper() else CALLS
+                        triplets.append((scope, kind, callee))
+                visit(child, scope, class_name)
+
+    visit(tree, module_name, None)
+    return triplets
+
+
+# --- tree-sitter (JS/TS, Go, Java, Rust, C/C++) ---
+
+FUNCTION_NODES = {
+    "function_declaration", "generator_function_declaration", "method_definition",  # JS/TS
+    "method_declaration", "constructor_declaration",                                # Java / Go
+    "function_item",                                                                # Rust
+    "function_definition",                                                          # C/C++
+}
+CLASS_NODES = {
+    "class_declaration", "abstract_class_declaration", "interface_declaration",     # JS/TS/Java
+    "class_specifier", "struct_specifier",                                          # C++
+    "impl_item",                                                                    # Rust
+}
+HERITAGE_NODES = {
+    "class_heritage", "extends_clause", "implements_clause", "extends_type_clause",  # JS/TS
+    "superclass", "super_interfaces", "extends_interfaces",                          # Java
+    "base_class_clause",                                                             # C++
+}
+CALL_NODES = {"call_expression", "method_invocation"}
+NEW_NODES = {"new_expression", "object_creation_expression", "composite_literal", "struct_expression"}
+
+
+def _text(node, source: bytes) -> str:
+    return source[node.start_byte:node.end_byte].decode("utf-8", errors="replace")
+
+
+def _last_identifier(node, source: bytes) -> Optional[str]:
+    """ a.b.c() / pkg.Func / ns::Type<T> -> 最后一个标识符 (泛型参数之前) """
+    if node is None:
+        return None
+    text = _text(node, source).split("<", 1)[0].split("(", 1)[0]
+    idents = _IDENT_RE.findall(text)
+    return idents[-1] if idents else None
+
+
+def _definition_name(node, source: bytes) -> Optional[str]:
+    name = node.child_by_field_name("name")
+    if name is not None:
+        return _last_identifier(name, source)
+    # C/C++: function_definition -> declarator -> function_declarator -> declarator
+    declarator = node.child_by_field_name("declarator")
+    while declarator is not None:
+        inner = declarator.child_by_field_name("declarator")
+        if inner is None:
+            return _last_identifier(declarator, source)
+        declarator = inner
+    return None
+
+
+def _heritage_names(node, source: bytes) -> List[str]:
+    names = []
+    for child in node.children:
+        if child.type in HERITAGE_NODES:
+            for ident in _IDENT_RE.findall(_strip_generics(_text(child, source))):
+                if ident not in ("extends", "implements", "public", "private", "protected", "virtual"):
+                    names.append(ident)
+    return names
+
+
+def _strip_generics(text: str) -> str:
+    depth, out = 0, []
+    for ch in text:
+        if ch == "<":
+            depth += 1
+        elif ch == ">":
+            depth = max(0, depth - 1)
+        elif depth == 0:
+            out.append(ch)
+    return "".join(out)
+
+
+def _extract_tree_sitter(code: str, parser, module_name: str) -> List[Tuple[str, str, str]]:
+    source = code.encode("utf-8")
+    tree = parser.parse(source)
+    triplets: List[Tuple[str, str, str]] = []
+
+    # 迭代遍历 (避免深层嵌套的递归上限)，栈中携带当前作用域名
+    stack = [(tree.root_node, module_name, None)]
+    while stack:
+        node, scope, class_name = stack.pop()
+        node_type = node.type
+
+        if node_type in CLASS_NODES:
+            if node_type == "impl_item":  # Rust: impl Trait for Type
+                type_name = _last_identifier(node.child_by_field_name("type"), source)
+                trait_name = _last_identifier(node.child_by_field_name("trait"), source)
+                if type_name and trait_name:
+                    triplets.append((type_name, INHERITS_FROM, trait_name))
+                class_name = type_name or class_name
+            else:
+                name = _definition_name(node, source)
+                if name:
+                    for base in _heritage_names(node, source):
+                        triplets.append((name, INHERITS_FROM, base))
+                    class_name = name
+            scope = class_name or scope
+
+        elif node_type in FUNCTION_NODES:
+            name = _definition_name(node, source)
+            if name:
+                # Go 方法: func (r *Recv) Name()
+                receiver = node.child_by_field_name("receiver")
+                owner = _go_receiver_type(receiver, source) if receiver is not None else class_name
+                scope = f"{owner}.{name}" if owner else name
+
+        elif node_type in CALL_NODES:
+            if node_type == "method_invocation":  # Java
+                callee = _last_identifier(node.child_by_field_name("name"), source)
+            else:
+                callee = _last_identifier(node.child_by_field_name("function"), source)
+            if callee:
+                triplets.append((scope, CALLS, callee))
+
+        elif node_type in NEW_NODES:
+            type_node = None
+            for field in ("constructor", "type", "name"):
+                type_node = node.child_by_field_name(field)
+                if type_node is not None:
+                    break
+            created = _last_identifier(type_node, source)
+            if created:
+                triplets.append((scope, INSTANTIATES, created))
+
+        for child in reversed(node.children):
+            stack.append((child, scope, class_name))
+    return triplets
+
+
+def _go_receiver_type(receiver, source: bytes) -> Optional[str]:
+    idents = _IDENT_RE.findall(_text(receiver, source))
+    return idents[-1] if idents else None
@@ -0,0 +1,232 @@
+# app/services/upload_service.py
+
+# 可续传的分块上传 (upload_sessions 表):
+#   POST   /{id}/uploads                   创建会话
+#   PUT    /{id}/uploads/{upload_id}?offset 追加一个分块 (请求体为原始字节，流式写盘)
+#   GET    /{id}/uploads/{upload_id}        查询已接收的 offset (断点续传)
+#   POST   /{id}/uploads/{upload_id}/commit 校验并把文件挂到 KB 上
+# 字节到达时即增量计算 sha256，commit 时不再重读整个文件。
+
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import uuid
+from pathlib import Path
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+import aiofiles
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.crud import crud_knowledgebase, crud_upload_session
+from app.models.knowledgebase import KnowledgeBase
+from app.models.upload_session import UploadSession
+from app.services import kb_service
+
+logger = logging.getLogger(__name__)
+
+PARTIAL_DIR = kb_service.UPLOADS_DIR / "partial"
+# 从磁盘重建哈希状态时的读块大小
+REHASH_READ_SIZE = 4 * 1024 * 1024
+
+
+class UploadOffsetMismatch(ValueError):
+    """ 分块的 offset 与服务端已接收的字节数不一致 (客户端应从 expected_offset 续传) """
+
+    def __init__(self, expected_offset: int):
+        super().__init__(f"Upload offset mismatch: server has {expected_offset} bytes.")
+        self.expected_offset = expected_offset
+
+
+class UploadTooLarge(ValueError):
+    """ 超出 UPLOAD_MAX_BYTES 或会话声明的 total_size """
+
+
+# 进程内的增量哈希状态: upload_id -> (已哈希的字节数, sha256 对象)
+# 进程重启或请求落到其他 worker 进程时，从磁盘上的部分文件重建
+_hash_states: Dict[str, Tuple[int, "hashlib._Hash"]] = {}
+_hash_lock = threading.Lock()
+_session_locks: Dict[str, asyncio.Lock] = {}
+
+
+def _partial_path(upload_id: str) -> Path:
+    return PARTIAL_DIR / f"{upload_id}.part"
+
+
+def _rehash(path: Path, length: int) -> "hashlib._Hash":
+    hasher = hashlib.sha256()
+    remaining = length
+    with path.open("rb") as f:
+        while remaining > 0:
+            block = f.read(min(REHASH_READ_SIZE, remaining))
+            if not block:
+                break
+            hasher.update(block)
+            remaining -= len(block)
+    return hasher
+
+
+def _take_hash_state(upload_id: str, offset: int) -> Optional["hashlib._Hash"]:
+    with _hash_lock:
+        state = _hash_states.pop(upload_id, None)
+    if state is not None and state[0] == offset:
+        return state[1]
+    return None
+
+
+def _check_size(upload: UploadSession, new_size: int) -> None:
+    if new_size > settings.UPLOAD_MAX_BYTES:
+        raise UploadTooLarge(f"Upload exceeds the maximum allowed size of {settings.UPLOAD_MAX_BYTES} bytes.")
+    if upload.total_size is not None and new_size > upload.total_size:
+        raise UploadTooLarge(f"Upload exceeds the declared total_size of {upload.total_size} bytes.")
+
+
+def _discard_partial(upload_id: str) -> None:
+    with _hash_lock:
+        _hash_states.pop(upload_id, None)
+    _session_locks.pop(upload_id, None)
+    try:
+        _partial_path(upload_id).unlink(missing_ok=True)
+    except OSError as e:
+        logger.warning(f"Failed to remove partial upload '{upload_id}': {e}")
+
+
+def expire_stale_sessions(db: Session) -> int:
+    """ 删除超过 UPLOAD_SESSION_TTL_SECONDS 没有新分块的会话及其部分文件 """
+    stale = crud_upload_session.get_stale_sessions(db, settings.UPLOAD_SESSION_TTL_SECONDS)
+    for upload in stale:
+        _discard_partial(upload.id)
+        crud_upload_session.set_status(db, upload, "aborted")
+    if stale:
+        logger.info(f"Expired {len(stale)} stale upload session(s).")
+    return len(stale)
+
+
+def create_session(db: Session, kb_id: int, filename: str, total_size: Optional[int]) -> Optional[UploadSession]:
+    if crud_knowledgebase.get_kb(db, kb_id) is None:
+        return None
+    safe_name = Path(filename or "").name
+    if not safe_name:
+        raise ValueError("A file name is required.")
+    if total_size is not None and total_size > settings.UPLOAD_MAX_BYTES:
+        raise UploadTooLarge(f"Upload exceeds the maximum allowed size of {settings.UPLOAD_MAX_BYTES} bytes.")
+
+    expire_stale_sessions(db)
+    PARTIAL_DIR.mkdir(parents=True, exist_ok=True)
+    upload_id = uuid.uuid4().hex
+    _partial_path(upload_id).touch()
+    upload = crud_upload_session.create_session(db, upload_id, kb_id, safe_name, total_size)
+    logger.info(f"[KB {kb_id}] Upload session {upload_id} created for '{safe_name}' (declared size: {total_size}).")
+    return upload
+
+
+def get_session(db: Session, kb_id: int, upload_id: str) -> Optional[UploadSession]:
+    return crud_upload_session.get_session(db, kb_id, upload_id)
+
+
+async def append_chunk(
+    db: Session,
+    upload: UploadSession,
+    offset: int,
+    chunks: AsyncIterator[bytes],
+    content_length: Optional[int] = None
+) -> UploadSession:
+    """
+    把一个分块流式写到部分文件末尾并更新哈希。
+    只有整个分块写完才推进 received；中途断开时多写的字节在下一次追加前截掉。
+    """
+    if upload.status != "uploading":
+        raise ValueError(f"Upload session is {upload.status}.")
+    if offset != upload.received:
+        raise UploadOffsetMismatch(upload.received)
+    if content_length is not None:
+        _check_size(upload, offset + content_length)
+
+    lock = _session_locks.setdefault(upload.id, asyncio.Lock())
+    async with lock:
+        # 等锁期间同一 offset 的另一个请求可能已经写完并推进了 received:
+        # 重新读取会话再校验，否则下面的截断会抹掉刚写入的分块
+        db.refresh(upload)
+        if upload.status != "uploading":
+            raise ValueError(f"Upload session is {upload.status}.")
+        if offset != upload.received:
+            raise UploadOffsetMismatch(upload.received)
+        path = _partial_path(upload.id)
+        if not path.exists():
+            raise ValueError("Partial upload data is missing; start a new upload session.")
+        # 丢弃上一次中断的分块残留
+        if path.stat().st_size != offset:
+            await asyncio.to_thread(os.truncate, path, offset)
+
+        hasher = _take_hash_state(upload.id, offset)
+        if hasher is None:
+            hasher = await asyncio.to_thread(_rehash, path, offset)
+
+        written = offset
+        async with aiofiles.open(path, "ab") as f:
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                _check_size(upload, written + len(chunk))
+                await f.write(chunk)
+                hasher.update(chunk)
+                written += len(chunk)
+
+        if not crud_upload_session.advance_offset(db, upload.id, offset, written):
+            raise UploadOffsetMismatch(crud_upload_session.get_session(db, upload.kb_id, upload.id).received)
+        with _hash_lock:
+            _hash_states[upload.id] = (written, hasher)
+
+    db.refresh(upload)
+    logger.debug(f"[KB {upload.kb_id}] Upload {upload.id}: {offset} -> {written} bytes.")
+    return upload
+
+
+async def commit_upload(db: Session, upload: UploadSession, expected_sha256: Optional[str] = None) -> Optional[KnowledgeBase]:
+    """
+    校验大小/哈希后把部分文件移动为 KB 的源文件，返回更新后的 KB。
+    持有会话锁 (等待进行中的追加写完) 并先把状态从 uploading 原子地切换为 committing，
+    之后的追加和并发的 commit 都会被拒绝，移动的文件与记录的 sha256 一致。
+    """
+    lock = _session_locks.setdefault(upload.id, asyncio.Lock())
+    async with lock:
+        db.refresh(upload)
+        if upload.status != "uploading":
+            raise ValueError(f"Upload session is {upload.status}.")
+        if upload.total_size is not None and upload.received != upload.total_size:
+            raise ValueError(f"Upload incomplete: received {upload.received} of {upload.total_size} bytes.")
+        if upload.received == 0:
+            raise ValueError("Upload is empty.")
+        if not crud_upload_session.transition_status(db, upload.id, "uploading", "committing"):
+            db.refresh(upload)
+            raise ValueError(f"Upload session is {upload.status}.")
+
+        try:
+            path = _partial_path(upload.id)
+            # 中断的分块可能在 received 之后留下残留字节
+            if path.stat().st_size != upload.received:
+                await asyncio.to_thread(os.truncate, path, upload.received)
+            hasher = _take_hash_state(upload.id, upload.received)
+            if hasher is None:
+                hasher = await asyncio.to_thread(_rehash, path, upload.received)
+            content_hash = hasher.hexdigest()
+            if expected_sha256 and expected_sha256.lower() != content_hash:
+                raise ValueError(f"Checksum mismatch: expected {expected_sha256}, got {content_hash}.")
+
+            final_path = kb_service.UPLOADS_DIR / f"kb_{upload.kb_id}_{upload.filename}"
+            await asyncio.to_thread(os.replace, path, final_path)
+        except Exception:
+            # 校验失败或移动失败: 会话回到 uploading，客户端可以续传、重新 commit 或放弃
+            crud_upload_session.transition_status(db, upload.id, "committing", "uploading")
+            raise
+        crud_upload_session.set_status(db, upload, "completed", content_hash=content_hash)
+    _session_locks.pop(upload.id, None)
+    logger.info(f"[KB {upload.kb_id}] Upload {upload.id} committed: {upload.received} bytes, sha256 {content_hash}.")
+    return kb_service.attach_source_file(db, upload.kb_id, final_path, content_hash)
+
+
+def abort_upload(db: Session, upload: UploadSession) -> UploadSession:
+    _discard_partial(upload.id)
+    return crud_upload_session.set_status(db, upload, "aborted")
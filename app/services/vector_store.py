@@ -0,0 +1,390 @@
+# app/services/vector_store.py
+
+# Qdrant 集合布局的唯一定义处:
+#   - 未命名的稠密向量 (嵌入模型输出, COSINE)
+#   - 命名稀疏向量 SPARSE_VECTOR_NAME (进程内 BM25 编码, IDF 由 Qdrant 计算)
+# 集合创建、写入点和混合检索都通过这里，避免各处各自拼 VectorParams。
+# 存储配置 (STORAGE_PROFILES) 决定量化方式、向量/payload 是否放磁盘以及 HNSW 参数；
+# KB 的 storage_profile 为空时使用部署默认值 VECTOR_STORAGE_PROFILE。
+# 集合模式 (VECTOR_COLLECTION_MODE):
+#   - per_kb: 每个 KB 一个集合 kb_{id}
+#   - shared: 使用同一嵌入模型的 KB 共用集合 kb_shared_{model_id}，按 payload 字段 kb_id 分区
+#             (is_tenant 的 keyword 索引，同一 KB 的点在存储上相邻)；
+#             KB 实际所在的集合记录在 knowledgebases.vector_collection (为空 = 旧的 kb_{id})
+
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional
+
+from qdrant_client import AsyncQdrantClient, QdrantClient, models
+
+from app.core.config import settings
+from app.services import sparse_encoder
+
+logger = logging.getLogger(__name__)
+
+SPARSE_VECTOR_NAME = "bm25"
+# 每个点所属的 KB，存为字符串 (kb_id_value)，共享集合上是 is_tenant 的 keyword 索引 (只支持字符串)；
+# 每个 KB 一个集合时同样写入，便于以后迁移
+KB_ID_KEY = "kb_id"
+SHARED_COLLECTION_PREFIX = "kb_shared_"
+# 代码块定义的实体名 (static_extractor.defined_names)，图谱扩展检索按此字段找片段
+DEFINES_KEY = "defines"
+# 混合检索时每一路预取的条数 = limit * HYBRID_PREFETCH_FACTOR，融合前保留更多候选
+HYBRID_PREFETCH_FACTOR = 2
+# Qdrant 的 RRF 融合给第 position 名 (从 0 开始) 记 1/(RRF_RANK_CONSTANT + position) 分。
+# 纯稠密检索 (旧集合) 的结果用同一公式按名次换算，与混合检索的分数处于同一尺度
+RRF_RANK_CONSTANT = 2
+# 集合是否有稀疏向量的缓存 (检索进程内)。旧集合重新解析后才会加上稀疏向量，
+# 所以 "有" 可以一直缓存，"没有" 只缓存 SPARSE_SUPPORT_TTL_SECONDS 秒
+SPARSE_SUPPORT_TTL_SECONDS = 300
+_sparse_support: Dict[str, tuple] = {}
+
+
+def collection_name_for(kb_id: int) -> str:
+    return f"kb_{kb_id}"
+
+
+def shared_collection_name(embedding_model_id: int) -> str:
+    # 同一嵌入模型行的维度固定，模型 ID 即可确定 (模型, 维度)
+    return f"{SHARED_COLLECTION_PREFIX}{embedding_model_id}"
+
+
+def is_shared_collection(collection_name: str) -> bool:
+    return collection_name.startswith(SHARED_COLLECTION_PREFIX)
+
+
+def target_collection(kb_id: int, embedding_model_id: int) -> str:
+    """ 本次解析应写入的集合 (由 VECTOR_COLLECTION_MODE 决定) """
+    if settings.VECTOR_COLLECTION_MODE == "shared":
+        return shared_collection_name(embedding_model_id)
+    return collection_name_for(kb_id)
+
+
+def collection_for_kb(kb: Any, kb_id: Optional[int] = None) -> str:
+    """ KB 当前的向量所在的集合 (kb 可以为 None，此时按旧规则 kb_{id}) """
+    collection = getattr(kb, "vector_collection", None)
+    return collection or collection_name_for(kb_id if kb_id is not None else kb.id)
+
+
+def kb_id_value(kb_id: int) -> str:
+    """ 写入 KB_ID_KEY 的值 """
+    return str(kb_id)
+
+
+def scope_filter(collection_name: str, kb_ids: Iterable[int], query_filter: Optional[models.Filter] = None) -> Optional[models.Filter]:
+    """ 共享集合中只看指定 KB 的点；每个 KB 一个集合时原样返回 """
+    if not is_shared_collection(collection_name):
+        return query_filter
+    conditions: List[Any] = [models.FieldCondition(key=KB_ID_KEY, match=models.MatchAny(any=[kb_id_value(k) for k in kb_ids]))]
+    if query_filter is not None:
+        conditions.append(query_filter)
+    return models.Filter(must=conditions)
+
+
+def delete_kb_vectors(qdrant: QdrantClient, collection_name: str, kb_id: int) -> None:
+    """ 删除一个 KB 的全部向量: 共享集合按 kb_id 删点，独占集合直接删除集合 """
+    if not qdrant.collection_exists(collection_name):
+        return
+    if is_shared_collection(collection_name):
+        qdrant.delete(
+            collection_name=collection_name,
+            points_selector=models.FilterSelector(filter=scope_filter(collection_name, [kb_id])),
+            wait=True
+        )
+    else:
+        qdrant.delete_collection(collection_name)
+    logger.info(f"Vectors of KB {kb_id} removed from '{collection_name}'.")
+
+
+@dataclass(frozen=True)
+class StorageProfile:
+    """ 稠密向量的存储方式 (hnsw_m / hnsw_ef_construct 的 Qdrant 默认值为 16 / 100) """
+    quantization: Optional[str] = None   # None / "scalar" (int8) / "binary" (1 bit)
+    on_disk: bool = False                # 原始 float32 向量放磁盘 (mmap)，量化向量常驻内存
+    on_disk_payload: bool = False
+    hnsw_m: int = 16
+    hnsw_ef_construct: int = 100
+    hnsw_on_disk: bool = False
+    oversampling: float = 1.0            # 量化检索时多取的候选倍数，再用原始向量重打分 (rescore)
+
+
+# 内存占用 / 召回代价 (相对 default，数量级参考 Qdrant 量化文档，实际取决于模型):
+#   scalar: 内存中只保留 int8 向量 (约 1/4)，重打分后召回损失通常 < 1%
+#   binary: 内存中只保留 1 bit 向量 (约 1/32)，适合 >= 1024 维的模型；过采样 + 重打分后召回损失约数个百分点
+#   disk:   不量化，向量、payload 和 HNSW 图都放磁盘，内存最省但检索延迟取决于磁盘
+STORAGE_PROFILES: Dict[str, StorageProfile] = {
+    "default": StorageProfile(),
+    "scalar": StorageProfile(quantization="scalar", on_disk=True, on_disk_payload=True, hnsw_ef_construct=128, oversampling=1.5),
+    "binary": StorageProfile(quantization="binary", on_disk=True, on_disk_payload=True, hnsw_ef_construct=128, oversampling=3.0),
+    "disk": StorageProfile(on_disk=True, on_disk_payload=True, hnsw_on_disk=True),
+}
+
+
+def validate_storage_profile(name: Optional[str]) -> Optional[str]:
+    """ None 表示使用部署默认值；未知名称抛出 ValueError """
+    if name is not None and name not in STORAGE_PROFILES:
+        raise ValueError(f"Unknown storage profile '{name}'. Available: {', '.join(STORAGE_PROFILES)}.")
+    return name
+
+
+def get_storage_profile(name: Optional[str] = None) -> StorageProfile:
+    name = name or settings.VECTOR_STORAGE_PROFILE
+    profile = STORAGE_PROFILES.get(name)
+    if profile is None:
+        logger.warning(f"Unknown storage profile '{name}', using 'default'.")
+        return STORAGE_PROFILES["default"]
+    return profile
+
+
+def _dense_config(dimension: int, profile: StorageProfile) -> models.VectorParams:
+    return models.VectorParams(size=dimension, distance=models.Distance.COSINE, on_disk=profile.on_disk)
+
+
+def _sparse_config() -> Dict[str, models.SparseVectorParams]:
+    return {SPARSE_VECTOR_NAME: models.SparseVectorParams(modifier=models.Modifier.IDF)}
+
+
+def _hnsw_config(profile: StorageProfile) -> models.HnswConfigDiff:
+    return models.HnswConfigDiff(m=profile.hnsw_m, ef_construct=profile.hnsw_ef_construct, on_disk=profile.hnsw_on_disk)
+
+
+def _quantization_config(profile: StorageProfile) -> Optional[models.QuantizationConfig]:
+    if profile.quantization == "scalar":
+        return models.ScalarQuantization(scalar=models.ScalarQuantizationConfig(
+            type=models.ScalarType.INT8, quantile=0.99, always_ram=True
+        ))
+    if profile.quantization == "binary":
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True))
+    return None
+
+
+def _collection_kwargs(dimension: int, profile_name: Optional[str], shared: bool = False) -> Dict[str, Any]:
+    profile = get_storage_profile(profile_name)
+    hnsw_config = _hnsw_config(profile)
+    if shared:
+        # 多租户: 按 kb_id 为每个 KB 单独建图 (payload_m)，单 KB 检索只走自己的小图；
+        # 同时保留全局图 (m > 0)，一次检索多个 KB (MatchAny) 时不会退化为全量扫描。
+        # 代价是多建一张全局图 (内存与构建时间约为集合的一份 HNSW 索引)
+        hnsw_config = models.HnswConfigDiff(
+            m=profile.hnsw_m, payload_m=profile.hnsw_m, ef_construct=profile.hnsw_ef_construct, on_disk=profile.hnsw_on_disk
+        )
+    return {
+        "vectors_config": _dense_config(dimension, profile),
+        "sparse_vectors_config": _sparse_config(),
+        "hnsw_config": hnsw_config,
+        "quantization_config": _quantization_config(profile),
+        "on_disk_payload": profile.on_disk_payload,
+    }
+
+
+def create_collection(qdrant: QdrantClient, collection_name: str, dimension: int, profile: Optional[str] = None) -> None:
+    qdrant.create_collection(collection_name=collection_name, **_collection_kwargs(dimension, profile))
+
+
+def recreate_collection(qdrant: QdrantClient, collection_name: str, dimension: int, profile: Optional[str] = None) -> None:
+    """ 删除 (如果存在) 并重新创建集合 """
+    qdrant.recreate_collection(collection_name=collection_name, **_collection_kwargs(dimension, profile))
+
+
+def _get_dimension(qdrant: QdrantClient, collection_name: str) -> Optional[int]:
+    vectors = qdrant.get_collection(collection_name).config.params.vectors
+    if isinstance(vectors, models.VectorParams):
+        return vectors.size
+    if isinstance(vectors, dict) and vectors:
+        return (vectors.get("") or next(iter(vectors.values()))).size
+    return None
+
+
+def ensure_shared_collection(qdrant: QdrantClient, collection_name: str, dimension: int) -> None:
+    """
+    创建 (如果不存在) 共享集合和 kb_id 索引。共享集合使用部署默认的存储配置。
+    已有集合维度不一致时报错 (不能为一个 KB 重建其他 KB 也在用的集合)。
+    """
+    if qdrant.collection_exists(collection_name):
+        existing = _get_dimension(qdrant, collection_name)
+        if existing is not None and existing != dimension:
+            raise ValueError(
+                f"Shared collection '{collection_name}' has dimension {existing}, but the model now produces {dimension}. "
+                f"Re-create the embedding model entry instead of changing its dimension."
+            )
+        hnsw = qdrant.get_collection(collection_name).config.hnsw_config
+        if not hnsw.m:
+            # 早期版本创建的共享集合没有全局图 (m=0)，补建以支持多 KB 检索
+            qdrant.update_collection(collection_name=collection_name, hnsw_config=_collection_kwargs(dimension, None, shared=True)["hnsw_config"])
+            logger.info(f"Shared collection '{collection_name}' now builds a global HNSW graph.")
+    else:
+        try:
+            qdrant.create_collection(collection_name=collection_name, **_collection_kwargs(dimension, None, shared=True))
+            logger.info(f"Shared collection '{collection_name}' created (dim {dimension}).")
+        except Exception as e:
+            # 另一个 KB 的解析同时创建了它
+            if not qdrant.collection_exists(collection_name):
+                raise
+            logger.debug(f"Shared collection '{collection_name}' was created concurrently: {e}")
+    # is_tenant: Qdrant 按 kb_id 组织存储，单个 KB 的检索只读取它自己的点
+    qdrant.create_payload_index(
+        collection_name,
+        field_name=KB_ID_KEY,
+        field_schema=models.KeywordIndexParams(type=models.KeywordIndexType.KEYWORD, is_tenant=True)
+    )
+
+
+def _profile_differs(config: models.CollectionConfig, profile: StorageProfile) -> bool:
+    vectors = config.params.vectors
+    dense = vectors if isinstance(vectors, models.VectorParams) else (vectors or {}).get("")
+    quantization = config.quantization_config
+    current_quantization = (
+        "scalar" if isinstance(quantization, models.ScalarQuantization)
+        else "binary" if isinstance(quantization, models.BinaryQuantization)
+        else None
+    )
+    return (
+        current_quantization != profile.quantization
+        or bool(dense is not None and dense.on_disk) != profile.on_disk
+        or bool(config.params.on_disk_payload) != profile.on_disk_payload
+        or config.hnsw_config.m != profile.hnsw_m
+        or config.hnsw_config.ef_construct != profile.hnsw_ef_construct
+        or bool(config.hnsw_config.on_disk) != profile.hnsw_on_disk
+    )
+
+
+def apply_storage_profile(qdrant: QdrantClient, collection_name: str, profile_name: Optional[str] = None) -> bool:
+    """
+    把已有集合原地迁移到指定存储配置 (update_collection，Qdrant 在后台重建量化向量/索引，期间可继续检索)。
+    配置一致或集合不存在时不做任何事；返回是否发起了迁移。
+    """
+    if is_shared_collection(collection_name) or not qdrant.collection_exists(collection_name):
+        return False  # 共享集合始终使用部署默认配置
+    profile = get_storage_profile(profile_name)
+    if not _profile_differs(qdrant.get_collection(collection_name).config, profile):
+        return False
+    qdrant.update_collection(
+        collection_name=collection_name,
+        vectors_config={"": models.VectorParamsDiff(on_disk=profile.on_disk)},
+        hnsw_config=_hnsw_config(profile),
+        quantization_config=_quantization_config(profile) or models.Disabled.DISABLED,
+        collection_params=models.CollectionParamsDiff(on_disk_payload=profile.on_disk_payload)
+    )
+    logger.info(f"Collection '{collection_name}' migrating to storage profile '{profile_name or settings.VECTOR_STORAGE_PROFILE}'.")
+    return True
+
+
+def search_params_for(profile_name: Optional[str] = None) -> Optional[models.SearchParams]:
+    """ 量化集合: 先用量化向量取 limit * oversampling 个候选，再用原始向量重打分 """
+    profile = get_storage_profile(profile_name)
+    if profile.quantization is None:
+        return None
+    return models.SearchParams(quantization=models.QuantizationSearchParams(rescore=True, oversampling=profile.oversampling))
+
+
+def has_sparse_vectors(qdrant: QdrantClient, collection_name: str) -> bool:
+    """ 旧版本创建的集合只有稠密向量，写入和检索时需要区分 """
+    sparse = qdrant.get_collection(collection_name).config.params.sparse_vectors or {}
+    return SPARSE_VECTOR_NAME in sparse
+
+
+async def supports_sparse(qdrant: AsyncQdrantClient, collection_name: str) -> bool:
+    """ 异步版 has_sparse_vectors，按集合缓存，避免每次检索都读取集合配置 """
+    cached = _sparse_support.get(collection_name)
+    if cached is not None and (cached[0] or time.monotonic() - cached[1] < SPARSE_SUPPORT_TTL_SECONDS):
+        return cached[0]
+    info = await qdrant.get_collection(collection_name)
+    supported = SPARSE_VECTOR_NAME in (info.config.params.sparse_vectors or {})
+    _sparse_support[collection_name] = (supported, time.monotonic())
+    return supported
+
+
+def make_point(point_id: str, dense_vector: List[float], text: str, payload: Dict[str, Any], with_sparse: bool = True) -> models.PointStruct:
+    if not with_sparse:
+        return models.PointStruct(id=point_id, vector=dense_vector, payload=payload)
+    indices, values = sparse_encoder.encode_document(text)
+    return models.PointStruct(
+        id=point_id,
+        vector={
+            "": dense_vector,
+            SPARSE_VECTOR_NAME: models.SparseVector(indices=indices, values=values)
+        },
+        payload=payload
+    )
+
+
+async def scroll_by_defines(
+    qdrant: AsyncQdrantClient,
+    collection_name: str,
+    names: List[str],
+    limit: int,
+    query_filter: Optional[models.Filter] = None
+) -> List[models.Record]:
+    """ 取定义了 names 中任一实体的代码块 (走 DEFINES_KEY 上的 keyword 索引) """
+    conditions: List[Any] = [models.FieldCondition(key=DEFINES_KEY, match=models.MatchAny(any=names))]
+    if query_filter is not None:
+        conditions.append(query_filter)
+    records, _ = await qdrant.scroll(
+        collection_name=collection_name,
+        scroll_filter=models.Filter(must=conditions),
+        limit=limit,
+        with_payload=True,
+        with_vectors=False
+    )
+    return records
+
+
+async def search(
+    qdrant: AsyncQdrantClient,
+    collection_name: str,
+    query_vector: List[float],
+    query_text: str,
+    limit: int,
+    query_filter: Optional[models.Filter] = None,
+    search_params: Optional[models.SearchParams] = None
+) -> List[models.ScoredPoint]:
+    """
+    稠密 + 稀疏两路检索，在 Qdrant 内用 RRF 融合 (一次请求)。
+    查询没有可用的词法 token，或集合没有稀疏向量 (旧集合) 时退回纯稠密检索，
+    余弦分数按名次换算成 RRF 分数 (rank_scores)，保证不同集合的结果可以直接按分数合并。
+    """
+    indices, values = sparse_encoder.encode_query(query_text)
+    if indices and await supports_sparse(qdrant, collection_name):
+        prefetch_limit = limit * HYBRID_PREFETCH_FACTOR
+        try:
+            response = await qdrant.query_points(
+                collection_name=collection_name,
+                prefetch=[
+                    models.Prefetch(query=query_vector, limit=prefetch_limit, filter=query_filter, params=search_params),
+                    models.Prefetch(
+                        query=models.SparseVector(indices=indices, values=values),
+                        using=SPARSE_VECTOR_NAME,
+                        limit=prefetch_limit,
+                        filter=query_filter
+                    ),
+                ],
+                query=models.FusionQuery(fusion=models.Fusion.RRF),
+                limit=limit,
+                with_payload=True
+            )
+            return response.points
+        except Exception as e:
+            logger.warning(f"Hybrid search failed for '{collection_name}', falling back to dense: {e}")
+
+    points = await qdrant.search(
+        collection_name=collection_name,
+        query_vector=query_vector,
+        query_filter=query_filter,
+        search_params=search_params,
+        limit=limit,
+        with_payload=True
+    )
+    return rank_scores(points)
+
+
+def rank_scores(points: List[models.ScoredPoint]) -> List[models.ScoredPoint]:
+    """
+    把按相似度排好序的结果换算成单路 RRF 分数 (与混合检索中只命中一路的点同分)。
+    只依赖名次，与集合里有多少个 KB、其他集合返回了什么无关。
+    """
+    return [
+        point.model_copy(update={"score": 1.0 / (RRF_RANK_CONSTANT + position)})
+        for position, point in enumerate(points)
+    ]
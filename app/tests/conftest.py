@@ -0,0 +1,19 @@
+# app/tests/conftest.py
+
+import os
+
+# app.core.config 要求数据库连接变量 (通常来自 .env)；单元测试不会真正连接数据库
+for key, value in {
+    "POSTGRES_SERVER": "localhost",
+    "POSTGRES_PORT": "5432",
+    "POSTGRES_USER": "test",
+    "POSTGRES_PASSWORD": "test",
+    "POSTGRES_DB": "test",
+}.items():
+    os.environ.setdefault(key, value)
+
+# 模型模块与 app.db.session 互相导入，需要先导入 session (与 app.main 的导入顺序一致)
+try:
+    import app.db.session  # noqa: F401
+except ImportError:
+    pass  # 未安装数据库依赖时只运行纯函数测试
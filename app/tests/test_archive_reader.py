@@ -0,0 +1,99 @@
+# app/tests/test_archive_reader.py
+
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+pytest.importorskip("rarfile")
+
+from app.services import archive_reader
+
+FILES = {
+    "src/main.py": b"print('hi')\n",
+    "src/util.py": b"def f():\n    return 1\n",
+    "vendor/big.js": b"x" * 5000,
+}
+
+
+def _zip(tmp_path):
+    path = tmp_path / "repo.zip"
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("src/", "")  # 目录条目
+        for name, data in FILES.items():
+            zf.writestr(name, data)
+    return path
+
+
+def _tar(tmp_path, suffix="tar.gz", mode="w:gz"):
+    path = tmp_path / f"repo.{suffix}"
+    with tarfile.open(path, mode) as tf:
+        for name, data in FILES.items():
+            info = tarfile.TarInfo(f"./{name}")
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+    return path
+
+
+def _accept_all(path, size):
+    return True
+
+
+@pytest.mark.parametrize("make", [_zip, _tar, lambda p: _tar(p, "tar", "w"), lambda p: _tar(p, "tar.xz", "w:xz")])
+def test_members_are_read_in_order_with_normalized_paths(tmp_path, make):
+    archive = make(tmp_path)
+    assert archive_reader.is_archive(archive)
+    assert list(archive_reader.iter_members(archive, _accept_all)) == list(FILES.items())
+
+
+def test_rejected_members_are_not_decompressed(tmp_path, monkeypatch):
+    read = []
+    original = archive_reader._read
+
+    def recording_read(handle, member):
+        read.append(getattr(member, "filename", getattr(member, "name", None)))
+        return original(handle, member)
+
+    monkeypatch.setattr(archive_reader, "_read", recording_read)
+    small_only = lambda path, size: size < 1000
+    for archive in (_zip(tmp_path), _tar(tmp_path)):
+        read.clear()
+        members = dict(archive_reader.iter_members(archive, small_only))
+        assert set(members) == {"src/main.py", "src/util.py"}
+        assert not any("vendor" in name for name in read)
+
+
+def test_accept_receives_path_and_uncompressed_size(tmp_path):
+    seen = {}
+
+    def accept(path, size):
+        seen[path] = size
+        return False
+
+    assert archive_reader.list_members(_zip(tmp_path), accept) == []
+    assert seen == {name: len(data) for name, data in FILES.items()}
+
+
+def test_list_members_applies_filter(tmp_path):
+    accept = lambda path, size: path.endswith(".py")
+    assert archive_reader.list_members(_tar(tmp_path), accept) == ["src/main.py", "src/util.py"]
+
+
+def test_corrupted_archives_raise_value_error(tmp_path):
+    bad_zip = tmp_path / "bad.zip"
+    bad_zip.write_bytes(b"not a zip")
+    with pytest.raises(ValueError, match="zip"):
+        list(archive_reader.iter_members(bad_zip, _accept_all))
+
+    bad_tar = tmp_path / "bad.tar.gz"
+    bad_tar.write_bytes(b"not a tar")
+    with pytest.raises(ValueError, match="tar"):
+        list(archive_reader.iter_members(bad_tar, _accept_all))
+
+
+def test_is_archive(tmp_path):
+    plain = tmp_path / "notes.txt"
+    plain.write_text("x")
+    assert not archive_reader.is_archive(plain)
+    assert not archive_reader.is_archive(tmp_path / "missing.zip")
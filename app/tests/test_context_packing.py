@@ -0,0 +1,87 @@
+# app/tests/test_context_packing.py
+
+import pytest
+
+pytest.importorskip("pydantic")
+
+from app.schemas.rag import RetrievedContext
+from app.services.context_packing import MIN_TRIM_TOKENS, _merge_overlapping, count_tokens, pack_contexts
+
+
+def _ctx(text: str, score: float, file_path: str = "a.py", kb_id: int = 1) -> RetrievedContext:
+    return RetrievedContext(source_kb_id=kb_id, file_path=file_path, text=text, score=score)
+
+
+def _lines(prefix: str, n: int) -> str:
+    return "".join(f"{prefix}_value_{i} = compute_{prefix}({i})\n" for i in range(n))
+
+
+def test_merge_overlapping():
+    shared = _lines("shared", 3)
+    first = _lines("head", 2) + shared
+    second = shared + _lines("tail", 2)
+    assert _merge_overlapping(first, second) == _lines("head", 2) + shared + _lines("tail", 2)
+    assert _merge_overlapping(second, first) == _lines("head", 2) + shared + _lines("tail", 2)
+    # 包含关系
+    assert _merge_overlapping(first, shared) == first
+    # 重叠太短不合并
+    assert _merge_overlapping("abc xyz", "xyz def") is None
+
+
+def test_everything_fits():
+    contexts = [_ctx(_lines("a", 3), 0.9), _ctx(_lines("b", 3), 0.5, file_path="b.py")]
+    packed, stats = pack_contexts(contexts, token_budget=10_000)
+    assert [c.text for c in packed] == [c.text for c in contexts]
+    assert stats["dropped_tokens"] == 0
+    assert stats["context_tokens"] == sum(count_tokens(c.text) for c in contexts)
+
+
+def test_higher_scores_are_packed_first():
+    low = _ctx(_lines("low", 40), 0.1, file_path="low.py")
+    high = _ctx(_lines("high", 40), 0.9, file_path="high.py")
+    packed, stats = pack_contexts([low, high], token_budget=count_tokens(high.text))
+    assert [c.file_path for c in packed] == ["high.py"]
+    assert stats["dropped_chunks"] == 1
+
+
+def test_overlapping_chunks_of_same_file_are_merged():
+    shared = _lines("shared", 3)
+    first = _ctx(_lines("head", 2) + shared, 0.9)
+    second = _ctx(shared + _lines("tail", 2), 0.8)
+    packed, stats = pack_contexts([first, second], token_budget=10_000)
+    assert len(packed) == 1
+    assert packed[0].text == _lines("head", 2) + shared + _lines("tail", 2)
+    assert packed[0].score == 0.9
+    assert stats["merged_chunks"] == 1
+    # 只为新增部分付费
+    assert stats["context_tokens"] == count_tokens(packed[0].text)
+
+
+def test_same_text_in_different_files_is_not_merged():
+    text = _lines("same", 3)
+    packed, stats = pack_contexts([_ctx(text, 0.9, "a.py"), _ctx(text, 0.8, "b.py")], token_budget=10_000)
+    assert len(packed) == 2
+    assert stats["merged_chunks"] == 0
+
+
+def test_chunk_is_trimmed_when_enough_budget_remains():
+    first = _ctx(_lines("first", 5), 0.9, file_path="first.py")
+    second = _ctx(_lines("second", 200), 0.5, file_path="second.py")
+    budget = count_tokens(first.text) + MIN_TRIM_TOKENS + 10
+    packed, stats = pack_contexts([first, second], token_budget=budget)
+    assert len(packed) == 2
+    assert second.text.startswith(packed[1].text)
+    assert stats["trimmed_chunks"] == 1
+    assert stats["context_tokens"] <= budget
+    assert stats["dropped_tokens"] > 0
+
+
+def test_chunk_is_dropped_when_remaining_budget_is_too_small():
+    first = _ctx(_lines("first", 5), 0.9, file_path="first.py")
+    second = _ctx(_lines("second", 200), 0.5, file_path="second.py")
+    budget = count_tokens(first.text) + MIN_TRIM_TOKENS - 1
+    packed, stats = pack_contexts([first, second], token_budget=budget)
+    assert [c.file_path for c in packed] == ["first.py"]
+    assert stats["dropped_chunks"] == 1
+    assert stats["trimmed_chunks"] == 0
+    assert stats["dropped_tokens"] == count_tokens(second.text)
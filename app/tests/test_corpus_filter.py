@@ -0,0 +1,176 @@
+# app/tests/test_corpus_filter.py
+
+import re
+
+import pytest
+
+pytest.importorskip("pydantic_settings")
+
+from app.services import corpus_filter
+from app.services.corpus_filter import CorpusFilter, IgnoreRules, _translate
+
+
+def _rules(*lines, base=""):
+    rules = IgnoreRules()
+    rules.add(lines, base=base)
+    return rules
+
+
+# --- _translate ---
+
+def test_translate_star_does_not_cross_directories():
+    regex = re.compile(f"^{_translate('*.py')}$")
+    assert regex.match("main.py")
+    assert not regex.match("app/main.py")
+
+
+def test_translate_double_star():
+    leading = re.compile(f"^{_translate('**/build')}$")
+    assert leading.match("build")
+    assert leading.match("a/b/build")
+
+    trailing = re.compile(f"^{_translate('logs/**')}$")
+    assert trailing.match("logs/a")
+    assert trailing.match("logs/a/b.txt")
+
+    middle = re.compile(f"^{_translate('a/**/z')}$")
+    assert middle.match("a/z")
+    assert middle.match("a/b/c/z")
+
+
+def test_translate_character_classes():
+    regex = re.compile(f"^{_translate('file[0-9].txt')}$")
+    assert regex.match("file3.txt")
+    assert not regex.match("fileA.txt")
+
+    negated = re.compile(f"^{_translate('[!a]b')}$")
+    assert negated.match("xb")
+    assert not negated.match("ab")
+
+
+# --- IgnoreRules ---
+
+def test_unanchored_pattern_matches_at_any_depth():
+    rules = _rules("*.log")
+    assert rules.is_ignored("debug.log")
+    assert rules.is_ignored("a/b/debug.log")
+    assert not rules.is_ignored("debug.txt")
+
+
+def test_leading_slash_anchors_to_root():
+    rules = _rules("/build")
+    assert rules.is_ignored("build", is_dir=True)
+    assert not rules.is_ignored("src/build", is_dir=True)
+
+
+def test_pattern_with_inner_slash_is_anchored():
+    rules = _rules("docs/*.md")
+    assert rules.is_ignored("docs/a.md")
+    assert not rules.is_ignored("x/docs/a.md")
+    assert not rules.is_ignored("docs/sub/a.md")
+
+
+def test_negation_reincludes_file():
+    rules = _rules("*.log", "!keep.log")
+    assert rules.is_ignored("trace.log")
+    assert not rules.is_ignored("keep.log")
+    assert not rules.is_ignored("sub/keep.log")
+
+
+def test_later_rule_wins():
+    rules = _rules("!keep.log", "*.log")
+    assert rules.is_ignored("keep.log")
+
+
+def test_negation_cannot_reinclude_file_in_ignored_directory():
+    rules = _rules("out/", "!out/keep.txt")
+    assert rules.is_ignored("out/keep.txt")
+
+
+def test_trailing_slash_matches_directories_only():
+    rules = _rules("out/")
+    assert rules.is_ignored("out", is_dir=True)
+    assert rules.is_ignored("out/a.txt")
+    assert not rules.is_ignored("out")
+
+
+def test_double_star_rules():
+    rules = _rules("**/generated/**", "src/**/*.tmp")
+    assert rules.is_ignored("generated/a.py")
+    assert rules.is_ignored("pkg/generated/a.py")
+    assert rules.is_ignored("src/a.tmp")
+    assert rules.is_ignored("src/x/y/a.tmp")
+    assert not rules.is_ignored("lib/a.tmp")
+
+
+def test_rules_are_scoped_to_their_gitignore_directory():
+    rules = _rules("*.json", base="frontend")
+    assert rules.is_ignored("frontend/data.json")
+    assert rules.is_ignored("frontend/src/data.json")
+    assert not rules.is_ignored("backend/data.json")
+
+
+def test_comments_blank_lines_and_escapes():
+    rules = _rules("# comment", "", "\\#notes.txt")
+    assert rules.is_ignored("#notes.txt")
+    assert not rules.is_ignored("comment")
+
+
+# --- CorpusFilter ---
+
+def _filter():
+    return CorpusFilter(max_bytes=1024 * 1024, patterns=[], enabled=True)
+
+
+def test_path_reasons():
+    corpus = _filter()
+    assert corpus.path_reason(".git/config", 10) == corpus_filter.HIDDEN
+    assert corpus.path_reason("web/node_modules/react/index.js", 10) == corpus_filter.VENDOR
+    assert corpus.path_reason("web/package-lock.json", 10) == corpus_filter.LOCKFILE
+    assert corpus.path_reason("static/app.min.js", 10) == corpus_filter.MINIFIED
+    assert corpus.path_reason("api/service_pb2.py", 10) == corpus_filter.GENERATED
+    assert corpus.path_reason("data/dump.sql", 2 * 1024 * 1024) == corpus_filter.TOO_LARGE
+    assert corpus.path_reason("app/main.py", 10) is None
+
+
+def test_content_reason_binary_and_generated_marker():
+    corpus = _filter()
+    assert corpus.content_reason("a.dat", b"abc\0def") == corpus_filter.BINARY
+    assert corpus.content_reason("a.go", b"// Code generated by protoc-gen-go. DO NOT EDIT.\npackage a\n") == corpus_filter.GENERATED
+    # 生成标记只在文件开头查找
+    late_marker = b"x = 1\n" * 300 + b"# do not edit\n"
+    assert corpus.content_reason("a.py", late_marker) is None
+
+
+def test_minified_detection_applies_to_js_css_json_only():
+    corpus = _filter()
+    one_line = b"var a=1;" * 500
+    assert corpus.content_reason("bundle.js", one_line) == corpus_filter.MINIFIED
+    assert corpus.content_reason("style.css", one_line) == corpus_filter.MINIFIED
+    assert corpus.content_reason("data.json", one_line) == corpus_filter.MINIFIED
+    # 不换行的长段落在 Markdown / 文本中很常见
+    assert corpus.content_reason("README.md", b"word " * 1000) is None
+    assert corpus.content_reason("notes.txt", b"word " * 1000) is None
+
+
+def test_minified_detection_needs_minimum_head_size():
+    corpus = _filter()
+    assert corpus.content_reason("config.json", b'{"a": 1, "b": 2}' * 30) is None
+
+
+def test_minified_detection_counts_characters_not_bytes():
+    corpus = _filter()
+    # 每行 200 个汉字 = 600 字节，但只有 200 个字符
+    line = ("说明" * 100 + "\n").encode("utf-8")
+    assert corpus.content_reason("messages.json", line * 10) is None
+
+
+def test_skip_report_groups_by_reason():
+    corpus = _filter()
+    assert not corpus.accept_path("web/node_modules/a.js", 100)
+    assert not corpus.accept_path("yarn.lock", 50)
+    assert corpus.accept_path("app/main.py", 10)
+    report = corpus.report.as_dict()
+    assert report["files"] == 2
+    assert report["bytes"] == 150
+    assert report["reasons"][corpus_filter.VENDOR]["examples"] == ["web/node_modules/a.js"]
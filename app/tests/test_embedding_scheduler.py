@@ -0,0 +1,113 @@
+# app/tests/test_embedding_scheduler.py
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("pydantic_settings")
+
+from app.services.embedding_scheduler import EmbeddingScheduler
+
+
+class FakeEndpoint:
+    """ 按批次首元素决定延迟的假嵌入端点，记录并发数和被取消的批次 """
+
+    def __init__(self, delays=None):
+        self.delays = delays or {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.started = []
+        self.cancelled = []
+
+    async def embed(self, batch):
+        self.started.append(batch[0])
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delays.get(batch[0], 0.001))
+            if batch[0] == "boom":
+                raise RuntimeError("endpoint failed")
+            return [[float(len(text))] for text in batch]
+        except asyncio.CancelledError:
+            self.cancelled.append(batch[0])
+            raise
+        finally:
+            self.in_flight -= 1
+
+
+async def _collect(scheduler, batches):
+    return [(batch, vectors) async for batch, vectors in scheduler.iter_embeddings(batches)]
+
+
+def test_results_keep_submission_order():
+    # 先提交的批次最慢完成
+    endpoint = FakeEndpoint({"a": 0.05, "b": 0.02, "c": 0.001})
+    batches = [["a", "aa"], ["b"], ["c", "ccc"]]
+    results = asyncio.run(_collect(EmbeddingScheduler(endpoint.embed, 3), batches))
+    assert [batch for batch, _ in results] == batches
+    assert results[0][1] == [[1.0], [2.0]]
+
+
+def test_in_flight_batches_are_bounded():
+    endpoint = FakeEndpoint()
+    batches = [[str(i)] for i in range(10)]
+    results = asyncio.run(_collect(EmbeddingScheduler(endpoint.embed, 3), batches))
+    assert len(results) == 10
+    assert endpoint.max_in_flight == 3
+
+
+def test_batches_are_pulled_lazily():
+    pulled = []
+
+    def source():
+        for i in range(100):
+            pulled.append(i)
+            yield [str(i)]
+
+    async def first_two():
+        scheduler = EmbeddingScheduler(FakeEndpoint().embed, 2)
+        stream = scheduler.iter_embeddings(source())
+        results = [await stream.__anext__(), await stream.__anext__()]
+        await stream.aclose()
+        return results
+
+    assert len(asyncio.run(first_two())) == 2
+    assert len(pulled) <= 4
+
+
+def test_empty_batches_are_skipped():
+    endpoint = FakeEndpoint()
+    results = asyncio.run(_collect(EmbeddingScheduler(endpoint.embed, 2), [[], ["a"], []]))
+    assert [batch for batch, _ in results] == [["a"]]
+
+
+def test_count_mismatch_raises():
+    async def short(batch):
+        return [[0.0]]
+
+    with pytest.raises(ValueError, match="count mismatch"):
+        asyncio.run(_collect(EmbeddingScheduler(short, 2), [["a", "b"]]))
+
+
+def test_early_exit_cancels_pending_requests():
+    endpoint = FakeEndpoint({"slow1": 1.0, "slow2": 1.0})
+
+    async def consume_first():
+        stream = EmbeddingScheduler(endpoint.embed, 3).iter_embeddings([["fast"], ["slow1"], ["slow2"]])
+        async for batch, _ in stream:
+            break
+        await stream.aclose()
+
+    asyncio.run(asyncio.wait_for(consume_first(), timeout=0.5))
+    assert sorted(endpoint.cancelled) == ["slow1", "slow2"]
+    assert endpoint.in_flight == 0
+
+
+def test_failed_batch_cancels_the_rest():
+    endpoint = FakeEndpoint({"boom": 0.001, "slow": 1.0})
+    with pytest.raises(RuntimeError, match="endpoint failed"):
+        asyncio.run(asyncio.wait_for(
+            _collect(EmbeddingScheduler(endpoint.embed, 3), [["boom"], ["slow"], ["slow"]]), timeout=0.5
+        ))
+    assert endpoint.cancelled == ["slow", "slow"]
+    assert endpoint.in_flight == 0
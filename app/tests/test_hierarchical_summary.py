@@ -0,0 +1,72 @@
+# app/tests/test_hierarchical_summary.py
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("openai")
+
+from app.services.context_packing import count_tokens
+from app.services.hierarchical_summary import MAX_REDUCE_DEPTH, _Summarizer
+
+
+def _summarizer(token_budget: int, summary_words: int):
+    """ 不连接 LLM 的 _Summarizer: 每次调用返回 summary_words 个词，记录每次调用的 prompt """
+    summarizer = _Summarizer.__new__(_Summarizer)
+    summarizer.token_budget = token_budget
+    summarizer.prompts = []
+
+    async def complete(prompt, description):
+        summarizer.prompts.append(prompt)
+        return " ".join(f"word{i}" for i in range(summary_words))
+
+    summarizer.complete = complete
+    return summarizer
+
+
+def _children(count: int, words: int):
+    return [(f"file_{i}.py", " ".join(f"token{i}_{j}" for j in range(words))) for i in range(count)]
+
+
+def test_children_within_budget_are_reduced_in_one_call():
+    summarizer = _summarizer(token_budget=2000, summary_words=10)
+    asyncio.run(summarizer.reduce("pkg", _children(3, 10)))
+    assert len(summarizer.prompts) == 1
+
+
+def test_oversized_directory_is_reduced_in_groups():
+    summarizer = _summarizer(token_budget=400, summary_words=10)
+    asyncio.run(summarizer.reduce("pkg", _children(30, 20)))
+    # 若干分组调用 + 一次最终汇总
+    assert 2 < len(summarizer.prompts) < 30
+    assert "(part 1)" in summarizer.prompts[-1]
+
+
+def test_reduce_terminates_when_partial_summaries_do_not_shrink():
+    # LLM 无视长度要求，每个部分摘要都和预算一样长: 每一轮都没有进展
+    summarizer = _summarizer(token_budget=300, summary_words=600)
+    asyncio.run(asyncio.wait_for(summarizer.reduce("pkg", _children(40, 100)), timeout=10))
+    assert len(summarizer.prompts) < 40 * MAX_REDUCE_DEPTH
+
+
+def test_two_children_that_cannot_be_grouped_fall_back_to_truncation():
+    summarizer = _summarizer(token_budget=100, summary_words=10)
+    asyncio.run(summarizer.reduce("pkg", _children(2, 200)))
+    assert len(summarizer.prompts) == 1
+    children_text = summarizer.prompts[0].split("---")[-1]
+    assert count_tokens(children_text) <= 100 + 20  # 每个子节点截断到预算的平均份额 (加标题)
+
+
+def test_recursion_depth_is_bounded(monkeypatch):
+    depths = []
+    original = _Summarizer.reduce
+
+    async def recording_reduce(self, path, children, depth=0):
+        depths.append(depth)
+        return await original(self, path, children, depth)
+
+    monkeypatch.setattr(_Summarizer, "reduce", recording_reduce)
+    summarizer = _summarizer(token_budget=300, summary_words=250)
+    asyncio.run(asyncio.wait_for(summarizer.reduce("pkg", _children(200, 60)), timeout=10))
+    assert max(depths) <= MAX_REDUCE_DEPTH
@@ -0,0 +1,128 @@
+# app/tests/test_job_queue.py
+
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("llama_index.core")
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.crud import crud_ingestion_job
+from app.db.session import Base
+from app.models.ingestion_job import IngestionJob
+from app.models.knowledgebase import KnowledgeBase
+from app.services import job_queue
+from app.services.ingestion_pipeline import _update_parsing_status
+
+
+@pytest.fixture
+def db(monkeypatch):
+    # 单元测试用内存 SQLite (FOR UPDATE SKIP LOCKED 在 SQLite 上被忽略，不影响单进程逻辑)
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr(job_queue, "SessionLocal", session_factory)
+    session = session_factory()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _running_job(db, owner="worker-a", attempts=1, max_attempts=3, expired=False, kb_status="processing"):
+    kb = KnowledgeBase(name="kb", status=kb_status, parsing_state={"stage": "embedding", "progress": 50})
+    db.add(kb)
+    db.commit()
+    job = IngestionJob(
+        kb_id=kb.id, payload={}, status="running", attempts=attempts, max_attempts=max_attempts,
+        run_after=_now(), lease_owner=owner,
+        lease_expires_at=_now() + timedelta(seconds=-60 if expired else 600)
+    )
+    db.add(job)
+    db.commit()
+    return kb.id, job.id
+
+
+def _reload(db, kb_id, job_id):
+    db.expire_all()
+    return db.get(KnowledgeBase, kb_id), db.get(IngestionJob, job_id)
+
+
+def test_expired_lease_is_rescheduled_with_backoff(db):
+    kb_id, job_id = _running_job(db, expired=True)
+    assert job_queue.reclaim_expired_jobs(db) == 1
+    kb, job = _reload(db, kb_id, job_id)
+    assert job.status == "queued"
+    assert job.lease_owner is None
+    assert job.run_after.replace(tzinfo=timezone.utc) > _now()
+    assert kb.status == "processing"
+    assert kb.parsing_state["stage"] == "pending"
+    # 退避期间不会被再次领取
+    assert crud_ingestion_job.lease_next_job(db, "worker-b", 600) is None
+
+
+def test_expired_lease_fails_after_max_attempts(db):
+    kb_id, job_id = _running_job(db, attempts=3, max_attempts=3, expired=True)
+    job_queue.reclaim_expired_jobs(db)
+    kb, job = _reload(db, kb_id, job_id)
+    assert job.status == "failed"
+    assert kb.status == "error"
+
+
+def test_live_lease_is_not_reclaimed(db):
+    kb_id, job_id = _running_job(db)
+    assert job_queue.reclaim_expired_jobs(db) == 0
+    assert _reload(db, kb_id, job_id)[1].status == "running"
+
+
+def test_expired_lease_still_counts_as_active(db):
+    kb_id, job_id = _running_job(db, expired=True)
+    assert crud_ingestion_job.get_active_job_for_kb(db, kb_id).id == job_id
+
+
+def test_owner_finalizes_successful_job(db):
+    kb_id, job_id = _running_job(db, kb_status="ready")
+    job_queue.finalize_job(job_id, "worker-a")
+    assert _reload(db, kb_id, job_id)[1].status == "succeeded"
+
+
+def test_stale_worker_cannot_settle_job_leased_by_another_worker(db):
+    kb_id, job_id = _running_job(db, expired=True)
+    job_queue.reclaim_expired_jobs(db)
+    db.query(IngestionJob).filter(IngestionJob.id == job_id).update({"run_after": _now() - timedelta(seconds=1)})
+    db.commit()
+    assert crud_ingestion_job.lease_next_job(db, "worker-b", 600).id == job_id
+
+    # worker-a 的管道结束 (失败) 后才发现租约已丢失
+    job_queue.finalize_job(job_id, "worker-a", error="boom")
+    kb, job = _reload(db, kb_id, job_id)
+    assert job.status == "running"
+    assert job.lease_owner == "worker-b"
+    assert job.attempts == 2
+    assert kb.status == "processing"
+
+
+def test_settle_is_conditional_on_lease_owner(db):
+    kb_id, job_id = _running_job(db)
+    assert not crud_ingestion_job.finish_job(db, job_id, "worker-b", "failed", "boom")
+    assert not crud_ingestion_job.reschedule_job(db, job_id, "worker-b", 1.0, "boom")
+    assert crud_ingestion_job.finish_job(db, job_id, "worker-a", "failed", "boom")
+    assert _reload(db, kb_id, job_id)[1].status == "failed"
+
+
+def test_lost_lease_stops_pipeline_status_updates(db):
+    kb_id, _ = _running_job(db)
+    lease_lost = threading.Event()
+    assert _update_parsing_status(db, kb_id, "embedding", 60, "batch 2", cancel_event=lease_lost)
+    lease_lost.set()
+    assert not _update_parsing_status(db, kb_id, "embedding", 70, "batch 3", cancel_event=lease_lost)
+    kb, _ = _reload(db, kb_id, 0)
+    assert kb.parsing_state["progress"] == 60
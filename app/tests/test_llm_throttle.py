@@ -0,0 +1,77 @@
+# app/tests/test_llm_throttle.py
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("openai")
+
+import httpx
+import openai
+
+from app.core import llm_throttle
+from app.core.config import settings
+from app.core.llm_clients import close_openai_clients, get_openai_client
+from app.core.llm_throttle import ModelThrottle, call_with_retry
+
+
+def _rate_limited() -> openai.RateLimitError:
+    request = httpx.Request("POST", "http://llm.local/v1/chat/completions")
+    return openai.RateLimitError("slow down", response=httpx.Response(429, request=request), body=None)
+
+
+def test_rate_limited_call_is_retried_without_holding_the_slot(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_RETRY_MAX_ATTEMPTS", 3)
+    sleeps = []
+    throttle = ModelThrottle(concurrency=1, requests_per_minute=0)
+
+    async def fake_sleep(delay):
+        # 退避等待期间并发名额已释放
+        assert not throttle._semaphore.locked()
+        sleeps.append(delay)
+
+    monkeypatch.setattr(llm_throttle.asyncio, "sleep", fake_sleep)
+    attempts = []
+
+    async def fn():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise _rate_limited()
+        return "ok"
+
+    assert asyncio.run(call_with_retry(throttle, fn)) == "ok"
+    assert len(attempts) == 3
+    assert len(sleeps) == 2
+
+
+def test_retries_stop_at_max_attempts(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_RETRY_MAX_ATTEMPTS", 2)
+
+    async def no_sleep(delay):
+        pass
+
+    monkeypatch.setattr(llm_throttle.asyncio, "sleep", no_sleep)
+    attempts = []
+
+    async def fn():
+        attempts.append(1)
+        raise _rate_limited()
+
+    with pytest.raises(openai.RateLimitError):
+        asyncio.run(call_with_retry(ModelThrottle(concurrency=1, requests_per_minute=0), fn))
+    assert len(attempts) == 2
+
+
+def test_no_retry_client_shares_the_pooled_connection():
+    async def run():
+        pooled = get_openai_client("http://llm.local/v1", "key", "generative")
+        no_retry = pooled.with_options(max_retries=0)
+        try:
+            return pooled.max_retries, no_retry.max_retries, no_retry._client is pooled._client
+        finally:
+            await close_openai_clients()
+
+    pooled_retries, no_retry_retries, shared = asyncio.run(run())
+    assert pooled_retries > 0
+    assert no_retry_retries == 0
+    assert shared
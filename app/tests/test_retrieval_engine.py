@@ -0,0 +1,77 @@
+# app/tests/test_retrieval_engine.py
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("qdrant_client")
+pytest.importorskip("llama_index.core")
+
+from qdrant_client import models
+
+from app.services import retrieval_engine, vector_store
+from app.services.retrieval_engine import RetrievalEngine, RetrievalState, merge_stage, search_stage
+
+
+def _point(point_id: int, score: float, kb_id: int) -> models.ScoredPoint:
+    return models.ScoredPoint(
+        id=point_id, version=0, score=score,
+        payload={"text": f"chunk {point_id}", "kb_id": kb_id, "metadata": {"file_path": f"{kb_id}.py"}}
+    )
+
+
+def _run(results_by_collection, kb_ids, monkeypatch):
+    async def fake_search(qdrant, collection, *args, **kwargs):
+        return results_by_collection[collection]
+
+    monkeypatch.setattr(retrieval_engine.crud_knowledgebase, "get_kb", lambda db, kb_id: SimpleNamespace(
+        id=kb_id, vector_collection=None, storage_profile=None
+    ))
+    monkeypatch.setattr(vector_store, "search", fake_search)
+    engine = RetrievalEngine(db=None, qdrant=None)
+    state = RetrievalState(query="load config", kb_ids=kb_ids, top_k=10, fetch_k=10, query_vector=[0.1])
+
+    async def run():
+        await search_stage(engine, state)
+        await merge_stage(engine, state)
+    asyncio.run(run())
+    return state.contexts
+
+
+def test_weak_kb_does_not_tie_strong_kb(monkeypatch):
+    # KB 1 的首条在稠密和稀疏两路都排第一；KB 2 只有一条，且只在稠密一路排第 6
+    strong = [_point(1, 1.0, 1), _point(2, 0.5, 1), _point(3, 1 / 3, 1)]
+    weak = [_point(4, 1 / 7, 2)]
+    contexts = _run({"kb_1": strong, "kb_2": weak}, [1, 2], monkeypatch)
+    assert [ctx.source_kb_id for ctx in contexts] == [1, 1, 1, 2]
+    assert contexts[0].score == 1.0
+    assert contexts[-1].score == pytest.approx(1 / 7)
+
+
+def test_scores_do_not_depend_on_collection_grouping(monkeypatch):
+    first = [_point(1, 1.0, 1), _point(2, 0.25, 1)]
+    second = [_point(3, 0.5, 2)]
+    per_kb = _run({"kb_1": first, "kb_2": second}, [1, 2], monkeypatch)
+    # 共享集合中两个 KB 一次检索，Qdrant 返回同样的 RRF 分数
+    shared = _run({"kb_1": sorted(first + second, key=lambda p: -p.score), "kb_2": []}, [1], monkeypatch)
+    assert [(c.text, c.score) for c in per_kb] == [(c.text, c.score) for c in shared]
+
+
+def test_rank_scores_use_rrf_scale():
+    points = vector_store.rank_scores([_point(1, 0.92, 1), _point(2, 0.91, 1), _point(3, 0.3, 1)])
+    assert [p.score for p in points] == [1 / 2, 1 / 3, 1 / 4]
+    assert vector_store.rank_scores([]) == []
+
+
+def test_dense_only_collection_results_are_rank_scored(monkeypatch):
+    class FakeQdrant:
+        async def get_collection(self, name):
+            return SimpleNamespace(config=SimpleNamespace(params=SimpleNamespace(sparse_vectors=None)))
+
+        async def search(self, **kwargs):
+            return [_point(1, 0.83, 1), _point(2, 0.81, 1)]
+
+    monkeypatch.setattr(vector_store, "_sparse_support", {})
+    points = asyncio.run(vector_store.search(FakeQdrant(), "kb_1", [0.1], "load config", 5))
+    assert [p.score for p in points] == [1 / 2, 1 / 3]
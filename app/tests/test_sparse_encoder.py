@@ -0,0 +1,49 @@
+# app/tests/test_sparse_encoder.py
+
+from app.services.sparse_encoder import encode_document, encode_query, tokenize
+
+
+def test_snake_case_keeps_full_identifier_and_parts():
+    tokens = tokenize("_update_parsing_status")
+    assert tokens[0] == "_update_parsing_status"
+    assert {"update", "parsing", "status"} <= set(tokens)
+
+
+def test_camel_case_and_acronyms_are_split():
+    assert {"getembeddingsfromapi", "get", "embeddings", "api"} <= set(tokenize("getEmbeddingsFromApi"))
+    assert {"httpserver", "http", "server"} <= set(tokenize("HTTPServer"))
+
+
+def test_stopwords_and_single_letters_are_dropped():
+    assert tokenize("the self a x") == []
+    # 停用词作为标识符的组成部分时同样被丢弃
+    assert "from" not in tokenize("loadFromDisk")
+
+
+def test_cjk_is_split_into_bigrams():
+    assert tokenize("向量检索") == ["向量", "量检", "检索"]
+    assert tokenize("库") == ["库"]
+
+
+def test_empty_text_encodes_to_empty_vector():
+    assert encode_document("") == ([], [])
+    assert encode_query("the and") == ([], [])
+
+
+def test_document_term_frequency_saturates():
+    once_indices, once_values = encode_document("parser")
+    thrice_indices, thrice_values = encode_document("parser parser parser")
+    assert once_indices == thrice_indices
+    assert once_values[0] < thrice_values[0] < 3 * once_values[0]
+
+
+def test_query_and_document_share_token_indices():
+    doc_indices, _ = encode_document("def load_config(path): return parse(path)")
+    query_indices, query_values = encode_query("load_config")
+    assert query_indices == sorted(query_indices)
+    assert set(query_indices) <= set(doc_indices)
+    assert all(value == 1.0 for value in query_values)
+
+
+def test_encoding_is_deterministic():
+    assert encode_document("retrieval engine stage") == encode_document("retrieval engine stage")
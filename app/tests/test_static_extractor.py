@@ -0,0 +1,207 @@
+# app/tests/test_static_extractor.py
+
+import logging
+from pathlib import Path
+
+import pytest
+
+from app.services import static_extractor
+from app.services.static_extractor import CALLS, INHERITS_FROM, INSTANTIATES, defined_names, extract_triplets
+
+
+def _triplets(name: str, code: str) -> set:
+    result = extract_triplets(Path(name), code)
+    assert result is not None
+    return {tuple(t) for t in result}
+
+
+# --- Python (ast) ---
+
+PYTHON_CODE = '''
+class Base(object):
+    pass
+
+class Repo(Base, Generic[T]):
+    def save(self, item):
+        conn = Connection()
+        conn.execute(item)
+        validate(item)
+
+def main():
+    repo = Repo()
+    repo.save(1)
+'''
+
+
+def test_python_triplets():
+    triplets = _triplets("repo.py", PYTHON_CODE)
+    assert {
+        ("Repo", INHERITS_FROM, "Base"),
+        ("Repo", INHERITS_FROM, "Generic"),
+        ("Repo.save", INSTANTIATES, "Connection"),
+        ("Repo.save", CALLS, "execute"),
+        ("Repo.save", CALLS, "validate"),
+        ("main", INSTANTIATES, "Repo"),
+        ("main", CALLS, "save"),
+    } <= triplets
+    # object 基类不算继承关系
+    assert ("Base", INHERITS_FROM, "object") not in triplets
+
+
+def test_python_module_level_calls_use_module_name():
+    assert ("setup", CALLS, "configure") in _triplets("setup.py", "configure()\n")
+
+
+def test_python_triplets_are_deduplicated():
+    result = extract_triplets(Path("a.py"), "def f():\n    g()\n    g()\n")
+    assert result == [["f", CALLS, "g"]]
+
+
+def test_python_syntax_error_returns_none():
+    assert extract_triplets(Path("broken.py"), "def f(:\n") is None
+
+
+def test_unsupported_language_returns_none():
+    assert extract_triplets(Path("notes.md"), "# title") is None
+    assert not static_extractor.supports(Path("notes.md"))
+    assert static_extractor.supports(Path("main.py"))
+
+
+def test_parser_failure_disables_language_and_warns_once(monkeypatch, caplog):
+    def broken_get_parser(language):
+        raise TypeError("incompatible tree-sitter version")
+
+    monkeypatch.setattr(static_extractor, "get_parser", broken_get_parser)
+    monkeypatch.setattr(static_extractor, "_unavailable_languages", set())
+    with caplog.at_level(logging.WARNING, logger=static_extractor.__name__):
+        assert not static_extractor.supports(Path("main.go"))
+        assert extract_triplets(Path("main.go"), "package main") is None
+    assert len([r for r in caplog.records if "'go'" in r.getMessage()]) == 1
+
+
+# --- defined_names (检索时的片段 -> 实体映射) ---
+
+def test_defined_names_python_methods_are_qualified():
+    code = "class Repo:\n    def save(self):\n        pass\n\ndef helper():\n    pass\n"
+    assert defined_names(code) == ["Repo", "Repo.save", "save", "helper"]
+
+
+def test_defined_names_other_languages():
+    assert defined_names("export async function loadUser(id) {}") == ["loadUser"]
+    assert defined_names("func (s *Server) Start() error {") == ["Start"]
+    assert defined_names("pub fn parse(input: &str) {}\npub struct Token;") == ["parse", "Token"]
+    assert defined_names("") == []
+
+
+# --- tree-sitter ---
+
+TREE_SITTER_CASES = [
+    (
+        "dog.js",
+        """
+class Dog extends Animal {
+  bark() { return makeSound("woof"); }
+}
+function main() { const d = new Dog(); d.bark(); }
+""",
+        {
+            ("Dog", INHERITS_FROM, "Animal"),
+            ("Dog.bark", CALLS, "makeSound"),
+            ("main", INSTANTIATES, "Dog"),
+            ("main", CALLS, "bark"),
+        },
+    ),
+    (
+        "repo.ts",
+        """
+class Repo implements Store<Item> {
+  save(item: Item) { persist(item); }
+}
+""",
+        {
+            ("Repo", INHERITS_FROM, "Store"),
+            ("Repo.save", CALLS, "persist"),
+        },
+    ),
+    (
+        "server.go",
+        """
+package main
+
+type Server struct{}
+
+func (s *Server) Start() {
+	listen()
+	cfg := Config{}
+	_ = cfg
+}
+
+func main() {
+	s := &Server{}
+	s.Start()
+}
+""",
+        {
+            ("Server.Start", CALLS, "listen"),
+            ("Server.Start", INSTANTIATES, "Config"),
+            ("main", INSTANTIATES, "Server"),
+            ("main", CALLS, "Start"),
+        },
+    ),
+    (
+        "Dog.java",
+        """
+class Dog extends Animal implements Pet {
+    void bark() {
+        Sound s = new Sound();
+        s.play();
+    }
+}
+""",
+        {
+            ("Dog", INHERITS_FROM, "Animal"),
+            ("Dog", INHERITS_FROM, "Pet"),
+            ("Dog.bark", INSTANTIATES, "Sound"),
+            ("Dog.bark", CALLS, "play"),
+        },
+    ),
+    (
+        "dog.rs",
+        """
+struct Dog;
+trait Speak { fn speak(&self); }
+impl Speak for Dog {
+    fn speak(&self) { bark(); }
+}
+fn main() { let d = Dog {}; d.speak(); }
+""",
+        {
+            ("Dog", INHERITS_FROM, "Speak"),
+            ("Dog.speak", CALLS, "bark"),
+            ("main", INSTANTIATES, "Dog"),
+            ("main", CALLS, "speak"),
+        },
+    ),
+    (
+        "dog.cpp",
+        """
+class Dog : public Animal {
+public:
+    void bark() { makeSound(); }
+};
+int main() { Dog d; d.bark(); return 0; }
+""",
+        {
+            ("Dog", INHERITS_FROM, "Animal"),
+            ("Dog.bark", CALLS, "makeSound"),
+            ("main", CALLS, "bark"),
+        },
+    ),
+]
+
+
+@pytest.mark.parametrize("name, code, expected", TREE_SITTER_CASES, ids=[case[0] for case in TREE_SITTER_CASES])
+def test_tree_sitter_triplets(name, code, expected):
+    pytest.importorskip("tree_sitter_language_pack")
+    assert static_extractor.supports(Path(name))
+    assert expected <= _triplets(name, code)
@@ -0,0 +1,153 @@
+# app/tests/test_upload_service.py
+
+import asyncio
+import hashlib
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("aiofiles")
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.core.config import settings
+from app.db.session import Base
+from app.models.knowledgebase import KnowledgeBase
+from app.services import kb_service, upload_service
+from app.services.upload_service import UploadOffsetMismatch, UploadTooLarge
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    monkeypatch.setattr(kb_service, "UPLOADS_DIR", tmp_path)
+    monkeypatch.setattr(upload_service, "PARTIAL_DIR", tmp_path / "partial")
+    monkeypatch.setattr(upload_service, "_hash_states", {})
+    monkeypatch.setattr(upload_service, "_session_locks", {})
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    session.add(KnowledgeBase(id=1, name="kb", status="new"))
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+async def _stream(*chunks: bytes):
+    for chunk in chunks:
+        await asyncio.sleep(0)
+        yield chunk
+
+
+def _append(db, upload, offset, *chunks):
+    return asyncio.run(upload_service.append_chunk(db, upload, offset, _stream(*chunks)))
+
+
+def test_chunks_are_appended_and_committed(db, tmp_path):
+    upload = upload_service.create_session(db, 1, "repo.zip", total_size=6)
+    _append(db, upload, 0, b"abc")
+    _append(db, upload, 3, b"de", b"f")
+    assert upload.received == 6
+
+    kb = asyncio.run(upload_service.commit_upload(db, upload, expected_sha256=hashlib.sha256(b"abcdef").hexdigest()))
+    assert (tmp_path / "kb_1_repo.zip").read_bytes() == b"abcdef"
+    assert kb.source_content_hash == hashlib.sha256(b"abcdef").hexdigest()
+    assert upload.status == "completed"
+    assert not upload_service._partial_path(upload.id).exists()
+
+
+def test_offset_mismatch_reports_server_offset(db):
+    upload = upload_service.create_session(db, 1, "a.txt", total_size=None)
+    _append(db, upload, 0, b"abc")
+    with pytest.raises(UploadOffsetMismatch) as exc:
+        _append(db, upload, 0, b"abc")
+    assert exc.value.expected_offset == 3
+
+
+def test_chunk_beyond_declared_size_is_rejected(db, monkeypatch):
+    upload = upload_service.create_session(db, 1, "a.txt", total_size=4)
+    with pytest.raises(UploadTooLarge):
+        _append(db, upload, 0, b"abc", b"de")
+    # 超限的分块不推进 offset
+    assert upload_service.get_session(db, 1, upload.id).received == 0
+
+    monkeypatch.setattr(settings, "UPLOAD_MAX_BYTES", 2)
+    with pytest.raises(UploadTooLarge):
+        upload_service.create_session(db, 1, "b.txt", total_size=3)
+
+
+def test_resume_after_interrupted_chunk_and_lost_hash_state(db, tmp_path):
+    upload = upload_service.create_session(db, 1, "a.txt", total_size=None)
+    _append(db, upload, 0, b"abc")
+    # 中断的分块在部分文件里留下残留字节；进程重启丢失了增量哈希状态
+    with upload_service._partial_path(upload.id).open("ab") as f:
+        f.write(b"garbage")
+    upload_service._hash_states.clear()
+
+    _append(db, upload, 3, b"def")
+    asyncio.run(upload_service.commit_upload(db, upload, expected_sha256=hashlib.sha256(b"abcdef").hexdigest()))
+    assert (tmp_path / "kb_1_a.txt").read_bytes() == b"abcdef"
+
+
+def test_commit_drops_bytes_of_interrupted_chunk(db, tmp_path):
+    upload = upload_service.create_session(db, 1, "a.txt", total_size=None)
+    _append(db, upload, 0, b"abc")
+    with upload_service._partial_path(upload.id).open("ab") as f:
+        f.write(b"garbage")
+    kb = asyncio.run(upload_service.commit_upload(db, upload))
+    assert (tmp_path / "kb_1_a.txt").read_bytes() == b"abc"
+    assert kb.source_content_hash == hashlib.sha256(b"abc").hexdigest()
+
+
+def test_checksum_mismatch_keeps_session_resumable(db):
+    upload = upload_service.create_session(db, 1, "a.txt", total_size=None)
+    _append(db, upload, 0, b"abc")
+    with pytest.raises(ValueError, match="Checksum mismatch"):
+        asyncio.run(upload_service.commit_upload(db, upload, expected_sha256="0" * 64))
+    db.refresh(upload)
+    assert upload.status == "uploading"
+    _append(db, upload, 3, b"d")
+    assert upload.received == 4
+
+
+def test_incomplete_upload_cannot_be_committed(db):
+    upload = upload_service.create_session(db, 1, "a.txt", total_size=10)
+    _append(db, upload, 0, b"abc")
+    with pytest.raises(ValueError, match="incomplete"):
+        asyncio.run(upload_service.commit_upload(db, upload))
+
+
+def test_commit_waits_for_in_flight_append_and_rejects_later_writes(db, tmp_path):
+    upload = upload_service.create_session(db, 1, "a.txt", total_size=None)
+
+    async def run():
+        append = asyncio.create_task(upload_service.append_chunk(db, upload, 0, _stream(b"ab", b"cd", b"ef")))
+        await asyncio.sleep(0)
+        commit = asyncio.create_task(upload_service.commit_upload(db, upload))
+        await append
+        await commit
+        with pytest.raises(ValueError, match="completed"):
+            await upload_service.append_chunk(db, upload, 6, _stream(b"gh"))
+
+    asyncio.run(run())
+    assert (tmp_path / "kb_1_a.txt").read_bytes() == b"abcdef"
+    assert upload.content_hash == hashlib.sha256(b"abcdef").hexdigest()
+
+
+def test_concurrent_commits_move_the_file_once(db):
+    upload = upload_service.create_session(db, 1, "a.txt", total_size=None)
+    _append(db, upload, 0, b"abc")
+
+    async def run():
+        return await asyncio.gather(
+            upload_service.commit_upload(db, upload),
+            upload_service.commit_upload(db, upload),
+            return_exceptions=True
+        )
+
+    first, second = asyncio.run(run())
+    assert isinstance(first, KnowledgeBase)
+    assert isinstance(second, ValueError)
+    assert "completed" in str(second)
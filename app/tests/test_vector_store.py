@@ -0,0 +1,108 @@
+# app/tests/test_vector_store.py
+
+import pytest
+
+pytest.importorskip("qdrant_client")
+
+from qdrant_client import QdrantClient, models
+
+from app.services import vector_store
+
+# 本地模式 (":memory:") 不使用 payload 索引，只验证过滤语义
+pytestmark = pytest.mark.filterwarnings("ignore:Payload indexes have no effect")
+
+
+def _shared_collection(dimension: int = 4) -> tuple:
+    qdrant = QdrantClient(":memory:")
+    name = vector_store.shared_collection_name(7)
+    vector_store.ensure_shared_collection(qdrant, name, dimension)
+    return qdrant, name
+
+
+def _add_points(qdrant: QdrantClient, name: str, kb_id: int, count: int, offset: int = 0) -> None:
+    qdrant.upsert(name, points=[
+        vector_store.make_point(
+            offset + i, [1.0, float(i), 0.0, 0.0], f"kb {kb_id} chunk {i}",
+            {"text": f"kb {kb_id} chunk {i}", vector_store.KB_ID_KEY: vector_store.kb_id_value(kb_id)}
+        )
+        for i in range(count)
+    ])
+
+
+def test_shared_collection_keeps_global_graph_and_per_kb_graphs():
+    hnsw = vector_store._collection_kwargs(8, None, shared=True)["hnsw_config"]
+    default = vector_store.get_storage_profile()
+    assert hnsw.m == default.hnsw_m > 0
+    assert hnsw.payload_m == default.hnsw_m
+
+
+def test_shared_collection_indexes_kb_id_as_tenant():
+    calls = []
+
+    class FakeQdrant:
+        def collection_exists(self, name):
+            return False
+
+        def create_collection(self, collection_name, **kwargs):
+            pass
+
+        def create_payload_index(self, collection_name, field_name, field_schema):
+            calls.append((field_name, field_schema))
+
+    vector_store.ensure_shared_collection(FakeQdrant(), "kb_shared_1", 8)
+    [(field_name, schema)] = calls
+    assert field_name == vector_store.KB_ID_KEY
+    assert isinstance(schema, models.KeywordIndexParams)
+    assert schema.is_tenant
+
+
+def test_existing_shared_collection_without_global_graph_is_upgraded():
+    updates = []
+
+    class FakeQdrant:
+        def collection_exists(self, name):
+            return True
+
+        def get_collection(self, name):
+            return models.CollectionInfo.model_construct(config=models.CollectionConfig.model_construct(
+                params=models.CollectionParams.model_construct(vectors=models.VectorParams(size=8, distance=models.Distance.COSINE)),
+                hnsw_config=models.HnswConfig.model_construct(m=0, payload_m=16)
+            ))
+
+        def update_collection(self, collection_name, hnsw_config):
+            updates.append(hnsw_config)
+
+        def create_payload_index(self, collection_name, field_name, field_schema):
+            pass
+
+    vector_store.ensure_shared_collection(FakeQdrant(), "kb_shared_1", 8)
+    assert [u.m for u in updates] == [vector_store.get_storage_profile().hnsw_m]
+
+
+def test_scope_filter_only_applies_to_shared_collections():
+    assert vector_store.scope_filter("kb_3", [3]) is None
+    condition = vector_store.scope_filter("kb_shared_1", [3, 4]).must[0]
+    assert condition.key == vector_store.KB_ID_KEY
+    assert condition.match.any == ["3", "4"]
+
+
+def test_multi_kb_search_in_shared_collection():
+    qdrant, name = _shared_collection()
+    _add_points(qdrant, name, kb_id=1, count=3)
+    _add_points(qdrant, name, kb_id=2, count=3, offset=10)
+    _add_points(qdrant, name, kb_id=3, count=3, offset=20)
+
+    points = qdrant.query_points(
+        name, query=[1.0, 0.0, 0.0, 0.0], query_filter=vector_store.scope_filter(name, [1, 3]), limit=10, with_payload=True
+    ).points
+    assert {p.payload[vector_store.KB_ID_KEY] for p in points} == {"1", "3"}
+    assert len(points) == 6
+
+
+def test_delete_kb_vectors_only_removes_that_kb_from_shared_collection():
+    qdrant, name = _shared_collection()
+    _add_points(qdrant, name, kb_id=1, count=2)
+    _add_points(qdrant, name, kb_id=2, count=2, offset=10)
+    vector_store.delete_kb_vectors(qdrant, name, 1)
+    records, _ = qdrant.scroll(name, limit=10, with_payload=True)
+    assert {r.payload[vector_store.KB_ID_KEY] for r in records} == {"2"}
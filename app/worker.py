@@ -0,0 +1,123 @@
+# app/worker.py
+"""
+摄取 worker 进程，独立于 API 进程运行:
+
+    python -m app.worker
+
+从 ingestion_jobs 表租约式领取任务，每个进程最多同时执行
+INGESTION_WORKER_CONCURRENCY 个任务。可以启动多个 worker 进程/容器。
+"""
+import logging
+import os
+import signal
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from app.db.session import SessionLocal, init_db
+from app.core.config import settings
+from app.crud import crud_ingestion_job
+from app.services import job_queue, graph_store
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("app.worker")
+
+
+class IngestionWorker:
+    def __init__(self, concurrency: int):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.concurrency = max(1, concurrency)
+        self._stop = threading.Event()
+
+    def stop(self, *_):
+        if not self._stop.is_set():
+            logger.info(f"Worker {self.worker_id} stopping after running jobs finish...")
+        self._stop.set()
+
+    def _heartbeat(self, job_id: int, owner: str, done: threading.Event, lease_lost: threading.Event):
+        """
+        周期性续约。租约已被回收 (任务可能已重新排队并由其他 worker 领取) 时置位 lease_lost，
+        管道在下一次更新状态时停止，且不再写 KB 状态或结算任务。
+        """
+        while not done.wait(settings.INGESTION_JOB_HEARTBEAT_SECONDS):
+            db = SessionLocal()
+            try:
+                if not crud_ingestion_job.extend_lease(db, job_id, owner, settings.INGESTION_JOB_LEASE_SECONDS):
+                    logger.warning(f"[Job {job_id}] Lease lost by {owner}, cancelling the running pipeline.")
+                    lease_lost.set()
+                    return
+            except Exception as e:
+                logger.warning(f"[Job {job_id}] Heartbeat failed: {e}")
+                db.rollback()
+            finally:
+                db.close()
+
+    def _run_slot(self, slot: int):
+        owner = f"{self.worker_id}#{slot}"
+        while not self._stop.is_set():
+            db = SessionLocal()
+            try:
+                job_queue.reclaim_expired_jobs(db)
+                job = crud_ingestion_job.lease_next_job(db, owner, settings.INGESTION_JOB_LEASE_SECONDS)
+                job_id = job.id if job else None
+            except Exception as e:
+                logger.error(f"[{owner}] Failed to lease job: {e}")
+                db.rollback()
+                job_id = None
+            finally:
+                db.close()
+
+            if job_id is None:
+                self._stop.wait(settings.INGESTION_WORKER_POLL_SECONDS)
+                continue
+
+            logger.info(f"[{owner}] Leased job {job_id}.")
+            done = threading.Event()
+            lease_lost = threading.Event()
+            heartbeat = threading.Thread(target=self._heartbeat, args=(job_id, owner, done, lease_lost), daemon=True)
+            heartbeat.start()
+            try:
+                error = job_queue.execute_job(job_id, cancel_event=lease_lost)
+            finally:
+                done.set()
+                heartbeat.join()
+            job_queue.finalize_job(job_id, owner, error)
+
+    def run(self):
+        logger.info(f"Ingestion worker {self.worker_id} started with {self.concurrency} slot(s).")
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="ingest") as pool:
+            for slot in range(self.concurrency):
+                pool.submit(self._run_slot, slot)
+        logger.info(f"Ingestion worker {self.worker_id} stopped.")
+
+
+def main():
+    init_db()
+    db = SessionLocal()
+    try:
+        recovered = job_queue.recover_orphaned_kbs(db)
+        if recovered:
+            logger.info(f"Recovered {recovered} orphaned knowledge base(s).")
+    finally:
+        db.close()
+
+    db = SessionLocal()
+    try:
+        imported = graph_store.import_legacy_graphs(db)
+        if imported:
+            logger.info(f"Indexed {imported} legacy knowledge graph(s).")
+    except Exception as e:
+        logger.error(f"Failed to index legacy knowledge graphs: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+    worker = IngestionWorker(settings.INGESTION_WORKER_CONCURRENCY)
+    signal.signal(signal.SIGINT, worker.stop)
+    signal.signal(signal.SIGTERM, worker.stop)
+    worker.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -19,14 +19,26 @@ if (-not (Get-Command python -ErrorAction SilentlyContinue)) {
     exit 1
 }
 
+# --- 启动摄取 worker (知识库解析任务由它执行) ---
+Write-Host "   正在后台启动摄取 worker..."
+$worker = Start-Process python -ArgumentList "-m", "app.worker" -NoNewWindow -PassThru
+
 # --- 启动 FastAPI 应用 ---
 Write-Host "   服务器运行于 http://127.0.0.1:8000 (按 CTRL+C 停止)"
 
 # 使用 --reload-dir 参数明确告诉 uvicorn 只监视 'app' 文件夹。
-python -m uvicorn app.main:app --reload --reload-dir ./app
+try {
+    python -m uvicorn app.main:app --reload --reload-dir ./app
+}
+finally {
+    # 服务器停止后一并停止 worker (未完成的任务租约过期后会按重试规则重新排队)
+    if (-not $worker.HasExited) {
+        Stop-Process -Id $worker.Id -ErrorAction SilentlyContinue
+    }
+}
 
 # 服务器停止后的清理信息
 Write-Host ""
-Write-Host "✅ FastAPI 应用已停止。" -ForegroundColor Green
+Write-Host "✅ FastAPI 应用与摄取 worker 已停止。" -ForegroundColor Green
 Write-Host "   提示: Qdrant 数据库仍在后台运行。"
 Write-Host "   如需停止数据库，请运行 .\stop-dev.ps1"